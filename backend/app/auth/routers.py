@@ -3,8 +3,10 @@ from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 
-from db import SessionDep
-from .utils import get_current_user, admin_required, create_access_token, verify_password
+from db import SessionDep, run_db
+from .utils import (
+    get_current_user, authenticate_user, admin_required, create_access_token, get_password_hash_async, user_cache
+)
 from .models import User, UserRequest, Token
 from .user_crud import create_user
 
@@ -28,7 +30,8 @@ async def create_new_user(
     Returns:
         User: The created user object.
     """
-    return create_user(user, session)
+    hashed_password = await get_password_hash_async(user.password)
+    return await run_db(session, create_user, user, hashed_password=hashed_password)
 
 
 @auth_router.get("/users/me")
@@ -44,6 +47,16 @@ async def read_users_me(current_user: Annotated[User, Depends(get_current_user)]
     return current_user
 
 
+@auth_router.get("/cache_stats", dependencies=[Depends(admin_required)])
+async def read_user_cache_stats():
+    """Retrieve the size and hit/miss counters of the authenticated user cache. Restricted to Admin users.
+
+    Returns:
+        dict: The user cache statistics.
+    """
+    return user_cache.stats()
+
+
 @auth_router.post("/token")
 async def login(session: SessionDep, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token:
     """Generate and return an access token for the user.
@@ -54,18 +67,19 @@ async def login(session: SessionDep, form_data: Annotated[OAuth2PasswordRequestF
 
     Raises:
         HTTPException: If the credentials are incorrect, an unauthorized error is raised.
+            If the password pool is saturated, a 503 error is raised.
 
     Returns:
         Token: The generated access token and its type.
     """
-    user = session.query(User).filter(User.username == form_data.username).first()
+    username = await authenticate_user(session, form_data.username, form_data.password)
 
-    if not verify_password(form_data.password, user.hashed_password):
+    if username is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.username})
+    access_token = create_access_token(data={"sub": username})
 
     return Token(access_token=access_token, token_type="bearer")
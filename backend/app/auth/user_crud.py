@@ -1,16 +1,19 @@
+from typing import Optional
+
 from fastapi import HTTPException
 from sqlmodel import Session
 
 from .models import UserRequest, User
-from .utils import get_password_hash
+from .utils import get_password_hash, user_cache
 
 
-def create_user(user: UserRequest, session: Session):
+def create_user(user: UserRequest, session: Session, hashed_password: Optional[str] = None):
     """Create a new user in the database.
 
     Args:
         user (UserRequest): The user data containing the username and password.
         session (Session): The SQLModel database session to interact with the database.
+        hashed_password (Optional[str]): The already hashed password, hashed here if not given.
 
     Returns:
         dict: A dictionary containing a success message and the new user's ID.
@@ -19,11 +22,13 @@ def create_user(user: UserRequest, session: Session):
         HTTPException: If an error occurs while creating the user, a 400 error is raised.
     """
     try:
-        hashed_password = get_password_hash(user.password)
+        if hashed_password is None:
+            hashed_password = get_password_hash(user.password)
         new_user = User(username=user.username, hashed_password=hashed_password)
         session.add(new_user)
         session.commit()
         session.refresh(new_user)  # Refresh to get the latest data
+        user_cache.invalidate(new_user.username)
         return {"message": "User created successfully", "user_id": new_user.id}
     except Exception as e:
         session.rollback()  # Rollback if error occurs
@@ -1,15 +1,21 @@
+import asyncio
 import os
+import threading
+import time
 import jwt
-from typing import Annotated
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Annotated, Optional, Tuple
 from datetime import datetime, timedelta, timezone
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, WebSocket, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session
+from sqlmodel import Session, select
 from jwt.exceptions import InvalidTokenError
 from passlib.context import CryptContext
 
-from db import engine
+from db import engine, SessionDep, run_db
 from .models import User, Role
 
 # OAuth2 password bearer for token authentication
@@ -24,6 +30,96 @@ SECRET_KEY = os.getenv("SECRET_KEY", "secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 5
 
+# Password hashing runs in a dedicated pool; requests beyond the queue depth are rejected
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 0)) or max(1, (os.cpu_count() or 1) // 2)
+PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv("PASSWORD_HASH_QUEUE_DEPTH", 32))
+# Niceness of the hashing threads, so the event loop thread wins the CPU whenever it has work
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", 19))
+
+
+def _lower_thread_priority():
+    """Lower the scheduling priority of the calling pool thread (Linux schedules threads individually)."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PASSWORD_HASH_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+# Hash of a random password, verified for unknown usernames so they take as long as known ones
+DUMMY_PASSWORD_HASH = "$2b$12$CnsSFBbY9wBmAFJ6gfgJOeWe.qOwP3318SikI0beD046KDFwThBQK"
+
+password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash", initializer=_lower_thread_priority
+)
+_password_tasks = 0
+_password_tasks_lock = threading.Lock()
+
+# Authenticated user cache configuration
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+
+
+class UserCache:
+    """TTL-bounded LRU cache of authenticated users, keyed by token subject.
+
+    The cache is local to each worker process. Users changed through user_crud
+    are invalidated in the process that changed them; other processes see the
+    change once the entry expires.
+
+    Attributes:
+        max_size (int): The maximum number of cached users.
+        ttl (float): The number of seconds a user stays cached.
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups that had to query the database.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[User]:
+        """Return the cached user with this username, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(username, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user: User):
+        """Cache a detached copy of a user, evicting the least recently used entry if full."""
+        if self.max_size <= 0:
+            return
+        snapshot = User(id=user.id, username=user.username, hashed_password=user.hashed_password, role=user.role)
+        with self._lock:
+            self._entries[user.username] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(user.username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None):
+        """Drop a user from the cache, or every user if no username is given."""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+    def stats(self) -> dict:
+        """Return the size of the cache and its hit and miss counters."""
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache()
+
 
 def verify_password(plain_password, hashed_password):
     """Verify that a plain password matches the hashed password.
@@ -50,6 +146,74 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+@contextmanager
+def password_slot():
+    """Reserve a place in the password pool, failing fast when the pool is saturated.
+
+    Raises:
+        HTTPException: If PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_DEPTH
+            operations are already in flight, a 503 error is raised.
+    """
+    global _password_tasks
+
+    with _password_tasks_lock:
+        if _password_tasks >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_DEPTH:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent authentication requests",
+                headers={"Retry-After": "1"},
+            )
+        _password_tasks += 1
+
+    try:
+        yield
+    finally:
+        with _password_tasks_lock:
+            _password_tasks -= 1
+
+
+async def _run_password_task(function, *args):
+    """Run a bcrypt operation in the password pool, failing fast when the pool is saturated.
+
+    Args:
+        function: The blocking password function to run.
+        *args: Arguments passed to the function.
+
+    Raises:
+        HTTPException: If the pool is saturated, a 503 error is raised.
+
+    Returns:
+        The return value of the function.
+    """
+    with password_slot():
+        return await asyncio.get_running_loop().run_in_executor(password_executor, function, *args)
+
+
+async def verify_password_async(plain_password, hashed_password):
+    """Verify a password in the password pool without blocking the event loop.
+
+    Args:
+        plain_password (str): The plain text password to verify.
+        hashed_password (str): The hashed password to compare against.
+
+    Returns:
+        bool: True if the passwords match, otherwise False.
+    """
+    return await _run_password_task(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    """Hash a password in the password pool without blocking the event loop.
+
+    Args:
+        password (str): The plain text password to hash.
+
+    Returns:
+        str: The hashed password.
+    """
+    return await _run_password_task(get_password_hash, password)
+
+
 def create_access_token(data: dict, expire_delta: int = ACCESS_TOKEN_EXPIRE_MINUTES):
     """Create a JWT access token with an expiration time.
 
@@ -67,11 +231,74 @@ def create_access_token(data: dict, expire_delta: int = ACCESS_TOKEN_EXPIRE_MINU
     return encoded_jwt
 
 
-async def get_current_user(token: OAuthDep):
-    """Retrieve the current user from the database based on the provided token.
+def get_user_by_username(session: Session, username: str) -> Optional[User]:
+    """Retrieve a user by username.
+
+    Args:
+        session (Session): The SQLModel database session.
+        username (str): The username to look up.
+
+    Returns:
+        Optional[User]: The matching user, or None if there is none.
+    """
+    return session.exec(select(User).where(User.username == username)).first()
+
+
+def get_credentials(session: Session, username: str) -> Tuple[Optional[str], Optional[str]]:
+    """Retrieve a user's username and password hash, then release the database connection.
+
+    The login route waits for the password pool after this lookup, and must not
+    hold a pooled connection while it does.
+
+    Args:
+        session (Session): The SQLModel database session.
+        username (str): The username to look up.
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: The username and hashed password, or (None, None) if there is no such user.
+    """
+    user = get_user_by_username(session, username)
+    credentials = (user.username, user.hashed_password) if user else (None, None)
+    session.rollback()
+    return credentials
+
+
+async def authenticate_user(session: SessionDep, username: str, password: str) -> Optional[str]:
+    """Check a username and password without blocking the event loop.
+
+    The place in the password pool is reserved before the user lookup, so
+    logins shed with a 503 during a storm cost no database work. Unknown
+    usernames are verified against DUMMY_PASSWORD_HASH, so the response time
+    does not reveal which usernames exist.
+
+    Args:
+        session (SessionDep): The database session dependency.
+        username (str): The submitted username.
+        password (str): The submitted password.
+
+    Raises:
+        HTTPException: If the password pool is saturated, a 503 error is raised.
+
+    Returns:
+        Optional[str]: The username if the credentials are valid, otherwise None.
+    """
+    with password_slot():
+        found, hashed_password = await run_db(session, get_credentials, username=username)
+        valid = await asyncio.get_running_loop().run_in_executor(
+            password_executor, verify_password, password, hashed_password or DUMMY_PASSWORD_HASH
+        )
+    return found if found is not None and valid else None
+
+
+async def get_current_user(token: OAuthDep, session: SessionDep):
+    """Retrieve the current user based on the provided token.
+
+    Users are served from user_cache when possible. Otherwise they are loaded
+    with the request's own database session and cached.
 
     Args:
         token (str): The JWT token for user authentication.
+        session (SessionDep): The database session dependency.
 
     Raises:
         HTTPException: If the token is invalid or the user cannot be found.
@@ -92,13 +319,17 @@ async def get_current_user(token: OAuthDep):
     except InvalidTokenError:
         raise credentials_exception
 
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+
     # Retrieve the user from the database
-    with Session(engine) as session:
-        user = session.query(User).filter(User.username == username).first()
+    user = await run_db(session, get_user_by_username, username=username)
 
     if user is None:
         raise credentials_exception
 
+    user_cache.put(user)
     return user
 
 
@@ -144,6 +375,65 @@ async def user_required(current_user: Annotated[User, Depends(get_current_user)]
     return await role_required(current_user, Role.USER)
 
 
+# Subprotocol announcing that the next offered subprotocol is the JWT, e.g. ["bearer", "<token>"]
+WEBSOCKET_TOKEN_PROTOCOL = "bearer"
+
+
+def websocket_token(websocket: WebSocket) -> Optional[str]:
+    """
+    Read the JWT of a WebSocket handshake.
+
+    Browsers cannot set headers on a WebSocket handshake, but they can offer
+    subprotocols, so the token is read from the Authorization header or from
+    the subprotocol following WEBSOCKET_TOKEN_PROTOCOL. Unlike a query
+    parameter, neither ends up in access logs.
+
+    Args:
+        websocket (WebSocket): The WebSocket being opened.
+
+    Returns:
+        Optional[str]: The token, or None if the client sent none.
+    """
+    scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return token
+
+    subprotocols = websocket.scope.get("subprotocols", [])
+    if WEBSOCKET_TOKEN_PROTOCOL in subprotocols[:-1]:
+        return subprotocols[subprotocols.index(WEBSOCKET_TOKEN_PROTOCOL) + 1]
+    return None
+
+
+def websocket_subprotocol(websocket: WebSocket) -> Optional[str]:
+    """Return the subprotocol to accept: WEBSOCKET_TOKEN_PROTOCOL if the client offered it, never the token."""
+    return WEBSOCKET_TOKEN_PROTOCOL if WEBSOCKET_TOKEN_PROTOCOL in websocket.scope.get("subprotocols", []) else None
+
+
+async def websocket_user_required(websocket: WebSocket, session: SessionDep):
+    """Ensure the client opening a WebSocket is a regular user.
+
+    The JWT is read by websocket_token.
+
+    Args:
+        websocket (WebSocket): The WebSocket being opened.
+        session (SessionDep): The database session dependency.
+
+    Raises:
+        WebSocketException: If the token is missing or invalid, or the user does not have the user role.
+
+    Returns:
+        User: The authenticated user.
+    """
+    token = websocket_token(websocket)
+    if token is None:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Not authenticated")
+
+    try:
+        return await user_required(await get_current_user(token, session))
+    except HTTPException as exc:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=exc.detail)
+
+
 def initialize_admin_user():
     """Initialize the admin user if none exists
     """
@@ -157,8 +447,10 @@ def initialize_admin_user():
             user = User(username=username, hashed_password=hashed_password, role=Role.ADMIN)
             session.add(user)
             session.commit()
+            user_cache.invalidate(username)
 
 
 # Dependency aliases for user roles
 UserRequired = Annotated[User, Depends(user_required)]
 AdminRequired = Annotated[User, Depends(admin_required)]
+WebSocketUserRequired = Annotated[User, Depends(websocket_user_required)]
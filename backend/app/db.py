@@ -1,12 +1,47 @@
 import os
-from typing import Annotated
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Annotated, Union
 
 from fastapi import Depends
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from metrics import InstrumentedQueuePool, instrument_engine
 
 # Database configuration
 database_url = os.getenv("DATABASE_URL")
-engine = create_engine(database_url)
+engine = create_engine(database_url, poolclass=InstrumentedQueuePool)
+instrument_engine(engine, "sync")
+
+# "sync" serves requests with blocking sessions in the threadpool, "async" with asyncpg sessions, on which the
+# hot reads run natively and other CRUD functions run on the event loop (see run_db)
+DB_MODE = os.getenv("DB_MODE", "sync")
+
+
+def get_async_database_url(url: str) -> str:
+    """
+    Derive the asyncpg URL of a PostgreSQL database URL.
+
+    Args:
+        url (str): The synchronous database URL.
+
+    Returns:
+        str: The same URL using the asyncpg driver.
+    """
+    return make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+
+# Profile of the current request, set by the profiling middleware when an admin opts in
+active_profile: ContextVar = ContextVar("active_profile", default=None)
+
+async_engine = None
+if DB_MODE == "async":
+    async_engine = create_async_engine(os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(database_url))
+    instrument_engine(async_engine.sync_engine, "async")
 
 
 def create_db_and_tables():
@@ -19,7 +54,39 @@ def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
 
 
-def get_session():
+def _warm_pool():
+    connections = [engine.connect() for _ in range(engine.pool.size())]
+    try:
+        for connection in connections:
+            connection.exec_driver_sql("SELECT 1")
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def warm_pools():
+    """
+    Open every connection of the database pools ahead of the first requests.
+
+    Raises:
+        Exception: Any error raised while connecting to the database.
+
+    Returns:
+        None
+    """
+    await run_in_threadpool(_warm_pool)
+
+    if async_engine is not None:
+        connections = [await async_engine.connect() for _ in range(async_engine.pool.size())]
+        try:
+            for connection in connections:
+                await connection.exec_driver_sql("SELECT 1")
+        finally:
+            for connection in connections:
+                await connection.close()
+
+
+def get_sync_session():
     """
     Yields a database session for use in database operations.
 
@@ -30,5 +97,93 @@ def get_session():
         yield session
 
 
+async def get_async_session():
+    """
+    Yields an asynchronous database session for use in database operations.
+
+    Yields:
+        AsyncSession: An asynchronous database session object.
+    """
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+# The session dependency matching the configured DB_MODE
+get_session = get_async_session if DB_MODE == "async" else get_sync_session
+
+
+def async_variant(variant):
+    """
+    Register a native coroutine as the AsyncSession variant of a database function.
+
+    Args:
+        variant: The coroutine function, taking the same arguments as the decorated function.
+
+    Returns:
+        A decorator attaching the variant to the function, for run_db.
+    """
+    def register(function):
+        function.async_variant = variant
+        return function
+    return register
+
+
+async def run_db(session: Union[Session, AsyncSession], function, *args, **kwargs):
+    """
+    Await a synchronous database function.
+
+    With a Session the function runs in the threadpool, so neither its queries
+    nor its Python work block the event loop. With an AsyncSession, a function
+    registered with an ``async_variant`` (the hot reads: listing pages and
+    signal windows) is awaited natively: its queries run on the async driver
+    and its CPU work, such as decoding signals, in the threadpool. Any other
+    function runs through ``run_sync`` on the event loop thread, where its
+    Python work holds the event loop until it returns. The function receives
+    the session as its ``session`` keyword argument, so the CRUD functions are
+    shared by both modes.
+
+    Args:
+        session (Union[Session, AsyncSession]): The request's database session.
+        function: The database function to call, e.g. a CRUD function.
+        *args: Positional arguments passed to the function.
+        **kwargs: Keyword arguments passed to the function.
+
+    Returns:
+        The return value of the function.
+    """
+    if isinstance(session, AsyncSession):
+        variant = getattr(function, "async_variant", None)
+        if variant is not None:
+            return await variant(*args, session=session, **kwargs)
+        return await session.run_sync(lambda sync_session: function(*args, session=sync_session, **kwargs))
+
+    profile = active_profile.get()
+    if profile is not None:
+        # The request's own profiler only sees the event loop thread
+        return await run_in_threadpool(profile.call, function, *args, session=session, **kwargs)
+    return await run_in_threadpool(function, *args, session=session, **kwargs)
+
+
+@contextmanager
+def sync_session_for(session: Union[Session, AsyncSession]):
+    """
+    Provide a synchronous session for work that must run outside ``run_db``.
+
+    Returns the request's own session in sync mode and a new session from
+    the synchronous engine in async mode.
+
+    Args:
+        session (Union[Session, AsyncSession]): The request's database session.
+
+    Yields:
+        Session: A synchronous database session.
+    """
+    if isinstance(session, AsyncSession):
+        with Session(engine) as sync_session:
+            yield sync_session
+    else:
+        yield session
+
+
 # Dependency for injecting a database session into routes or functions
-SessionDep = Annotated[Session, Depends(get_session)]
+SessionDep = Annotated[Union[Session, AsyncSession], Depends(get_session)]
@@ -0,0 +1,279 @@
+import os
+import time
+from functools import cached_property
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from .codec import lead_signal
+from .models import Lead
+from .utils import count_zero_crossings_matrix
+
+# Bump whenever the output of analyze_leads changes so stored insights are recomputed
+INSIGHTS_VERSION = 3
+
+# Samples per second of the stored signals
+ECG_SAMPLING_RATE = int(os.getenv("ECG_SAMPLING_RATE", 500))
+
+# Shortest plausible RR interval (s), i.e. a heart rate of at most 240 bpm
+REFRACTORY_SECONDS = 0.25
+
+# Signal quality thresholds, in signal units or as fractions of the lead's samples
+FLAT_PEAK_TO_PEAK = 10
+CLIPPED_FRACTION = 0.01
+NOISE_RATIO = 0.5
+MIN_SECONDS = 2
+
+# Key of the per-metric compute times in the insights
+COMPUTE_TIME_KEY = "compute_ms"
+
+
+class SignalBatch:
+    """The signals of all leads of an ECG, stacked once and shared by every metric.
+
+    Metrics that only need per-lead reductions (mean, extrema) share them,
+    computed on first use. Everything else is computed one lead at a time on
+    its unpadded row, so at most one lead is ever converted to float64 and no
+    (leads, samples) intermediate besides the int32 matrix is kept alive.
+
+    Attributes:
+        identifiers (List[str]): The lead identifiers, in row order.
+        matrix (np.ndarray): A (leads, samples) int32 array, right-padded with zeros.
+        lengths (np.ndarray): The number of samples of each lead.
+        sampling_rate (int): The number of samples per second.
+    """
+
+    def __init__(self, identifiers: List[str], signals: Sequence[np.ndarray], sampling_rate: int = None):
+        self.identifiers = identifiers
+        self.lengths = np.array([len(signal) for signal in signals], dtype=np.int64)
+        self.matrix = np.zeros((len(signals), int(self.lengths.max(initial=0))), dtype=np.int32)
+        for row, signal in enumerate(signals):
+            self.matrix[row, :len(signal)] = signal
+        self.sampling_rate = sampling_rate or ECG_SAMPLING_RATE
+
+    @classmethod
+    def from_leads(cls, leads: Sequence[Lead], sampling_rate: int = None) -> "SignalBatch":
+        """Stack the leads of an ECG, whichever storage format they use."""
+        return cls([lead.identifier for lead in leads], [lead_signal(lead) for lead in leads], sampling_rate)
+
+    def rows(self) -> Iterator[np.ndarray]:
+        """Yield the samples of each lead without its padding, as int32 views of the matrix."""
+        for row, length in zip(self.matrix, self.lengths.tolist()):
+            yield row[:length]
+
+    @cached_property
+    def mean(self) -> np.ndarray:
+        return np.array([row.mean(dtype=np.float64) if len(row) else np.nan for row in self.rows()])
+
+    @cached_property
+    def minimum(self) -> np.ndarray:
+        return np.array([row.min() if len(row) else np.inf for row in self.rows()], dtype=np.float64)
+
+    @cached_property
+    def maximum(self) -> np.ndarray:
+        return np.array([row.max() if len(row) else -np.inf for row in self.rows()], dtype=np.float64)
+
+    def per_lead(self, values: Sequence, empty=None) -> dict:
+        """Map each lead identifier to its value, or to ``empty`` for leads without samples."""
+        return {
+            identifier: value if length else empty
+            for identifier, value, length in zip(self.identifiers, values, self.lengths.tolist())
+        }
+
+
+# Registry of the insight metrics, by name
+METRICS: Dict[str, Callable[[SignalBatch], dict]] = {}
+
+
+def register_metric(name: str):
+    """
+    Register an insight metric computed from a SignalBatch.
+
+    Args:
+        name (str): The key of the metric in the insights and in the metrics query parameter.
+
+    Returns:
+        Callable: A decorator registering the function.
+    """
+    def decorator(function: Callable[[SignalBatch], dict]):
+        METRICS[name] = function
+        return function
+    return decorator
+
+
+@register_metric("zero_crossings")
+def zero_crossings(batch: SignalBatch) -> dict:
+    """The number of strict zero crossings of each lead."""
+    return batch.per_lead(count_zero_crossings_matrix(batch.matrix).tolist(), empty=0)
+
+
+@register_metric("stats")
+def stats(batch: SignalBatch) -> dict:
+    """The minimum, maximum, mean and root mean square of each lead."""
+    rms = np.array([np.sqrt(np.square(row, dtype=np.float64).mean()) if len(row) else np.nan for row in batch.rows()])
+
+    rows = zip(batch.minimum.tolist(), batch.maximum.tolist(), batch.mean.tolist(), rms.tolist(),
+               batch.lengths.tolist())
+    return batch.per_lead([
+        {"min": int(minimum), "max": int(maximum), "mean": mean, "rms": root} if length else None
+        for minimum, maximum, mean, root, length in rows
+    ])
+
+
+def _window_means(row: np.ndarray, window: int) -> np.ndarray:
+    """Mean of every full window of a lead."""
+    number_of_windows = len(row) // window
+    return row[:number_of_windows * window].reshape(number_of_windows, window).mean(axis=1, dtype=np.float64)
+
+
+@register_metric("baseline_wander")
+def baseline_wander(batch: SignalBatch) -> dict:
+    """
+    The baseline wander of each lead, in signal units.
+
+    The baseline is estimated by the mean of each one-second window, which
+    spans about one beat; the wander is the range of those means.
+    """
+    wander = []
+    for row in batch.rows():
+        means = _window_means(row, batch.sampling_rate)
+        wander.append(float(means.max() - means.min()) if len(means) else None)
+    return batch.per_lead(wander)
+
+
+def _refractory(onsets: np.ndarray, gap: float) -> np.ndarray:
+    """Keep the onsets at least ``gap`` samples after the previous kept onset, in order."""
+    kept, last = [], -np.inf
+    for onset in onsets.tolist():
+        if onset - last >= gap:
+            kept.append(onset)
+            last = onset
+    return np.array(kept, dtype=np.int64)
+
+
+def detect_r_peaks(batch: SignalBatch) -> List[np.ndarray]:
+    """
+    Locate the QRS complexes of every lead.
+
+    The absolute slope of each lead is smoothed over 50 ms; a QRS complex
+    starts wherever it rises above half of the lead's 99th percentile slope,
+    at least REFRACTORY_SECONDS after the previous detected complex.
+
+    Args:
+        batch (SignalBatch): The signals of the ECG.
+
+    Returns:
+        List[np.ndarray]: The sample index of each detected complex, per lead.
+    """
+    window = max(batch.sampling_rate // 20, 1)
+    peaks = []
+    for row in batch.rows():
+        if len(row) < 2:
+            peaks.append(np.empty(0, dtype=np.int64))
+            continue
+
+        slope = np.abs(np.diff(row.astype(np.int64)))
+        cumulative = np.cumsum(slope)
+        energy = cumulative.copy()
+        energy[window:] -= cumulative[:-window]
+
+        above = energy > 0.5 * np.percentile(energy, 99)
+        onsets = np.flatnonzero(above[1:] & ~above[:-1])
+        peaks.append(_refractory(onsets, REFRACTORY_SECONDS * batch.sampling_rate))
+    return peaks
+
+
+@register_metric("heart_rate")
+def heart_rate(batch: SignalBatch) -> dict:
+    """The heart rate (bpm) from the median RR interval of each lead, and the median over the leads."""
+    rates = []
+    for peaks in detect_r_peaks(batch):
+        intervals = np.diff(peaks)
+        rates.append(60 * batch.sampling_rate / float(np.median(intervals)) if len(intervals) else None)
+
+    estimates = [rate for rate in rates if rate is not None]
+    return {"bpm": float(np.median(estimates)) if estimates else None, "leads": batch.per_lead(rates)}
+
+
+@register_metric("signal_quality")
+def signal_quality(batch: SignalBatch) -> dict:
+    """
+    Quality flags of each lead: "short", "flat", "clipped" and "noisy".
+
+    A lead is noisy when the sample-to-sample differences that are not part of
+    a slow wave (second differences) are large compared to the signal itself.
+    """
+    peak_to_peak = batch.maximum - batch.minimum
+
+    clipped_fraction, noise_ratio = [], []
+    for row, minimum, maximum, mean in zip(batch.rows(), batch.minimum, batch.maximum, batch.mean):
+        if not len(row):
+            clipped_fraction.append(np.nan)
+            noise_ratio.append(np.nan)
+            continue
+        clipped_fraction.append(np.count_nonzero((row == minimum) | (row == maximum)) / len(row))
+        second_difference = np.diff(row.astype(np.int64), n=2)
+        noise = np.sqrt(np.square(second_difference, dtype=np.float64).sum() / max(len(row) - 2, 1))
+        spread = np.sqrt(np.square(row - mean).mean())
+        with np.errstate(invalid="ignore", divide="ignore"):
+            noise_ratio.append(noise / spread)
+
+    flags = []
+    rows = zip(batch.lengths.tolist(), peak_to_peak.tolist(), clipped_fraction, noise_ratio)
+    for length, span, clipped, ratio in rows:
+        lead_flags = []
+        if length < MIN_SECONDS * batch.sampling_rate:
+            lead_flags.append("short")
+        if length and span < FLAT_PEAK_TO_PEAK:
+            lead_flags.append("flat")
+        elif length:
+            if clipped > CLIPPED_FRACTION:
+                lead_flags.append("clipped")
+            if ratio > NOISE_RATIO:
+                lead_flags.append("noisy")
+        flags.append({"ok": not lead_flags, "flags": lead_flags})
+    return dict(zip(batch.identifiers, flags))
+
+
+def analyze_leads(leads: Sequence[Lead], metrics: Optional[List[str]] = None, sampling_rate: int = None) -> dict:
+    """
+    Compute the insights of the leads of an ECG record.
+
+    The signals are stacked once and every selected metric runs on the same
+    arrays. The compute time of each metric is reported under COMPUTE_TIME_KEY.
+
+    Args:
+        leads (Sequence[Lead]): The leads of an ECG record.
+        metrics (Optional[List[str]]): The names of the metrics to compute (default is every registered metric).
+        sampling_rate (int): The number of samples per second (default is ECG_SAMPLING_RATE).
+
+    Returns:
+        dict: The result of each metric, keyed by its name, and their compute times in milliseconds.
+    """
+    batch = SignalBatch.from_leads(leads, sampling_rate)
+
+    insights, compute_ms = {}, {}
+    for name in metrics or METRICS:
+        start = time.perf_counter()
+        insights[name] = METRICS[name](batch)
+        compute_ms[name] = (time.perf_counter() - start) * 1000
+
+    insights[COMPUTE_TIME_KEY] = compute_ms
+    return insights
+
+
+def select_insights(insights: dict, metrics: List[str]) -> dict:
+    """
+    Keep only some metrics of computed insights, with their compute times.
+
+    Args:
+        insights (dict): Insights returned by analyze_leads.
+        metrics (List[str]): The names of the metrics to keep.
+
+    Returns:
+        dict: The selected metrics and their compute times.
+    """
+    compute_ms = insights.get(COMPUTE_TIME_KEY, {})
+    selected = {name: insights[name] for name in metrics}
+    selected[COMPUTE_TIME_KEY] = {name: compute_ms[name] for name in metrics if name in compute_ms}
+    return selected
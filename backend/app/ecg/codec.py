@@ -0,0 +1,187 @@
+import os
+import struct
+import zlib
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Storage format for new lead signals: "array" (integer[] column) or "bytea" (compressed blocks)
+SIGNAL_STORAGE = os.getenv("SIGNAL_STORAGE", "array")
+
+# Number of samples per independently decodable block. Every block but the last is full, so block k of
+# a signal starts at sample k * BLOCK_SIZE and a window can be located with the signal's block_offsets
+BLOCK_SIZE = 4096
+
+INT16_MIN, INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+# Every block starts with its number of samples and its compressed size in bytes
+_BLOCK_HEADER = struct.Struct("<II")
+
+
+def fits_int16(signal: Sequence[int]) -> bool:
+    """
+    Check whether every sample of a signal fits in a 16-bit integer.
+
+    Args:
+        signal (Sequence[int]): The signal values.
+
+    Returns:
+        bool: True if the signal can be stored with encode_signal, otherwise False.
+    """
+    values = np.asarray(signal)
+    return values.size == 0 or (values.min() >= INT16_MIN and values.max() <= INT16_MAX)
+
+
+def encode_signal(signal: Sequence[int]) -> bytes:
+    """
+    Encode a signal as a sequence of compressed, delta-encoded int16 blocks.
+
+    Each block stores its first sample relative to zero, so blocks can be
+    decoded independently and appended to an existing encoded signal.
+
+    Args:
+        signal (Sequence[int]): The signal values.
+
+    Raises:
+        ValueError: If a sample does not fit in a 16-bit integer.
+
+    Returns:
+        bytes: The encoded signal.
+    """
+    if not fits_int16(signal):
+        raise ValueError("Signal values do not fit in 16-bit integers")
+
+    values = np.asarray(signal, dtype=np.int16)
+    blocks = []
+    for offset in range(0, len(values), BLOCK_SIZE):
+        block = values[offset:offset + BLOCK_SIZE]
+        # Deltas wrap around in int16 and the cumulative sum wraps back when decoding
+        deltas = np.diff(block, prepend=np.int16(0)).astype("<i2")
+        compressed = zlib.compress(deltas.tobytes())
+        blocks.append(_BLOCK_HEADER.pack(len(block), len(compressed)) + compressed)
+
+    return b"".join(blocks)
+
+
+def iter_blocks(blob: bytes) -> Iterator[Tuple[int, int, memoryview]]:
+    """
+    Iterate over the blocks of an encoded signal without decompressing them.
+
+    Args:
+        blob (bytes): The encoded signal.
+
+    Yields:
+        Tuple[int, int, memoryview]: The index of the block's first sample, its
+            number of samples and its compressed payload.
+    """
+    view = memoryview(blob)
+    position, first_sample = 0, 0
+    while position < len(view):
+        number_of_samples, size = _BLOCK_HEADER.unpack_from(view, position)
+        position += _BLOCK_HEADER.size
+        yield first_sample, number_of_samples, view[position:position + size]
+        position += size
+        first_sample += number_of_samples
+
+
+def decode_signal(blob: bytes, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+    """
+    Decode an encoded signal straight into a NumPy array.
+
+    Only the blocks overlapping the requested sample range are decompressed.
+
+    Args:
+        blob (bytes): The encoded signal.
+        start (int): The index of the first sample to return (default is 0).
+        end (Optional[int]): The index after the last sample to return (default is the end of the signal).
+
+    Returns:
+        np.ndarray: The int16 samples in the range [start, end).
+    """
+    parts = []
+    for first_sample, number_of_samples, payload in iter_blocks(blob):
+        last_sample = first_sample + number_of_samples
+        if last_sample <= start:
+            continue
+        if end is not None and first_sample >= end:
+            break
+
+        deltas = np.frombuffer(zlib.decompress(payload), dtype="<i2")
+        block = np.cumsum(deltas, dtype=np.int16)
+        parts.append(block[max(start - first_sample, 0):None if end is None else end - first_sample])
+
+    if not parts:
+        return np.zeros(0, dtype=np.int16)
+    return np.concatenate(parts)
+
+
+def block_offsets(blob: bytes) -> List[int]:
+    """
+    Index the blocks of an encoded signal, without decompressing them.
+
+    Args:
+        blob (bytes): The encoded signal.
+
+    Returns:
+        List[int]: The byte offset of each block, followed by the size of the encoded signal.
+    """
+    offsets, position = [0], 0
+    for _, _, payload in iter_blocks(blob):
+        position += _BLOCK_HEADER.size + len(payload)
+        offsets.append(position)
+    return offsets
+
+
+def block_range(offsets: Sequence[int], start: int = 0, end: Optional[int] = None) -> Tuple[int, int, int]:
+    """
+    Locate the blocks of an encoded signal holding a window of its samples.
+
+    Args:
+        offsets (Sequence[int]): The signal's block_offsets.
+        start (int): The index of the first sample of the window (default is 0).
+        end (Optional[int]): The index after the last sample of the window (default is the end of the signal).
+
+    Returns:
+        Tuple[int, int, int]: The index of the first sample of the first block, and the byte
+            range [first, last) of the blocks, to be decoded with decode_signal.
+    """
+    blocks = len(offsets) - 1
+    first = min(start // BLOCK_SIZE, blocks)
+    last = blocks if end is None else max(min(-(-end // BLOCK_SIZE), blocks), first)
+    return first * BLOCK_SIZE, offsets[first], offsets[last]
+
+
+def lead_signal(lead) -> np.ndarray:
+    """
+    Return the signal of a lead as a NumPy array, whatever its storage format.
+
+    Args:
+        lead (Lead): The lead to read.
+
+    Returns:
+        np.ndarray: The samples of the lead.
+    """
+    if lead.signal_blob is not None:
+        return decode_signal(lead.signal_blob)
+    return np.asarray(lead.signal if lead.signal is not None else (), dtype=np.int32)
+
+
+def apply_signal_storage(lead, storage: Optional[str] = None):
+    """
+    Move the signal of a lead into the configured storage format.
+
+    Signals that do not fit in 16-bit integers always stay in the array column.
+
+    Args:
+        lead (Lead): The lead to store.
+        storage (Optional[str]): The storage format, "array" or "bytea" (default is SIGNAL_STORAGE).
+
+    Returns:
+        Lead: The same lead, ready to be persisted.
+    """
+    storage = storage or SIGNAL_STORAGE
+    if storage == "bytea" and lead.signal is not None and fits_int16(lead.signal):
+        lead.signal_blob = encode_signal(lead.signal)
+        lead.block_offsets = block_offsets(lead.signal_blob)
+        lead.signal = None
+    return lead
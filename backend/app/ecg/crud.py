@@ -1,44 +1,559 @@
+import base64
+import json
 from datetime import datetime
-from typing import List
+from typing import Any, List, Optional, Tuple, Union
 
+import numpy as np
 from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import func, or_, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from auth.models import User
+from db import async_variant
+from metrics import INSIGHT_DURATION
 
-from .models import ECG, Lead
-from .utils import count_zero_crossings
+from .codec import apply_signal_storage
+from .models import ECG, ECGInsight, InsightStatus, Lead, LeadPyramid
+from .pyramid import bucket_extremes, choose_level, downsample, number_of_levels, store_pyramids
+from .analytics import INSIGHTS_VERSION, METRICS, analyze_leads, select_insights
+from .records import (
+    ECGRecord, ECGVersion, fetch_ecg, fetch_ecg_async, fetch_ecg_page, fetch_ecg_page_async, fetch_ecg_version,
+    fetch_insight, fetch_lead_summaries, fetch_lead_summaries_async, fetch_lead_windows, fetch_lead_windows_async,
+    fetch_lead_windows_by_id
+)
+from .utils import content_hash
 
-def create_ecg(user: User, session: Session, leads: List[Lead]) -> ECG:
+# Page sizes of the ECG listing
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Maximum number of ECG records in one bulk creation request
+MAX_BULK_SIZE = 500
+
+# Periods by which aggregate statistics can be grouped, as accepted by date_trunc
+AGGREGATE_PERIODS = ("day", "week", "month")
+
+# Statistics over the current stored insights of a user's records, one row per period. Insights of an older
+# INSIGHTS_VERSION may lack metrics or compute them differently, so they are only counted as outdated.
+_AGGREGATE_ECGS = text("""
+    SELECT date_trunc(:period, ecg.date) AS period,
+           count(*) AS ecgs,
+           count(*) FILTER (WHERE ecg_insight.version = :version) AS analyzed,
+           count(*) FILTER (WHERE ecg_insight.version <> :version) AS outdated,
+           avg((ecg_insight.data -> 'heart_rate' ->> 'bpm')::float)
+               FILTER (WHERE ecg_insight.version = :version) AS heart_rate_mean,
+           min((ecg_insight.data -> 'heart_rate' ->> 'bpm')::float)
+               FILTER (WHERE ecg_insight.version = :version) AS heart_rate_min,
+           max((ecg_insight.data -> 'heart_rate' ->> 'bpm')::float)
+               FILTER (WHERE ecg_insight.version = :version) AS heart_rate_max
+    FROM ecg
+    LEFT JOIN ecg_insight ON ecg_insight.ecg_id = ecg.id AND ecg_insight.status = 'DONE'
+    WHERE ecg.user_id = :user_id AND ecg.date >= :date_from AND ecg.date < :date_to
+        AND ecg.upload_activity IS NULL
+    GROUP BY 1
+    ORDER BY 1
+""")
+
+# Statistics of each lead over the current stored insights of a user's records, one row per period and lead
+_AGGREGATE_LEADS = text("""
+    SELECT date_trunc(:period, ecg.date) AS period,
+           stats.key AS identifier,
+           count(*) AS ecgs,
+           avg((stats.value ->> 'mean')::float) AS mean,
+           avg((stats.value ->> 'rms')::float) AS rms,
+           min((stats.value ->> 'min')::int) AS min,
+           max((stats.value ->> 'max')::int) AS max,
+           avg((ecg_insight.data -> 'zero_crossings' ->> stats.key)::float) AS zero_crossings,
+           avg((ecg_insight.data -> 'baseline_wander' ->> stats.key)::float) AS baseline_wander,
+           avg((ecg_insight.data -> 'signal_quality' -> stats.key ->> 'ok')::boolean::int) AS quality_ok
+    FROM ecg
+    JOIN ecg_insight ON ecg_insight.ecg_id = ecg.id AND ecg_insight.status = 'DONE'
+        AND ecg_insight.version = :version
+    CROSS JOIN LATERAL jsonb_each(ecg_insight.data -> 'stats') AS stats
+    WHERE ecg.user_id = :user_id AND ecg.date >= :date_from AND ecg.date < :date_to
+        AND ecg.upload_activity IS NULL
+        AND jsonb_typeof(stats.value) = 'object'
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+""")
+
+# Waveform overviews return at most this many points per lead
+DEFAULT_OVERVIEW_POINTS = 1000
+MAX_OVERVIEW_POINTS = 10000
+
+def prepare_leads(leads: List[Lead]) -> List[Lead]:
+    """
+    Fill in the sample count of each lead and move its signal into the configured storage format.
+
+    Args:
+        leads (List[Lead]): List of Lead objects that represent the ECG channels.
+
+    Returns:
+        List[Lead]: The same leads, ready to be persisted.
+    """
+    for lead in leads:
+        if lead.number_of_samples is None and lead.signal is not None:
+            lead.number_of_samples = len(lead.signal)
+        apply_signal_storage(lead)
+    return leads
+
+def find_existing_ecg(
+        user: User, session: Session, digest: str, idempotency_key: Optional[str] = None
+) -> Optional[ECG]:
+    """
+    Find the record a repeated upload refers to, by idempotency key or by content hash.
+
+    Args:
+        user (User): The user uploading the ECG record.
+        session (Session): SQLModel session used to interact with the database.
+        digest (str): The content hash of the uploaded leads.
+        idempotency_key (Optional[str]): The Idempotency-Key sent with the upload, if any.
+
+    Raises:
+        HTTPException: If the idempotency key was already used for different content, a 422 error is raised.
+
+    Returns:
+        Optional[ECG]: The existing ECG record, or None if the upload is new.
+    """
+    match = ECG.content_hash == digest
+    if idempotency_key is not None:
+        match = or_(match, ECG.idempotency_key == idempotency_key)
+    existing = session.exec(select(ECG).where(ECG.user_id == user.id, match)).all()
+
+    for ecg in existing:
+        if idempotency_key is not None and ecg.idempotency_key == idempotency_key:
+            if ecg.content_hash != digest:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different ECG")
+            return ecg
+    return existing[0] if existing else None
+
+def add_ecg(user: User, session: Session, ecg: ECG) -> Optional[ECG]:
+    """
+    Add a new ECG record to the session and flush it, unless a concurrent retry of the same upload was stored first.
+
+    Args:
+        user (User): The user creating the ECG record.
+        session (Session): SQLModel session used to interact with the database.
+        ecg (ECG): The new ECG record, with its content hash and idempotency key.
+
+    Raises:
+        HTTPException: If the idempotency key was already used for different content, a 422 error is raised.
+
+    Returns:
+        Optional[ECG]: The record stored first by the concurrent retry, or None if ``ecg`` was flushed.
+    """
+    session.add(ecg)
+    try:
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        existing = find_existing_ecg(user, session, ecg.content_hash, ecg.idempotency_key)
+        if existing is None:
+            raise
+        return existing
+    return None
+
+def create_ecg(user: User, session: Session, leads: List[Lead], idempotency_key: Optional[str] = None) -> ECG:
     """
     Create an ECG record with the given leads.
 
+    Uploads are idempotent: when the user already stored the same leads, or
+    sent the same idempotency key before, the existing record is returned and
+    nothing is written.
+
     Args:
+        user (User): The user creating the ECG record.
         session (Session): SQLModel session used to interact with the database.
         leads (List[Lead]): List of Lead objects that represent the ECG channels.
+        idempotency_key (Optional[str]): A client-chosen key identifying the upload, e.g. across retries.
+
+    Raises:
+        HTTPException: If the idempotency key was already used for different content, a 422 error is raised.
 
     Returns:
-        ECG: The created ECG record, including the assigned id and timestamp.
+        ECG: The created or existing ECG record, including the assigned id and timestamp.
     """
-    ecg = ECG(date=datetime.now(), leads=leads, user_id=user.id)
-    session.add(ecg)
+    digest = content_hash(leads)
+    existing = find_existing_ecg(user, session, digest, idempotency_key)
+    if existing is not None:
+        return existing
+
+    # ECGs are immutable, so their insights are computed once at ingest
+    with INSIGHT_DURATION.labels("ingest").time():
+        insights = analyze_leads(leads)
+    signals = [np.asarray(lead.signal) for lead in leads]
+
+    ecg = ECG(date=datetime.now(), leads=prepare_leads(leads), user_id=user.id, content_hash=digest,
+              idempotency_key=idempotency_key)
+    existing = add_ecg(user, session, ecg)
+    if existing is not None:
+        return existing
+
+    store_insights(session, ecg.id, insights)
+    store_pyramids(session, zip([lead.id for lead in ecg.leads], signals))
+    session.commit()
+    session.refresh(ecg)
+
+    return ecg
+
+def create_ecg_pending(
+        user: User, session: Session, leads: List[Lead], idempotency_key: Optional[str] = None
+) -> ECG:
+    """
+    Create an ECG record whose insights are computed later by the analysis worker.
+
+    Like create_ecg, repeated uploads of the same leads or with the same
+    idempotency key return the existing record and nothing is written.
+
+    Args:
+        user (User): The user creating the ECG record.
+        session (Session): SQLModel session used to interact with the database.
+        leads (List[Lead]): List of Lead objects that represent the ECG channels.
+        idempotency_key (Optional[str]): A client-chosen key identifying the upload, e.g. across retries.
+
+    Raises:
+        HTTPException: If the idempotency key was already used for different content, a 422 error is raised.
+
+    Returns:
+        ECG: The created or existing ECG record, including the assigned id and timestamp.
+    """
+    digest = content_hash(leads)
+    existing = find_existing_ecg(user, session, digest, idempotency_key)
+    if existing is not None:
+        return existing
+
+    ecg = ECG(date=datetime.now(), leads=prepare_leads(leads), user_id=user.id, content_hash=digest,
+              idempotency_key=idempotency_key)
+    existing = add_ecg(user, session, ecg)
+    if existing is not None:
+        return existing
+
+    session.add(ECGInsight(ecg_id=ecg.id, status=InsightStatus.PENDING, version=0))
     session.commit()
     session.refresh(ecg)
 
     return ecg
 
-def retrieve_ecgs(user: User, session: Session) -> List[ECG]:
+def validate_bulk_items(items: List[Any]) -> Tuple[List[Tuple[int, List[Lead]]], List[dict]]:
+    """
+    Validate the items of a bulk creation request one by one.
+
+    Args:
+        items (List[Any]): The raw items, each expected to be {"leads": [...]}.
+
+    Returns:
+        Tuple[List[Tuple[int, List[Lead]]], List[dict]]: The index and leads of each
+            valid item, and the index and validation errors of each invalid one.
+    """
+    valid, errors = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get("leads"), list):
+            errors.append({"index": index, "errors": [{"msg": 'Each item must be an object like {"leads": [...]}'}]})
+            continue
+        try:
+            valid.append((index, [Lead.model_validate(lead) for lead in item["leads"]]))
+        except ValidationError as e:
+            errors.append({"index": index, "errors": e.errors(include_url=False, include_context=False)})
+    return valid, errors
+
+def create_ecgs_bulk(
+        user: User, session: Session, ecgs: List[List[Lead]], idempotency_key: Optional[str] = None
+) -> List[int]:
+    """
+    Create many ECG records in a single transaction with batched multi-row inserts.
+
+    Like create_ecg, records whose leads the user already stored, or that
+    appear twice in the request, resolve to the existing record and are not
+    written again. With an idempotency key, the n-th record of the request
+    gets the key ``{idempotency_key}:{n}``, so a retried request returns the
+    same IDs.
+
+    Args:
+        user (User): The user creating the ECG records.
+        session (Session): SQLModel session used to interact with the database.
+        ecgs (List[List[Lead]]): The leads of each ECG record to create.
+        idempotency_key (Optional[str]): A client-chosen key identifying the request, e.g. across retries.
+
+    Raises:
+        HTTPException: If the idempotency key was already used for different content, a 422 error is raised.
+            If a concurrent request stored some of the same records first, a 409 error is raised.
+
+    Returns:
+        List[int]: The IDs of the created or existing ECG records, in the order they were given.
+    """
+    if not ecgs:
+        return []
+
+    digests = [content_hash(leads) for leads in ecgs]
+    keys = [f"{idempotency_key}:{index}" if idempotency_key is not None else None for index in range(len(ecgs))]
+    match = ECG.content_hash.in_(digests)
+    if idempotency_key is not None:
+        match = or_(match, ECG.idempotency_key.in_(keys))
+    stored = session.exec(select(ECG.id, ECG.content_hash, ECG.idempotency_key).where(ECG.user_id == user.id, match))
+    by_hash, by_key = {}, {}
+    for ecg_id, digest, key in stored.all():
+        by_hash[digest] = ecg_id
+        if key is not None:
+            by_key[key] = (ecg_id, digest)
+
+    # Records to insert, the first of each content in the request
+    ids = [None] * len(ecgs)
+    new = {}
+    for index, (digest, key) in enumerate(zip(digests, keys)):
+        if key in by_key:
+            if by_key[key][1] != digest:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for different ECGs")
+            ids[index] = by_key[key][0]
+        elif digest in by_hash:
+            ids[index] = by_hash[digest]
+        else:
+            new.setdefault(digest, index)
+    new_indexes = list(new.values())
+
+    if new_indexes:
+        try:
+            inserted = _insert_ecgs(user, session, [ecgs[index] for index in new_indexes],
+                                    [digests[index] for index in new_indexes], [keys[index] for index in new_indexes])
+        except IntegrityError:
+            # A concurrent request stored some of the same records first; a retry resolves them to those records
+            session.rollback()
+            raise HTTPException(status_code=409, detail="Some of these ECGs were stored concurrently, retry")
+        session.commit()
+        by_hash.update(zip(new, inserted))
+
+    return [ecg_id if ecg_id is not None else by_hash[digest] for ecg_id, digest in zip(ids, digests)]
+
+def _insert_ecgs(
+        user: User, session: Session, ecgs: List[List[Lead]], digests: List[str], keys: List[Optional[str]]
+) -> List[int]:
+    """Insert new ECG records with their leads, pyramids and insights, without committing, returning their IDs."""
+    with INSIGHT_DURATION.labels("bulk").time():
+        insights = [analyze_leads(leads) for leads in ecgs]
+    signals = [np.asarray(lead.signal) for leads in ecgs for lead in leads]
+
+    now = datetime.now()
+    ecg_ids = session.exec(
+        insert(ECG).returning(ECG.id, sort_by_parameter_order=True),
+        params=[
+            {"date": now, "user_id": user.id, "content_hash": digest, "idempotency_key": key}
+            for digest, key in zip(digests, keys)
+        ],
+    ).scalars().all()
+
+    lead_rows = [
+        {
+            "identifier": lead.identifier,
+            "number_of_samples": lead.number_of_samples,
+            "signal": lead.signal,
+            "signal_blob": lead.signal_blob,
+            "block_offsets": lead.block_offsets,
+            "ecg_id": ecg_id,
+        }
+        for ecg_id, leads in zip(ecg_ids, ecgs)
+        for lead in prepare_leads(leads)
+    ]
+    if lead_rows:
+        lead_ids = session.exec(
+            insert(Lead).returning(Lead.id, sort_by_parameter_order=True), params=lead_rows
+        ).scalars().all()
+        store_pyramids(session, zip(lead_ids, signals))
+
+    session.exec(insert(ECGInsight), params=[
+        {"ecg_id": ecg_id, "status": InsightStatus.DONE, "version": INSIGHTS_VERSION, "data": data, "computed_at": now}
+        for ecg_id, data in zip(ecg_ids, insights)
+    ])
+    return list(ecg_ids)
+
+def encode_cursor(ecg: Union[ECG, ECGRecord]) -> str:
+    """
+    Encode the position of an ECG record as an opaque pagination cursor.
+
+    Args:
+        ecg (Union[ECG, ECGRecord]): The last ECG record of a page.
+
+    Returns:
+        str: The cursor pointing after that record.
+    """
+    position = json.dumps([ecg.date.isoformat(), ecg.id]).encode()
+    return base64.urlsafe_b64encode(position).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a pagination cursor created by encode_cursor.
+
+    Args:
+        cursor (str): The cursor received from the client.
+
+    Raises:
+        HTTPException: If the cursor is malformed, a 400 error is raised.
+
+    Returns:
+        Tuple[datetime, int]: The date and ID of the last record of the previous page.
+    """
+    try:
+        date, ecg_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(date), int(ecg_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def retrieve_ecgs(
+        user: User,
+        session: Session,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+) -> List[ECG]:
+    """
+    Retrieve a page of the user's ECG records, newest first.
+
+    Pages are delimited with a keyset on (date, id) served by the
+    (user_id, date, id) index, so every page costs the same however deep it is.
+    The leads and their signals are not loaded.
+
+    Args:
+        user (User): The user making the request.
+        session (Session): SQLModel session used to interact with the database.
+        limit (int): The maximum number of records to return, capped at MAX_PAGE_SIZE.
+        cursor (Optional[str]): The cursor returned with the previous page, if any.
+        date_from (Optional[datetime]): Only return records dated at or after this date.
+        date_to (Optional[datetime]): Only return records dated before this date.
+
+    Returns:
+        List[ECG]: A page of the user's ECG records.
+    """
+    statement = select(ECG).where(ECG.user_id == user.id, ECG.upload_activity.is_(None))
+
+    if cursor is not None:
+        statement = statement.where(tuple_(ECG.date, ECG.id) < tuple_(*decode_cursor(cursor)))
+    if date_from is not None:
+        statement = statement.where(ECG.date >= date_from)
+    if date_to is not None:
+        statement = statement.where(ECG.date < date_to)
+
+    statement = statement.order_by(ECG.date.desc(), ECG.id.desc()).limit(min(limit, MAX_PAGE_SIZE))
+    return session.exec(statement).all()
+
+async def _retrieve_ecg_summaries_async(
+        user: User,
+        session: AsyncSession,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+) -> dict:
+    """The retrieve_ecg_summaries of an AsyncSession, awaited natively by run_db."""
+    limit = min(limit, MAX_PAGE_SIZE)
+    after = decode_cursor(cursor) if cursor is not None else None
+
+    data = await fetch_ecg_page_async(session, user, limit, after, date_from, date_to)
+    await fetch_lead_summaries_async(session, data)
+    next_cursor = encode_cursor(data[-1]) if len(data) == limit else None
+
+    return {"data": data, "next_cursor": next_cursor}
+
+
+@async_variant(_retrieve_ecg_summaries_async)
+def retrieve_ecg_summaries(
+        user: User,
+        session: Session,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+) -> dict:
     """
-    Retrieve all ECG records from the database.
+    Retrieve a page of the user's ECG records as metadata, without any signal.
+
+    The page is paginated like retrieve_ecgs, but read with SQLAlchemy Core
+    into lightweight records, and the leads of every record on the page are
+    loaded with a single query.
 
     Args:
         user (User): The user making the request.
         session (Session): SQLModel session used to interact with the database.
+        limit (int): The maximum number of records to return, capped at MAX_PAGE_SIZE.
+        cursor (Optional[str]): The cursor returned with the previous page, if any.
+        date_from (Optional[datetime]): Only return records dated at or after this date.
+        date_to (Optional[datetime]): Only return records dated before this date.
 
     Returns:
-        List[ECG]: A list of all ECG records stored in the database.
+        dict: The records of the page (ECGRecord), each with its lead identifiers and sample
+            counts, and the cursor of the next page (None on the last page).
+    """
+    limit = min(limit, MAX_PAGE_SIZE)
+    after = decode_cursor(cursor) if cursor is not None else None
+
+    data = fetch_ecg_page(session, user, limit, after, date_from, date_to)
+    fetch_lead_summaries(session, data)
+    next_cursor = encode_cursor(data[-1]) if len(data) == limit else None
+
+    return {"data": data, "next_cursor": next_cursor}
+
+def aggregate_ecgs(
+        user: User,
+        session: Session,
+        period: str = "day",
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+) -> dict:
     """
-    return session.query(ECG).filter(ECG.user_id == user.id).all()
+    Summarize the user's ECG records per day, week or month.
+
+    Everything is computed by Postgres from the insights stored with each
+    record, so no signal is read. Records whose insights are pending or
+    failed are counted but not part of the averages, and neither are insights
+    of an older INSIGHTS_VERSION, which are counted as outdated until a
+    re-analysis replaces them.
+
+    Args:
+        user (User): The user making the request.
+        session (Session): SQLModel session used to interact with the database.
+        period (str): One of AGGREGATE_PERIODS.
+        date_from (Optional[datetime]): Only include records dated at or after this date.
+        date_to (Optional[datetime]): Only include records dated before this date.
+
+    Returns:
+        dict: For each period with records, the number of records, the number with current and with outdated
+            insights, heart rate statistics, and per lead the mean, RMS, extremes, zero crossings,
+            baseline wander and the fraction of good-quality recordings.
+    """
+    params = {
+        "period": period,
+        "user_id": user.id,
+        "date_from": date_from or datetime.min,
+        "date_to": date_to or datetime.max,
+        "version": INSIGHTS_VERSION,
+    }
+
+    periods = {}
+    for row in session.exec(_AGGREGATE_ECGS, params=params).mappings():
+        periods[row["period"]] = {
+            "period": row["period"],
+            "ecgs": row["ecgs"],
+            "analyzed": row["analyzed"],
+            "outdated": row["outdated"],
+            "heart_rate": {"mean": row["heart_rate_mean"], "min": row["heart_rate_min"], "max": row["heart_rate_max"]},
+            "leads": {},
+        }
+
+    for row in session.exec(_AGGREGATE_LEADS, params=params).mappings():
+        periods[row["period"]]["leads"][row["identifier"]] = {
+            "ecgs": row["ecgs"],
+            "mean": row["mean"],
+            "rms": row["rms"],
+            "min": row["min"],
+            "max": row["max"],
+            "zero_crossings": row["zero_crossings"],
+            "baseline_wander": row["baseline_wander"],
+            "quality_ok": float(row["quality_ok"]) if row["quality_ok"] is not None else None,
+        }
+
+    return {"period": period, "data": list(periods.values())}
 
 def retrieve_ecg_by_id(user: User, session: Session, ecg_id: int) -> ECG:
     """
@@ -55,30 +570,308 @@ def retrieve_ecg_by_id(user: User, session: Session, ecg_id: int) -> ECG:
     Returns:
         ECG: The ECG record corresponding to the provided ID.
     """
-    ecg = session.exec(select(ECG).where(ECG.id == ecg_id, ECG.user_id == user.id)).first()
+    ecg = session.exec(
+        select(ECG).where(ECG.id == ecg_id, ECG.user_id == user.id, ECG.upload_activity.is_(None))
+    ).first()
 
     if not ecg:
         raise HTTPException(status_code=404, detail="ECG not found")
 
     return ecg
 
-def compute_insights(user: User, session: Session, ecg_id: int) -> dict:
+async def _retrieve_ecg_signals_async(
+        user: User,
+        session: AsyncSession,
+        ecg_id: int,
+        leads: Optional[List[str]] = None,
+        start: int = 0,
+        end: Optional[int] = None,
+) -> ECGRecord:
+    """The retrieve_ecg_signals of an AsyncSession, awaited natively by run_db."""
+    ecg = await fetch_ecg_async(session, user, ecg_id)
+    if ecg is None:
+        raise HTTPException(status_code=404, detail="ECG not found")
+
+    ecg.leads = await fetch_lead_windows_async(session, ecg_id, leads, start, end)
+    return ecg
+
+
+@async_variant(_retrieve_ecg_signals_async)
+def retrieve_ecg_signals(
+        user: User,
+        session: Session,
+        ecg_id: int,
+        leads: Optional[List[str]] = None,
+        start: int = 0,
+        end: Optional[int] = None,
+) -> ECGRecord:
     """
-    Compute insights based on an ECG record's leads.
+    Retrieve an ECG record with a window of its lead signals.
+
+    Array signals are sliced by Postgres, so only the requested samples leave
+    the database. For bytea signals, only the compressed blocks overlapping the
+    window are read and decoded. Nothing is loaded through the ORM.
 
     Args:
         user (User): The user making the request.
         session (Session): SQLModel session used to interact with the database.
-        ecg_id (int): The ID of the ECG record for which to compute insights.
+        ecg_id (int): The unique identifier of the ECG record to retrieve.
+        leads (Optional[List[str]]): The identifiers of the leads to return (default is every lead).
+        start (int): The index of the first sample to return (default is 0).
+        end (Optional[int]): The index after the last sample to return (default is the end of the signal).
+
+    Raises:
+        HTTPException: If the ECG record is not found, a 404 error is raised.
 
     Returns:
-        dict: A dictionary containing insights (e.g., zero-crossings) for the ECG.
+        ECGRecord: The ECG record's metadata and, for each lead, its identifier, total
+            number of samples, the returned window and the window's samples as a NumPy array.
+    """
+    ecg = fetch_ecg(session, user, ecg_id)
+    if ecg is None:
+        raise HTTPException(status_code=404, detail="ECG not found")
+
+    ecg.leads = fetch_lead_windows(session, ecg_id, leads, start, end)
+    return ecg
+
+def retrieve_ecg_version(user: User, session: Session, ecg_id: int) -> Optional[ECGVersion]:
+    """
+    Retrieve what identifies the current content of an ECG record and of its insights.
+
+    This is a single primary key lookup, cheap enough to answer conditional
+    requests without reading the signals or the insights.
+
+    Args:
+        user (User): The user making the request.
+        session (Session): SQLModel session used to interact with the database.
+        ecg_id (int): The ID of the ECG record.
+
+    Returns:
+        Optional[ECGVersion]: The version of the record, or None if the user has no such record.
+    """
+    return fetch_ecg_version(session, user, ecg_id)
+
+
+def retrieve_ecg_overview(
+        user: User,
+        session: Session,
+        ecg_id: int,
+        points: int = DEFAULT_OVERVIEW_POINTS,
+        leads: Optional[List[str]] = None,
+        start: int = 0,
+        end: Optional[int] = None,
+) -> dict:
+    """
+    Retrieve at most ``points`` min/max pairs per lead covering a window of an ECG record.
+
+    Each lead is read from the finest level of its min/max pyramid that fits
+    the requested number of points, sliced by Postgres, so the full-resolution
+    signal is only read for windows of at most 2**(FIRST_LEVEL - 1) samples
+    per point. The buckets of records stored before pyramids existed are
+    computed from their signal's window, without writing anything: their
+    pyramids are built by ``migrate.py pyramids``.
+
+    Args:
+        user (User): The user making the request.
+        session (Session): SQLModel session used to interact with the database.
+        ecg_id (int): The unique identifier of the ECG record to retrieve.
+        points (int): The maximum number of points per lead.
+        leads (Optional[List[str]]): The identifiers of the leads to return (default is every lead).
+        start (int): The index of the first sample of the window (default is 0).
+        end (Optional[int]): The index after the last sample of the window (default is the end of the signal).
+
+    Raises:
+        HTTPException: If the ECG record is not found, a 404 error is raised.
+
+    Returns:
+        dict: The ECG record's metadata and, for each lead, its identifier, total number of samples,
+            the covered window, the number of samples per point and the minimum and maximum of each point.
     """
     ecg = retrieve_ecg_by_id(user, session, ecg_id)
 
-    # Response data
-    insights = {
-        "zero_crossings": count_zero_crossings(ecg.leads),
+    number_of_samples = func.coalesce(Lead.number_of_samples, func.cardinality(Lead.signal), 0)
+    statement = select(Lead.id, Lead.identifier, number_of_samples).where(Lead.ecg_id == ecg_id)
+    if leads is not None:
+        statement = statement.where(Lead.identifier.in_(leads))
+    rows = session.exec(statement.order_by(Lead.id)).all()
+
+    # Lead windows grouped by the pyramid level they are read from
+    by_level = {}
+    for lead_id, identifier, samples in rows:
+        lead_end = samples if end is None else min(end, samples)
+        level = choose_level(max(lead_end - start, 0), points, number_of_levels(samples))
+        by_level.setdefault(level, []).append((lead_id, identifier, samples, lead_end))
+
+    data = {}
+    for level, level_leads in by_level.items():
+        size = 1 << level
+        first = start >> level
+        last = max(-(-lead_end // size) for *_, lead_end in level_leads)
+        if level == 0:
+            values = _overview_samples(session, ecg_id, level_leads, first, last)
+        else:
+            values = _overview_buckets(session, ecg_id, level_leads, level, first, last)
+
+        for lead_id, identifier, samples, lead_end in level_leads:
+            count = max(-(-lead_end // size) - first, 0)
+            minimum, maximum = (array[:count] for array in values[lead_id])
+            minimum, maximum, factor = downsample(minimum, maximum, points)
+            data[lead_id] = {
+                "identifier": identifier,
+                "number_of_samples": samples,
+                "start": min(first << level, samples),
+                "end": min((first + count) << level, samples) if count else min(start, samples),
+                "samples_per_point": factor << level,
+                "min": minimum,
+                "max": maximum,
+            }
+
+    return {
+        "id": ecg.id, "date": ecg.date, "user_id": ecg.user_id,
+        "leads": [data[lead_id] for lead_id, *_ in rows],
+    }
+
+def _overview_samples(session: Session, ecg_id: int, level_leads: List[tuple], first: int, last: int) -> dict:
+    """Read a window of full-resolution signals, as (minimum, maximum) pairs of equal arrays per lead ID."""
+    windows = fetch_lead_windows_by_id(session, ecg_id, [lead_id for lead_id, *_ in level_leads], first, last)
+    return {lead_id: (window.signal, window.signal) for lead_id, window in windows.items()}
+
+def _pyramid_window(session: Session, lead_ids: List[int], level: int, first: int, last: int) -> dict:
+    """Read a window of buckets of one pyramid level, as (minimum, maximum) arrays per lead ID."""
+    statement = select(
+        LeadPyramid.lead_id, LeadPyramid.minimum[first + 1:last], LeadPyramid.maximum[first + 1:last]
+    ).where(LeadPyramid.lead_id.in_(lead_ids), LeadPyramid.level == level)
+    return {
+        lead_id: (np.asarray(minimum or (), dtype=np.int32), np.asarray(maximum or (), dtype=np.int32))
+        for lead_id, minimum, maximum in session.exec(statement).all()
     }
 
-    return insights
+def _overview_buckets(
+        session: Session, ecg_id: int, level_leads: List[tuple], level: int, first: int, last: int
+) -> dict:
+    """Read a window of buckets of one pyramid level, computing those of missing pyramids from the signals."""
+    values = _pyramid_window(session, [lead_id for lead_id, *_ in level_leads], level, first, last)
+
+    # Pyramids of records stored before they existed are built by "migrate.py pyramids", never by a read
+    missing = [lead for lead in level_leads if lead[0] not in values]
+    if missing:
+        windows = _overview_samples(session, ecg_id, missing, first << level, last << level)
+        values.update({lead_id: bucket_extremes(signal, level) for lead_id, (signal, _) in windows.items()})
+    return values
+
+def parse_metric_names(metrics: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Validate the metric names of a request, given repeated or comma-separated.
+
+    Args:
+        metrics (Optional[List[str]]): The requested metric names.
+
+    Raises:
+        HTTPException: If a metric is not registered, a 400 error is raised.
+
+    Returns:
+        Optional[List[str]]: The metric names, or None to select every metric.
+    """
+    if not metrics:
+        return None
+
+    names = list(dict.fromkeys(name.strip() for value in metrics for name in value.split(",") if name.strip()))
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown metrics: {', '.join(unknown)}. Available: {', '.join(METRICS)}"
+        )
+    return names or None
+
+def compute_insights(user: User, session: Session, ecg_id: int, metrics: Optional[List[str]] = None) -> dict:
+    """
+    Retrieve the insights of an ECG record.
+
+    Insights are stored when the ECG is created, so this is a single lookup
+    that never loads the lead signals. Reads never compute insights: failed,
+    outdated or missing ones are recomputed by the analysis worker or the
+    re-analysis job, and reported meanwhile with an error.
+
+    Args:
+        user (User): The user making the request.
+        session (Session): SQLModel session used to interact with the database.
+        ecg_id (int): The ID of the ECG record for which to compute insights.
+        metrics (Optional[List[str]]): The metrics to return (default is every metric).
+
+    Raises:
+        HTTPException: If the ECG record is not found, a 404 error is raised.
+            If its insights are pending, outdated or not computed yet, a 409 error is raised.
+            If their computation failed, a 422 error is raised.
+
+    Returns:
+        dict: The result of each metric (e.g., zero_crossings, heart_rate) and their compute times.
+    """
+    metrics = parse_metric_names(metrics)
+    insight = fetch_insight(session, user, ecg_id)
+
+    if insight is None:
+        if fetch_ecg(session, user, ecg_id) is None:
+            raise HTTPException(status_code=404, detail="ECG not found")
+        raise HTTPException(status_code=409, detail="ECG insights have not been computed yet")
+    if insight.status == InsightStatus.PENDING:
+        raise HTTPException(status_code=409, detail="ECG insights are still being computed")
+    if insight.status == InsightStatus.FAILED:
+        raise HTTPException(status_code=422, detail="ECG insights could not be computed")
+    if insight.version != INSIGHTS_VERSION:
+        raise HTTPException(status_code=409, detail="ECG insights are outdated and waiting to be recomputed")
+
+    return select_insights(insight.data, metrics) if metrics else insight.data
+
+
+def retrieve_insight_status(user: User, session: Session, ecg_id: int) -> dict:
+    """
+    Report whether the insights of an ECG record are pending, done or failed.
+
+    Records stored before insights existed are reported as pending, with no
+    version, until the re-analysis job computes them.
+
+    Args:
+        user (User): The user making the request.
+        session (Session): SQLModel session used to interact with the database.
+        ecg_id (int): The ID of the ECG record.
+
+    Raises:
+        HTTPException: If the ECG record is not found, a 404 error is raised.
+
+    Returns:
+        dict: A dictionary with the ECG id, the insight status and the insight version.
+    """
+    insight = fetch_insight(session, user, ecg_id)
+
+    if insight is None:
+        if fetch_ecg(session, user, ecg_id) is None:
+            raise HTTPException(status_code=404, detail="ECG not found")
+        return {"ecg_id": ecg_id, "status": InsightStatus.PENDING, "version": None}
+
+    return {"ecg_id": ecg_id, "status": insight.status, "version": insight.version}
+
+
+def store_insights(session: Session, ecg_id: int, data: dict, status: InsightStatus = InsightStatus.DONE):
+    """
+    Insert or replace the stored insights of an ECG record.
+
+    The caller is responsible for committing the session.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        ecg_id (int): The ID of the ECG record the insights belong to.
+        data (dict): The computed insights.
+        status (InsightStatus): The status to record (default is InsightStatus.DONE).
+
+    Returns:
+        None
+    """
+    values = {
+        "ecg_id": ecg_id,
+        "status": status,
+        "version": INSIGHTS_VERSION,
+        "data": data,
+        "computed_at": datetime.now(),
+    }
+    statement = insert(ECGInsight).values(**values)
+    session.exec(statement.on_conflict_do_update(index_elements=[ECGInsight.ecg_id], set_=values))
@@ -0,0 +1,224 @@
+"""
+Live monitoring of ECG signals streamed over a WebSocket.
+
+Insights are kept up to date incrementally: every lead carries the running
+state its metrics need (the sign of its last sample for zero crossings, sums
+and extrema for the statistics), so each received chunk is processed in time
+proportional to its own length, whatever the length of the recording so far.
+"""
+import json
+import math
+from typing import Dict, List, Optional, Union
+
+import anyio
+import numpy as np
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from auth.models import User
+from db import sync_session_for
+
+from .analytics import ECG_SAMPLING_RATE
+from .models import ECG
+from .streaming import ECGStreamWriter, _parse_header, _parse_samples, _unprocessable
+
+# Samples per lead received between two insight updates, one second by default
+LIVE_UPDATE_SAMPLES = ECG_SAMPLING_RATE
+
+
+class LeadState:
+    """
+    Running insights of one lead, updated chunk by chunk.
+
+    Attributes:
+        count (int): The number of samples received.
+        zero_crossings (int): The number of strict zero crossings so far.
+        last_sign (int): The sign of the last sample, used for crossings spanning two chunks.
+    """
+    __slots__ = ("count", "zero_crossings", "last_sign", "total", "squares", "minimum", "maximum")
+
+    def __init__(self):
+        self.count = 0
+        self.zero_crossings = 0
+        self.last_sign = 0
+        self.total = 0
+        self.squares = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def update(self, samples: np.ndarray):
+        """
+        Fold a chunk of samples into the state.
+
+        Args:
+            samples (np.ndarray): The samples following those already received.
+
+        Returns:
+            None
+        """
+        if not len(samples):
+            return
+
+        signs = np.sign(samples).astype(np.int8)
+        self.zero_crossings += int(np.count_nonzero(signs[:-1] * signs[1:] < 0)) + int(self.last_sign * signs[0] < 0)
+        self.last_sign = int(signs[-1])
+
+        self.count += len(samples)
+        self.total += int(samples.sum(dtype=np.int64))
+        self.squares += float(np.square(samples, dtype=np.float64).sum())
+        minimum, maximum = int(samples.min()), int(samples.max())
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    def stats(self) -> Optional[dict]:
+        """Return the statistics in the format of the stored insights, or None before the first sample."""
+        if not self.count:
+            return None
+        return {"min": self.minimum, "max": self.maximum, "mean": self.total / self.count,
+                "rms": math.sqrt(self.squares / self.count)}
+
+
+class LiveMonitor:
+    """
+    Incremental insights of the leads of a live stream.
+
+    Attributes:
+        leads (Dict[str, LeadState]): The state of each lead, by identifier.
+        update_samples (int): The number of samples per lead between two insight updates.
+    """
+
+    def __init__(self, identifiers: List[str], update_samples: int = None):
+        self.leads = {identifier: LeadState() for identifier in identifiers}
+        self.update_samples = update_samples or LIVE_UPDATE_SAMPLES
+        self._next_update = self.update_samples
+
+    @property
+    def received(self) -> int:
+        """int: The number of samples of the most advanced lead."""
+        return max(state.count for state in self.leads.values())
+
+    def append(self, chunk: Dict[str, np.ndarray]) -> bool:
+        """
+        Fold a chunk of samples into the state of its leads.
+
+        Args:
+            chunk (Dict[str, np.ndarray]): The samples received for each lead.
+
+        Returns:
+            bool: True when update_samples more samples have been received since the last update.
+        """
+        for identifier, samples in chunk.items():
+            self.leads[identifier].update(samples)
+
+        received = self.received
+        if received < self._next_update:
+            return False
+        self._next_update = (received // self.update_samples + 1) * self.update_samples
+        return True
+
+    def insights(self) -> dict:
+        """
+        Return the current insights, keyed like those computed by analyze_leads.
+
+        Returns:
+            dict: The zero crossings, statistics and sample count of each lead.
+        """
+        return {
+            "samples": {identifier: state.count for identifier, state in self.leads.items()},
+            "zero_crossings": {identifier: state.zero_crossings for identifier, state in self.leads.items()},
+            "stats": {identifier: state.stats() for identifier, state in self.leads.items()},
+        }
+
+
+async def _receive(websocket: WebSocket) -> Union[str, bytes]:
+    """Return the next text or binary message of a WebSocket."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE), message.get("reason"))
+    return message["text"] if message.get("text") is not None else message.get("bytes", b"")
+
+
+def _parse_chunk(message: Union[str, bytes], identifiers: List[str]) -> Dict[str, np.ndarray]:
+    """
+    Parse a data message: JSON mapping lead identifiers to samples, or binary frames.
+
+    Binary messages hold frames of one little-endian int16 sample per lead,
+    in header order, like the body of a binary upload.
+    """
+    if isinstance(message, bytes):
+        frame_size = 2 * len(identifiers)
+        if len(message) % frame_size:
+            raise _unprocessable("Binary messages must hold whole frames")
+        frames = np.frombuffer(message, dtype="<i2").reshape(-1, len(identifiers))
+        return {identifier: frames[:, column] for column, identifier in enumerate(identifiers)}
+
+    try:
+        chunk = json.loads(message)
+    except ValueError:
+        chunk = None
+    if not isinstance(chunk, dict):
+        raise _unprocessable("Every message must map lead identifiers to lists of integers")
+    return {identifier: _parse_samples(samples) for identifier, samples in chunk.items()}
+
+
+async def run_live_session(
+        websocket: WebSocket, user: User, session: Union[Session, AsyncSession], update_samples: int = None
+) -> Optional[ECG]:
+    """
+    Monitor a live ECG stream and record it.
+
+    The first message names the leads, e.g. ``{"leads": ["I", "II"]}``, and is
+    answered with ``{"type": "started", "ecg_id": ...}``. Every following
+    message carries samples, as JSON or binary frames. Updated insights are
+    sent as ``{"type": "insights", "data": ...}`` every ``update_samples``
+    samples. When the client closes the connection, the samples are stored as
+    the ECG record, unless the user already has a record with the same content,
+    which is returned instead; a malformed message closes it with code 1007 and
+    discards the recording.
+
+    Args:
+        websocket (WebSocket): The accepted WebSocket.
+        user (User): The user streaming the ECG record.
+        session (Union[Session, AsyncSession]): The connection's database session.
+        update_samples (int): The number of samples per lead between two insight updates
+            (default is LIVE_UPDATE_SAMPLES).
+
+    Returns:
+        Optional[ECG]: The recorded ECG, whose insights are pending, or None if no sample was received.
+    """
+    with sync_session_for(session) as sync_session:
+        writer = None
+        try:
+            identifiers = _parse_header(await _receive(websocket))
+            monitor = LiveMonitor(identifiers, update_samples)
+            writer = await run_in_threadpool(ECGStreamWriter, user, sync_session, identifiers)
+            await websocket.send_json({"type": "started", "ecg_id": writer.ecg_id})
+
+            while True:
+                chunk = _parse_chunk(await _receive(websocket), identifiers)
+                for identifier, samples in chunk.items():
+                    writer.append(identifier, samples)
+                if monitor.append(chunk):
+                    await websocket.send_json({"type": "insights", "data": monitor.insights()})
+                if writer.needs_flush:
+                    await run_in_threadpool(writer.flush)
+        except WebSocketDisconnect:
+            if writer is None:
+                return None
+            # The recording is stored even if the server cancels the endpoint meanwhile, e.g. on shutdown
+            with anyio.CancelScope(shield=True):
+                if not monitor.received:
+                    await run_in_threadpool(writer.abort)
+                    return None
+                return await run_in_threadpool(writer.finish)
+        except HTTPException as exc:
+            if writer is not None:
+                await run_in_threadpool(writer.abort)
+            await websocket.close(code=status.WS_1007_INVALID_FRAME_PAYLOAD_DATA, reason=exc.detail)
+            return None
+        except BaseException:
+            if writer is not None:
+                await run_in_threadpool(writer.abort)
+            raise
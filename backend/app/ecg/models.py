@@ -1,7 +1,8 @@
 from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 
-from sqlalchemy import Column, Integer
+from sqlalchemy import Column, Index, Integer, LargeBinary
 from sqlalchemy.dialects import postgresql
 from sqlmodel import Field, SQLModel, Relationship
 
@@ -15,6 +16,10 @@ class Lead(SQLModel, table=True):
         identifier (str): The identifier of the lead (e.g., I, II, III, etc.).
         number_of_samples (Optional[int]): The number of samples in the lead's signal.
         signal (List[int]): The list of signal values
+        signal_blob (Optional[bytes]): The signal encoded by ecg.codec, used instead of signal
+            when the deployment stores signals as bytea.
+        block_offsets (Optional[List[int]]): The byte offset of each block of signal_blob and its size, so windows
+            are read without transferring the whole blob. None for blobs stored before it was recorded.
         ecg_id (Optional[int]): The ID of the associated ECG record.
         ecg (Optional[ECG]): The ECG record to which the lead belongs.
     """
@@ -22,8 +27,10 @@ class Lead(SQLModel, table=True):
     identifier: str
     number_of_samples: Optional[int] = None
     signal: List[int] = Field(sa_column=Column(postgresql.ARRAY(Integer)))
+    signal_blob: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary), exclude=True)
+    block_offsets: Optional[List[int]] = Field(default=None, sa_column=Column(postgresql.ARRAY(Integer)), exclude=True)
 
-    ecg_id: Optional[int] = Field(default=None, foreign_key="ecg.id")
+    ecg_id: Optional[int] = Field(default=None, foreign_key="ecg.id", index=True)
     ecg: Optional["ECG"] = Relationship(back_populates="leads")
 
 
@@ -39,8 +46,162 @@ class ECG(SQLModel, table=True):
         id (Optional[int]): The unique identifier of the ECG record.
         date (datetime): The date and time when the ECG was recorded.
         leads (List[Lead]): The list of Lead objects associated with this ECG.
+        user_id (int): The ID of the user who owns the ECG record.
+        content_hash (Optional[str]): The SHA-256 of the lead identifiers and signals, used to detect repeated uploads.
+        idempotency_key (Optional[str]): The Idempotency-Key sent with the upload, if any.
+        upload_activity (Optional[datetime]): When a streamed upload still in progress last wrote samples, None
+            once the record is complete. Incomplete records are hidden from every read.
     """
+    __table_args__ = (
+        # Serves the keyset pagination of a user's records by (date, id)
+        Index("ix_ecg_user_id_date_id", "user_id", "date", "id"),
+        # A user's repeated uploads resolve to the existing record with a single lookup
+        Index("ix_ecg_user_id_content_hash", "user_id", "content_hash", unique=True),
+        Index("ix_ecg_user_id_idempotency_key", "user_id", "idempotency_key", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     date: datetime = Field(default_factory=datetime.now)
-    leads: List[Lead] = Relationship(back_populates="ecg")
+    leads: List[Lead] = Relationship(back_populates="ecg", sa_relationship_kwargs={"order_by": "Lead.id"})
     user_id: int = Field(foreign_key="user.id")
+    content_hash: Optional[str] = Field(default=None, max_length=64)
+    idempotency_key: Optional[str] = Field(default=None, max_length=255)
+    upload_activity: Optional[datetime] = Field(default=None)
+
+
+class InsightStatus(str, Enum):
+    """Enum representing the state of an ECG record's insights.
+
+    Attributes:
+        PENDING: The insights are waiting to be computed.
+        DONE: The insights have been computed and stored.
+        FAILED: The computation of the insights failed.
+    """
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class ECGInsight(SQLModel, table=True):
+    """
+    Stores the insights computed for an ECG record.
+
+    ECG records are immutable once created, so their insights are computed a
+    single time and then served from this table.
+
+    Attributes:
+        ecg_id (int): The ID of the ECG record the insights belong to.
+        status (InsightStatus): Whether the insights are pending, done or failed.
+        version (int): The version of the insight logic used to compute the data.
+        data (dict): The computed insights (e.g., zero-crossings per lead).
+        computed_at (datetime): The date and time when the insights were computed.
+    """
+    __tablename__ = "ecg_insight"
+
+    ecg_id: int = Field(foreign_key="ecg.id", primary_key=True)
+    status: InsightStatus = Field(default=InsightStatus.DONE)
+    version: int = Field(default=1)
+    data: dict = Field(default_factory=dict, sa_column=Column(postgresql.JSONB))
+    computed_at: datetime = Field(default_factory=datetime.now)
+
+
+class LeadChunk(SQLModel, table=True):
+    """
+    Stages one chunk of a lead's signal while a streamed upload is in progress.
+
+    Chunks are concatenated into the lead's signal in the database when the
+    upload completes, and then deleted.
+
+    Attributes:
+        lead_id (int): The ID of the lead the chunk belongs to.
+        seq (int): The position of the chunk within the lead's signal.
+        number_of_samples (int): The number of samples in the chunk.
+        signal (Optional[List[int]]): The chunk's samples, when stored as an array.
+        signal_blob (Optional[bytes]): The chunk's samples encoded by ecg.codec, when stored as bytea.
+    """
+    __tablename__ = "lead_chunk"
+
+    lead_id: int = Field(foreign_key="lead.id", primary_key=True)
+    seq: int = Field(primary_key=True)
+    number_of_samples: int
+    signal: Optional[List[int]] = Field(default=None, sa_column=Column(postgresql.ARRAY(Integer)))
+    signal_blob: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+
+
+class LeadPyramid(SQLModel, table=True):
+    """
+    Stores one level of the min/max decimation pyramid of a lead's signal.
+
+    Level k holds the minimum and maximum of each bucket of 2**k consecutive
+    samples, so waveforms can be drawn at screen resolution without reading
+    the full signal.
+
+    Attributes:
+        lead_id (int): The ID of the lead the level belongs to.
+        level (int): The level, whose buckets span 2**level samples.
+        number_of_buckets (int): The number of buckets of the level.
+        minimum (List[int]): The minimum sample of each bucket.
+        maximum (List[int]): The maximum sample of each bucket.
+    """
+    __tablename__ = "lead_pyramid"
+
+    lead_id: int = Field(foreign_key="lead.id", primary_key=True)
+    level: int = Field(primary_key=True)
+    number_of_buckets: int
+    minimum: List[int] = Field(sa_column=Column(postgresql.ARRAY(Integer)))
+    maximum: List[int] = Field(sa_column=Column(postgresql.ARRAY(Integer)))
+
+
+class JobStatus(str, Enum):
+    """Enum representing the state of a batch job.
+
+    Attributes:
+        RUNNING: The job is running, or was interrupted and can be resumed.
+        DONE: The job processed every record.
+        CANCELLED: The job was stopped by an admin and can be resumed.
+        FAILED: The job stopped on an error and can be resumed.
+    """
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+
+class ReanalysisJob(SQLModel, table=True):
+    """
+    Tracks a batch re-analysis of the stored ECG records.
+
+    ECG records are processed in id order and the checkpoint is committed
+    together with each batch of results, so an interrupted job resumes where
+    it stopped.
+
+    Attributes:
+        id (Optional[int]): The unique identifier of the job.
+        status (JobStatus): Whether the job is running, done, cancelled or failed.
+        version (int): The insight version the records are brought up to.
+        force (bool): Whether records already at that version are recomputed too.
+        max_rate (Optional[float]): The maximum number of records processed per second, if throttled.
+        checkpoint (int): The ID of the last ECG record whose results were written.
+        total (int): The number of records to process when the job was created.
+        processed (int): The number of records whose insights were recomputed.
+        failed (int): The number of records whose analysis failed.
+        elapsed_seconds (float): The time spent running, over every run of the job.
+        error (Optional[str]): The error that stopped a failed job.
+        created_at (datetime): The date and time when the job was created.
+        updated_at (datetime): The date and time of the last progress update.
+    """
+    __tablename__ = "reanalysis_job"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    status: JobStatus = Field(default=JobStatus.RUNNING)
+    version: int
+    force: bool = False
+    max_rate: Optional[float] = None
+    checkpoint: int = 0
+    total: int = 0
+    processed: int = 0
+    failed: int = 0
+    elapsed_seconds: float = 0
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
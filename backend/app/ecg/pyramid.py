@@ -0,0 +1,140 @@
+"""
+Min/max decimation pyramids of lead signals.
+
+Level k of a lead's pyramid holds the minimum and maximum of every bucket of
+2**k consecutive samples, so a waveform can be drawn at any zoom level from
+at most a few times as many values as it has pixels. Levels are stored from
+FIRST_LEVEL up to the first level with at most TOP_BUCKETS buckets, which
+takes about a quarter as many values as the signal itself. Finer zoom levels
+are served from the full-resolution signal, reading at most 2**(FIRST_LEVEL - 1)
+samples per point.
+"""
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session
+
+from .models import LeadPyramid
+
+TOP_BUCKETS = 128
+
+# Finest stored level: levels 1 to 3 would take 7/4 as many values as the signal, for little gain
+FIRST_LEVEL = 4
+
+# Signals with at most this many samples have no stored level
+MIN_PYRAMID_SAMPLES = TOP_BUCKETS << (FIRST_LEVEL - 1)
+
+
+def number_of_levels(number_of_samples: int) -> int:
+    """Return how many levels the pyramid of a signal with this many samples has."""
+    levels, buckets = 0, number_of_samples
+    while buckets > 1 and (levels == 0 or buckets > TOP_BUCKETS):
+        buckets = (buckets + 1) // 2
+        levels += 1
+    return levels
+
+
+def _halve(minimum: np.ndarray, maximum: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Merge pairs of buckets; an odd last bucket is merged with itself."""
+    if len(minimum) % 2:
+        minimum, maximum = np.append(minimum, minimum[-1]), np.append(maximum, maximum[-1])
+    return np.minimum(minimum[0::2], minimum[1::2]), np.maximum(maximum[0::2], maximum[1::2])
+
+
+def build_pyramid(signal: np.ndarray) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Build the stored levels of the min/max pyramid of a signal.
+
+    Args:
+        signal (np.ndarray): The samples of a lead.
+
+    Returns:
+        List[Tuple[int, np.ndarray, np.ndarray]]: The level, bucket minimums and bucket maximums of each level
+            from FIRST_LEVEL, none for signals of at most MIN_PYRAMID_SAMPLES samples.
+    """
+    minimum = maximum = np.asarray(signal)
+    levels = []
+    for level in range(1, number_of_levels(len(minimum)) + 1):
+        minimum, maximum = _halve(minimum, maximum)
+        if level >= FIRST_LEVEL:
+            levels.append((level, minimum, maximum))
+    return levels
+
+
+def bucket_extremes(signal: np.ndarray, level: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the buckets of one pyramid level from a window of the signal starting on a bucket boundary.
+
+    Args:
+        signal (np.ndarray): The samples of the window.
+        level (int): The level, whose buckets span 2**level samples.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The minimum and maximum of each bucket, as stored for the level.
+    """
+    if not len(signal):
+        return signal, signal
+    starts = np.arange(0, len(signal), 1 << level)
+    return np.minimum.reduceat(signal, starts), np.maximum.reduceat(signal, starts)
+
+
+def store_pyramids(session: Session, signals: Iterable[Tuple[int, np.ndarray]]):
+    """
+    Build and insert the pyramids of leads, keeping those that already exist.
+
+    The caller is responsible for committing the session.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        signals (Iterable[Tuple[int, np.ndarray]]): The ID and full signal of each lead.
+
+    Returns:
+        None
+    """
+    rows = [
+        {"lead_id": lead_id, "level": level, "number_of_buckets": len(minimum),
+         "minimum": minimum.tolist(), "maximum": maximum.tolist()}
+        for lead_id, signal in signals
+        for level, minimum, maximum in build_pyramid(signal)
+    ]
+    if rows:
+        session.exec(insert(LeadPyramid).on_conflict_do_nothing(), params=rows)
+
+
+def choose_level(span: int, points: int, levels: int) -> int:
+    """
+    Pick the finest pyramid level that covers a span of samples in at most ``points`` buckets.
+
+    Args:
+        span (int): The number of samples to draw.
+        points (int): The maximum number of buckets to return.
+        levels (int): The number of levels of the lead's pyramid.
+
+    Returns:
+        int: The level to read, capped at the top level, or 0 for the full-resolution signal when the
+            finest level that fits is not stored.
+    """
+    level = 0
+    while level < levels and span > points << level:
+        level += 1
+    return level if level >= FIRST_LEVEL else 0
+
+
+def downsample(minimum: np.ndarray, maximum: np.ndarray, points: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Merge consecutive buckets until there are at most ``points`` of them.
+
+    Args:
+        minimum (np.ndarray): The bucket minimums.
+        maximum (np.ndarray): The bucket maximums.
+        points (int): The maximum number of buckets to return.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, int]: The merged minimums and maximums, and how many buckets were merged into each.
+    """
+    factor = -(-len(minimum) // points) if len(minimum) else 1
+    if factor <= 1:
+        return minimum, maximum, 1
+    starts = np.arange(0, len(minimum), factor)
+    return np.minimum.reduceat(minimum, starts), np.maximum.reduceat(maximum, starts), factor
@@ -0,0 +1,403 @@
+"""
+Batch re-analysis of the stored ECG records.
+
+When the insight logic changes (INSIGHTS_VERSION is bumped), every stored
+record whose insights are older, failed or missing is recomputed by a job that:
+
+- reads those records in ECG id order, one batch per short query resuming
+  after the last ECG id read (keyset pagination), so signals are loaded in
+  batches and no transaction stays open while the job runs,
+- fans the batches out to a dedicated process pool,
+- writes each batch of results with one bulk upsert, committed together with
+  the job's checkpoint, so an interrupted job resumes after the last batch,
+- throttles itself to at most ``max_rate`` records per second.
+
+A Postgres advisory lock ensures a single job runs at a time across replicas.
+It is taken by lock_reanalysis before the job is started and held by the
+connection handed to run_reanalysis until the job stops, so a request that
+cannot take it never writes a job.
+
+``POST /ecg/reanalysis`` runs the job in a thread of the server process, whose
+analysis pool competes with the requests of that worker: it suits small
+backlogs, e.g. the records that failed. Large backlogs are run with
+``python migrate.py reanalyze`` from a one-off container or Kubernetes Job.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import Connection, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+from db import engine
+
+from .analytics import INSIGHTS_VERSION
+from .codec import decode_signal
+from .models import ECGInsight, InsightStatus, JobStatus, ReanalysisJob
+from .worker import analyze_signals
+
+logger = logging.getLogger(__name__)
+
+# Number of processes analysing records, separate from the pool serving requests
+REANALYSIS_WORKERS = int(os.getenv("REANALYSIS_WORKERS", os.cpu_count() or 1))
+
+# Records analysed and written per batch
+REANALYSIS_BATCH_SIZE = int(os.getenv("REANALYSIS_BATCH_SIZE", 100))
+
+# Default cap on the records processed per second, 0 for no cap
+REANALYSIS_MAX_RATE = float(os.getenv("REANALYSIS_MAX_RATE", 200))
+
+# Key of the advisory lock held by the running job
+REANALYSIS_LOCK_KEY = 0x45434732
+
+# Complete records that need new insights: never analysed (stored before insights were), outdated or failed,
+# but not being analysed for the first time
+_OUTDATED = """
+    ecg.id > :after AND ecg.upload_activity IS NULL
+    AND (ecg_insight.ecg_id IS NULL OR ecg_insight.status <> 'PENDING')
+    AND (:force OR ecg_insight.ecg_id IS NULL OR ecg_insight.version < :version OR ecg_insight.status = 'FAILED')
+"""
+
+_RECORDS = "ecg LEFT JOIN ecg_insight ON ecg_insight.ecg_id = ecg.id"
+
+_COUNT_OUTDATED = text(f"SELECT count(*) FROM {_RECORDS} WHERE {_OUTDATED}")
+
+# The next batch of records, with their leads (none for a record without leads)
+_OUTDATED_BATCH = text(f"""
+    WITH batch AS (SELECT ecg.id FROM {_RECORDS} WHERE {_OUTDATED} ORDER BY ecg.id LIMIT :limit)
+    SELECT batch.id AS ecg_id, lead.identifier, lead.signal, lead.signal_blob
+    FROM batch LEFT JOIN lead ON lead.ecg_id = batch.id
+    ORDER BY batch.id, lead.id
+""")
+
+# A batch of records: the ECG id and the (identifier, signal, signal_blob) of each lead
+Batch = List[Tuple[int, List[Tuple[str, Optional[List[int]], Optional[bytes]]]]]
+
+
+def analyze_batch(batch: Batch) -> List[Tuple[int, Optional[dict]]]:
+    """
+    Compute the insights of a batch of records.
+
+    This runs inside the worker processes. Signals stored as bytea are
+    decoded here, so the parent only forwards the compact blobs.
+
+    Args:
+        batch (Batch): The leads of each record, as read from the database.
+
+    Returns:
+        List[Tuple[int, Optional[dict]]]: The ECG id and insights of each record, None if its analysis failed.
+    """
+    results = []
+    for ecg_id, leads in batch:
+        try:
+            signals = [
+                (identifier, decode_signal(blob) if blob is not None else signal or [])
+                for identifier, signal, blob in leads
+            ]
+            results.append((ecg_id, analyze_signals(signals)))
+        except Exception:
+            logger.exception("Re-analysis of ECG %s failed", ecg_id)
+            results.append((ecg_id, None))
+    return results
+
+
+def _bytes(blob) -> Optional[bytes]:
+    """Copy a bytea value, which the driver may return as a memoryview, into picklable bytes."""
+    return bytes(blob) if blob is not None else None
+
+
+def _batches(params: dict, batch_size: int) -> Iterator[Batch]:
+    """Read the outdated records in batches, each with its own query resuming after the last ECG id read."""
+    params = {**params, "limit": batch_size}
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(_OUTDATED_BATCH, params).all()
+        if not rows:
+            return
+        # A record without leads comes back as one row whose lead columns are NULL
+        yield [
+            (ecg_id, [(row.identifier, row.signal, _bytes(row.signal_blob)) for row in leads if row.identifier])
+            for ecg_id, leads in itertools.groupby(rows, key=lambda row: row.ecg_id)
+        ]
+        params["after"] = rows[-1].ecg_id
+
+
+def _outdated_params(job: ReanalysisJob) -> dict:
+    return {"after": job.checkpoint, "force": job.force, "version": job.version}
+
+
+def lock_reanalysis() -> Connection:
+    """
+    Take the re-analysis lock on a connection of its own, to be handed to run_reanalysis.
+
+    The advisory lock belongs to the connection's session, not to a
+    transaction, so no transaction is kept open while it is held.
+
+    Raises:
+        HTTPException: If a job is already running, a 409 error is raised.
+
+    Returns:
+        Connection: The connection holding the lock.
+    """
+    locker = engine.connect()
+    try:
+        acquired = locker.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": REANALYSIS_LOCK_KEY}).scalar()
+        locker.commit()
+    except BaseException:
+        locker.close()
+        raise
+    if not acquired:
+        locker.close()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A re-analysis job is already running")
+    return locker
+
+
+def unlock_reanalysis(locker: Connection):
+    """
+    Release the re-analysis lock taken by lock_reanalysis and close its connection.
+
+    Args:
+        locker (Connection): The connection returned by lock_reanalysis.
+
+    Returns:
+        None
+    """
+    try:
+        locker.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": REANALYSIS_LOCK_KEY})
+        locker.commit()
+    finally:
+        locker.close()
+
+
+def job_progress(job: ReanalysisJob) -> dict:
+    """
+    Describe the progress of a job, with its throughput and estimated time to completion.
+
+    Args:
+        job (ReanalysisJob): The job.
+
+    Returns:
+        dict: The job's fields, its throughput in records per second and its ETA in seconds.
+    """
+    done = job.processed + job.failed
+    throughput = done / job.elapsed_seconds if job.elapsed_seconds else None
+    remaining = max(job.total - done, 0) if job.status != JobStatus.DONE else 0
+    return {
+        **job.model_dump(),
+        "remaining": remaining,
+        "throughput_per_second": throughput,
+        "eta_seconds": remaining / throughput if throughput else None,
+    }
+
+
+def start_reanalysis(session: Session, force: bool = False, max_rate: Optional[float] = None) -> ReanalysisJob:
+    """
+    Create a re-analysis job, or resume the last one if it did not complete.
+
+    The caller must hold the re-analysis lock, from lock_reanalysis, so no
+    other job is started or running meanwhile.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        force (bool): Recompute every record, not only those with outdated or failed insights (default is False).
+        max_rate (Optional[float]): The maximum number of records processed per second
+            (default is REANALYSIS_MAX_RATE, 0 for no cap).
+
+    Returns:
+        ReanalysisJob: The job to run with run_reanalysis.
+    """
+    max_rate = REANALYSIS_MAX_RATE if max_rate is None else max_rate
+    job = session.exec(select(ReanalysisJob).order_by(ReanalysisJob.id.desc())).first()
+    if job is None or job.status == JobStatus.DONE or (job.version, job.force) != (INSIGHTS_VERSION, force):
+        job = ReanalysisJob(version=INSIGHTS_VERSION, force=force)
+        job.total = session.exec(_COUNT_OUTDATED, params=_outdated_params(job)).scalar()
+
+    job.status, job.error, job.max_rate = JobStatus.RUNNING, None, max_rate or None
+    job.updated_at = datetime.now()
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def cancel_reanalysis(session: Session, job_id: int) -> ReanalysisJob:
+    """
+    Ask a running job to stop after its current batch. It can be resumed later.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        job_id (int): The ID of the job.
+
+    Raises:
+        HTTPException: If the job does not exist, a 404 error is raised.
+
+    Returns:
+        ReanalysisJob: The job.
+    """
+    job = retrieve_reanalysis(session, job_id)
+    if job.status == JobStatus.RUNNING:
+        job.status = JobStatus.CANCELLED
+        job.updated_at = datetime.now()
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+    return job
+
+
+def retrieve_reanalysis(session: Session, job_id: int) -> ReanalysisJob:
+    """
+    Retrieve a re-analysis job by its ID.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        job_id (int): The ID of the job.
+
+    Raises:
+        HTTPException: If the job does not exist, a 404 error is raised.
+
+    Returns:
+        ReanalysisJob: The job.
+    """
+    job = session.get(ReanalysisJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Re-analysis job not found")
+    return job
+
+
+def _write_batch(job_id: int, results: List[Tuple[int, Optional[dict]]], elapsed: float) -> bool:
+    """
+    Store the results of a batch and advance the job's checkpoint in one transaction.
+
+    Returns:
+        bool: False if the job was cancelled meanwhile, in which case nothing is written.
+    """
+    with Session(engine) as session:
+        job = session.get(ReanalysisJob, job_id, with_for_update=True)
+        if job.status != JobStatus.RUNNING:
+            return False
+
+        now = datetime.now()
+        rows = [
+            {"ecg_id": ecg_id, "status": InsightStatus.DONE if data is not None else InsightStatus.FAILED,
+             "version": job.version, "data": data if data is not None else {}, "computed_at": now}
+            for ecg_id, data in results
+        ]
+        statement = insert(ECGInsight)
+        session.exec(statement.on_conflict_do_update(
+            index_elements=[ECGInsight.ecg_id],
+            set_={column: statement.excluded[column] for column in ("status", "version", "data", "computed_at")},
+        ), params=rows)
+
+        failed = sum(data is None for _, data in results)
+        job.checkpoint = results[-1][0]
+        job.processed += len(results) - failed
+        job.failed += failed
+        job.elapsed_seconds += elapsed
+        job.updated_at = now
+        session.add(job)
+        session.commit()
+        return True
+
+
+def _finish(job_id: int, job_status: JobStatus, error: Optional[str] = None):
+    with Session(engine) as session:
+        job = session.get(ReanalysisJob, job_id, with_for_update=True)
+        if job.status == JobStatus.RUNNING:
+            job.status, job.error, job.updated_at = job_status, error, datetime.now()
+            session.add(job)
+        session.commit()
+
+
+def run_reanalysis(job_id: int, locker: Connection, workers: Optional[int] = None, batch_size: Optional[int] = None):
+    """
+    Run a re-analysis job until it completes, is cancelled or fails, then release the re-analysis lock.
+
+    Args:
+        job_id (int): The ID of the job, as returned by start_reanalysis.
+        locker (Connection): The connection holding the re-analysis lock, from lock_reanalysis.
+        workers (Optional[int]): The number of analysis processes (default is REANALYSIS_WORKERS).
+        batch_size (Optional[int]): The number of records per batch (default is REANALYSIS_BATCH_SIZE).
+
+    Returns:
+        None
+    """
+    workers = workers or REANALYSIS_WORKERS
+    batch_size = batch_size or REANALYSIS_BATCH_SIZE
+
+    try:
+        with Session(engine) as session:
+            job = session.get(ReanalysisJob, job_id)
+            params, max_rate = _outdated_params(job), job.max_rate
+        logger.info("Re-analysis job %s started after ECG %s", job_id, params["after"])
+
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            completed = _process(job_id, _batches(params, batch_size), executor, workers, max_rate)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        if completed:
+            _finish(job_id, JobStatus.DONE)
+        logger.info("Re-analysis job %s %s", job_id, "done" if completed else "cancelled")
+    except Exception as exc:
+        logger.exception("Re-analysis job %s failed", job_id)
+        _finish(job_id, JobStatus.FAILED, repr(exc))
+    finally:
+        unlock_reanalysis(locker)
+
+
+def _process(job_id: int, batches: Iterator[Batch], executor, workers: int, max_rate: Optional[float]) -> bool:
+    """
+    Analyse batches in the pool and write their results in order, a few batches ahead of the writes.
+
+    Returns:
+        bool: True if every batch was written, False if the job was cancelled.
+    """
+    in_flight = deque()
+    started = last_write = time.monotonic()
+    written = 0
+
+    for batch in itertools.chain(batches, [None]):
+        if batch is not None:
+            in_flight.append(executor.submit(analyze_batch, batch))
+            # Keep every worker busy while the oldest batch is written
+            if len(in_flight) <= workers:
+                continue
+        while in_flight and (batch is None or len(in_flight) > workers):
+            results = in_flight.popleft().result()
+            if max_rate:
+                # Stay under max_rate records per second since the job (re)started
+                time.sleep(max(0.0, (written + len(results)) / max_rate - (time.monotonic() - started)))
+            now = time.monotonic()
+            if not _write_batch(job_id, results, now - last_write):
+                return False
+            written += len(results)
+            last_write = now
+    return True
+
+
+def start_reanalysis_thread(job_id: int, locker: Connection) -> threading.Thread:
+    """
+    Run a re-analysis job in a daemon thread of the server process.
+
+    Args:
+        job_id (int): The ID of the job, as returned by start_reanalysis.
+        locker (Connection): The connection holding the re-analysis lock, now owned by the thread.
+
+    Returns:
+        threading.Thread: The started thread.
+    """
+    thread = threading.Thread(
+        target=run_reanalysis, args=(job_id, locker), name=f"reanalysis-{job_id}", daemon=True
+    )
+    thread.start()
+    return thread
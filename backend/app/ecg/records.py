@@ -0,0 +1,391 @@
+"""
+Read-only records served by the listing, signal and insight endpoints.
+
+These endpoints never modify what they read, so they bypass the ORM: rows are
+fetched with SQLAlchemy Core on the session's connection and copied into
+slotted dataclasses, with signals kept as NumPy arrays. Nothing is validated,
+tracked in the session's identity map or kept alive by the session once the
+response is sent, and orjson serializes the records natively.
+
+The hot reads also have ``*_async`` variants for an AsyncSession, sharing the
+same statements: their queries are awaited on the async driver and the
+decoding of signals runs in the threadpool, so the event loop only waits.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Integer, column, func, select, tuple_, values
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from auth.models import User
+
+from .codec import block_range, decode_signal
+from .models import ECG, ECGInsight, InsightStatus, Lead
+
+ecg_table = ECG.__table__
+lead_table = Lead.__table__
+insight_table = ECGInsight.__table__
+
+# Records whose streamed upload is still in progress are never read
+_COMPLETE = ecg_table.c.upload_activity.is_(None)
+
+# Upper bound used for open-ended slices of array signals
+MAX_SIGNAL_INDEX = 2 ** 31 - 1
+
+# Sample counts missing from older rows are read from the array header
+_NUMBER_OF_SAMPLES = func.coalesce(lead_table.c.number_of_samples, func.cardinality(lead_table.c.signal))
+
+
+@dataclass(slots=True)
+class LeadSummary:
+    """The identifier and sample count of a lead, without its signal."""
+    identifier: str
+    number_of_samples: Optional[int]
+
+
+@dataclass(slots=True)
+class LeadWindow:
+    """A window of a lead's signal: samples ``start`` to ``end`` of its ``number_of_samples``."""
+    identifier: str
+    number_of_samples: Optional[int]
+    start: int
+    end: int
+    signal: np.ndarray
+
+
+@dataclass(slots=True)
+class ECGRecord:
+    """An ECG record's metadata and the leads loaded with it."""
+    id: int
+    date: datetime
+    user_id: int
+    leads: list = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class InsightRecord:
+    """The stored insights of an ECG record."""
+    ecg_id: int
+    status: InsightStatus
+    version: int
+    data: dict
+
+
+@dataclass(slots=True)
+class ECGVersion:
+    """
+    What identifies the current content of an ECG record and of its insights.
+
+    ``insight_status`` is None for records stored before insights were, until
+    their insights are first read.
+    """
+    content_hash: Optional[str]
+    insight_status: Optional[InsightStatus]
+    insight_version: Optional[int]
+    computed_at: Optional[datetime]
+
+
+def _records(session: Session, statement) -> List[ECGRecord]:
+    return [ECGRecord(*row) for row in session.connection().execute(statement)]
+
+
+def fetch_ecg(session: Session, user: User, ecg_id: int) -> Optional[ECGRecord]:
+    """
+    Fetch the metadata of one of the user's ECG records.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        user (User): The user making the request.
+        ecg_id (int): The ID of the ECG record.
+
+    Returns:
+        Optional[ECGRecord]: The record without its leads, or None if the user has no such record.
+    """
+    records = _records(session, _ecg_statement(user, ecg_id))
+    return records[0] if records else None
+
+
+def _ecg_statement(user: User, ecg_id: int):
+    return select(ecg_table.c.id, ecg_table.c.date, ecg_table.c.user_id).where(
+        ecg_table.c.id == ecg_id, ecg_table.c.user_id == user.id, _COMPLETE
+    )
+
+
+def fetch_ecg_page(
+        session: Session,
+        user: User,
+        limit: int,
+        after: Optional[Tuple[datetime, int]] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+) -> List[ECGRecord]:
+    """
+    Fetch a page of the user's ECG records, newest first, by keyset on (date, id).
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        user (User): The user making the request.
+        limit (int): The maximum number of records to return.
+        after (Optional[Tuple[datetime, int]]): The date and ID of the last record of the previous page.
+        date_from (Optional[datetime]): Only return records dated at or after this date.
+        date_to (Optional[datetime]): Only return records dated before this date.
+
+    Returns:
+        List[ECGRecord]: The records of the page, without their leads.
+    """
+    return _records(session, _ecg_page_statement(user, limit, after, date_from, date_to))
+
+
+def _ecg_page_statement(
+        user: User,
+        limit: int,
+        after: Optional[Tuple[datetime, int]],
+        date_from: Optional[datetime],
+        date_to: Optional[datetime],
+):
+    columns = ecg_table.c
+    statement = select(columns.id, columns.date, columns.user_id).where(columns.user_id == user.id, _COMPLETE)
+    if after is not None:
+        statement = statement.where(tuple_(columns.date, columns.id) < tuple_(*after))
+    if date_from is not None:
+        statement = statement.where(columns.date >= date_from)
+    if date_to is not None:
+        statement = statement.where(columns.date < date_to)
+
+    return statement.order_by(columns.date.desc(), columns.id.desc()).limit(limit)
+
+
+def fetch_lead_summaries(session: Session, ecgs: Iterable[ECGRecord]):
+    """
+    Load the lead identifiers and sample counts of many records with a single query.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        ecgs (Iterable[ECGRecord]): The records, whose leads are filled in place.
+
+    Returns:
+        None
+    """
+    by_id = {ecg.id: ecg for ecg in ecgs}
+    if by_id:
+        _attach_lead_summaries(by_id, session.connection().execute(_lead_summaries_statement(by_id)))
+
+
+def _lead_summaries_statement(ecg_ids: Iterable[int]):
+    return (
+        select(lead_table.c.ecg_id, lead_table.c.identifier, _NUMBER_OF_SAMPLES)
+        .where(lead_table.c.ecg_id.in_(ecg_ids))
+        .order_by(lead_table.c.ecg_id, lead_table.c.id)
+    )
+
+
+def _attach_lead_summaries(by_id: dict, rows):
+    for ecg_id, identifier, samples in rows:
+        by_id[ecg_id].leads.append(LeadSummary(identifier, samples))
+
+
+def fetch_lead_windows(
+        session: Session,
+        ecg_id: int,
+        leads: Optional[List[str]] = None,
+        start: int = 0,
+        end: Optional[int] = None,
+) -> List[LeadWindow]:
+    """
+    Load a window of the signals of an ECG record's leads.
+
+    Array signals are sliced by Postgres. For bytea signals, the block index
+    locates the compressed blocks overlapping the window and only their bytes
+    are read, with substring(); blobs stored before the index existed are read
+    whole. Either way, only the requested part of each signal leaves the database.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        ecg_id (int): The ID of the ECG record.
+        leads (Optional[List[str]]): The identifiers of the leads to return (default is every lead).
+        start (int): The index of the first sample to return (default is 0).
+        end (Optional[int]): The index after the last sample to return (default is the end of the signal).
+
+    Returns:
+        List[LeadWindow]: The window of each lead, in lead order.
+    """
+    return list(_read_lead_windows(session, _lead_windows_statement(ecg_id, start, end, leads), start, end).values())
+
+
+def fetch_lead_windows_by_id(
+        session: Session, ecg_id: int, lead_ids: List[int], start: int = 0, end: Optional[int] = None
+) -> Dict[int, LeadWindow]:
+    """
+    Load a window of the signals of some of an ECG record's leads, keyed by lead ID.
+
+    Identifiers are not unique within a record, so callers holding lead IDs
+    read windows with this rather than with fetch_lead_windows.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        ecg_id (int): The ID of the ECG record.
+        lead_ids (List[int]): The IDs of the leads to return.
+        start (int): The index of the first sample to return (default is 0).
+        end (Optional[int]): The index after the last sample to return (default is the end of the signal).
+
+    Returns:
+        Dict[int, LeadWindow]: The window of each lead by lead ID, in lead order.
+    """
+    statement = _lead_windows_statement(ecg_id, start, end).where(lead_table.c.id.in_(lead_ids))
+    return _read_lead_windows(session, statement, start, end)
+
+
+def _read_lead_windows(session: Session, statement, start: int, end: Optional[int]) -> Dict[int, LeadWindow]:
+    connection = session.connection()
+    rows = connection.execute(statement).all()
+    ranges = _blob_ranges(rows, start, end)
+    blobs = _blobs(connection.execute(_blob_ranges_statement(ranges))) if ranges else {}
+    return dict(zip((row[0] for row in rows), _lead_windows(rows, blobs, start, end)))
+
+
+def _lead_windows_statement(ecg_id: int, start: int, end: Optional[int], leads: Optional[List[str]] = None):
+    # Postgres arrays are 1-based and their slices include both bounds
+    window = lead_table.c.signal[start + 1:end if end is not None else MAX_SIGNAL_INDEX]
+    statement = select(
+        lead_table.c.id, lead_table.c.identifier, _NUMBER_OF_SAMPLES, window, lead_table.c.block_offsets,
+        lead_table.c.signal_blob.is_not(None),
+    ).where(lead_table.c.ecg_id == ecg_id)
+    if leads is not None:
+        statement = statement.where(lead_table.c.identifier.in_(leads))
+    return statement.order_by(lead_table.c.id)
+
+
+def _blob_ranges(rows, start: int, end: Optional[int]) -> List[Tuple[int, int, int, int]]:
+    """Return the byte range of each bytea lead: (lead ID, first block sample, 1-based first byte, length)."""
+    ranges = []
+    for lead_id, _, _, _, offsets, is_blob in rows:
+        if not is_blob:
+            continue
+        if offsets is None:
+            ranges.append((lead_id, 0, 1, MAX_SIGNAL_INDEX))
+        else:
+            first_sample, first_byte, last_byte = block_range(offsets, start, end)
+            ranges.append((lead_id, first_sample, first_byte + 1, last_byte - first_byte))
+    return ranges
+
+
+def _blob_ranges_statement(ranges: List[Tuple[int, int, int, int]]):
+    """Read byte ranges of several leads' blobs with one query."""
+    wanted = values(
+        column("lead_id", Integer), column("first_sample", Integer), column("first_byte", Integer),
+        column("length", Integer), name="wanted",
+    ).data(ranges)
+    return select(
+        wanted.c.lead_id, wanted.c.first_sample,
+        func.substring(lead_table.c.signal_blob, wanted.c.first_byte, wanted.c.length),
+    ).join(lead_table, lead_table.c.id == wanted.c.lead_id)
+
+
+def _blobs(rows) -> dict:
+    """Key the blob ranges read by lead ID, with their first sample."""
+    return {lead_id: (first_sample, blob) for lead_id, first_sample, blob in rows}
+
+
+def _lead_windows(rows, blobs: dict, start: int, end: Optional[int]) -> List[LeadWindow]:
+    """Decode the windows read by fetch_lead_windows into NumPy arrays."""
+    windows = []
+    for lead_id, identifier, samples, signal, _, is_blob in rows:
+        if is_blob:
+            first_sample, blob = blobs[lead_id]
+            signal = decode_signal(blob, max(start - first_sample, 0), None if end is None else end - first_sample)
+        else:
+            signal = np.array(signal if signal is not None else (), dtype=np.int32)
+        windows.append(LeadWindow(identifier, samples, start, start + len(signal), signal))
+    return windows
+
+
+async def fetch_ecg_async(session: AsyncSession, user: User, ecg_id: int) -> Optional[ECGRecord]:
+    """The fetch_ecg of an AsyncSession."""
+    connection = await session.connection()
+    records = [ECGRecord(*row) for row in await connection.execute(_ecg_statement(user, ecg_id))]
+    return records[0] if records else None
+
+
+async def fetch_ecg_page_async(
+        session: AsyncSession,
+        user: User,
+        limit: int,
+        after: Optional[Tuple[datetime, int]] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+) -> List[ECGRecord]:
+    """The fetch_ecg_page of an AsyncSession."""
+    connection = await session.connection()
+    statement = _ecg_page_statement(user, limit, after, date_from, date_to)
+    return [ECGRecord(*row) for row in await connection.execute(statement)]
+
+
+async def fetch_lead_summaries_async(session: AsyncSession, ecgs: Iterable[ECGRecord]):
+    """The fetch_lead_summaries of an AsyncSession."""
+    by_id = {ecg.id: ecg for ecg in ecgs}
+    if by_id:
+        connection = await session.connection()
+        _attach_lead_summaries(by_id, await connection.execute(_lead_summaries_statement(by_id)))
+
+
+async def fetch_lead_windows_async(
+        session: AsyncSession,
+        ecg_id: int,
+        leads: Optional[List[str]] = None,
+        start: int = 0,
+        end: Optional[int] = None,
+) -> List[LeadWindow]:
+    """The fetch_lead_windows of an AsyncSession, decoding the signals in the threadpool."""
+    connection = await session.connection()
+    rows = (await connection.execute(_lead_windows_statement(ecg_id, start, end, leads))).all()
+    ranges = _blob_ranges(rows, start, end)
+    blobs = _blobs(await connection.execute(_blob_ranges_statement(ranges))) if ranges else {}
+    return await run_in_threadpool(_lead_windows, rows, blobs, start, end)
+
+
+def fetch_insight(session: Session, user: User, ecg_id: int) -> Optional[InsightRecord]:
+    """
+    Fetch the stored insights of one of the user's ECG records, without loading its leads.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        user (User): The user making the request.
+        ecg_id (int): The ID of the ECG record.
+
+    Returns:
+        Optional[InsightRecord]: The stored insights, or None if there are none.
+    """
+    columns = insight_table.c
+    statement = (
+        select(columns.ecg_id, columns.status, columns.version, columns.data)
+        .join(ecg_table, ecg_table.c.id == columns.ecg_id)
+        .where(columns.ecg_id == ecg_id, ecg_table.c.user_id == user.id, _COMPLETE)
+    )
+    row = session.connection().execute(statement).first()
+    return InsightRecord(*row) if row is not None else None
+
+
+def fetch_ecg_version(session: Session, user: User, ecg_id: int) -> Optional[ECGVersion]:
+    """
+    Fetch the version of one of the user's ECG records and of its insights, by primary key.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        user (User): The user making the request.
+        ecg_id (int): The ID of the ECG record.
+
+    Returns:
+        Optional[ECGVersion]: The version of the record, or None if the user has no such record.
+    """
+    columns = insight_table.c
+    statement = (
+        select(ecg_table.c.content_hash, columns.status, columns.version, columns.computed_at)
+        .select_from(ecg_table.outerjoin(insight_table, columns.ecg_id == ecg_table.c.id))
+        .where(ecg_table.c.id == ecg_id, ecg_table.c.user_id == user.id, _COMPLETE)
+    )
+    row = session.connection().execute(statement).first()
+    return ECGVersion(*row) if row is not None else None
@@ -0,0 +1,272 @@
+import dataclasses
+import hashlib
+import io
+from typing import Iterable, List, Optional
+from urllib.parse import quote
+
+import msgpack
+import numpy as np
+import orjson
+from fastapi import HTTPException, Request, Response, status
+
+from .analytics import INSIGHTS_VERSION
+from .models import InsightStatus
+from .records import ECGRecord, ECGVersion, LeadWindow
+
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+OCTET_STREAM = "application/octet-stream"
+NPY = "application/x-npy"
+
+# Media types able to represent any response, and those that can only hold signals
+DOCUMENT_MEDIA_TYPES = [JSON, MSGPACK]
+SIGNAL_MEDIA_TYPES = [JSON, MSGPACK, OCTET_STREAM, NPY]
+
+# Bumped whenever the serialized form of a resource changes, so stale cache entries are not revalidated
+REPRESENTATION_VERSION = 3
+
+# The one dtype of every signal array in MessagePack documents, wide enough for any stored sample
+MSGPACK_SIGNAL_DTYPE = np.dtype("<i4")
+
+# Signals never change once their upload is complete; insights are revalidated as a re-analysis may replace them
+IMMUTABLE = "private, max-age=31536000, immutable"
+REVALIDATE = "private, no-cache"
+NO_STORE = "private, no-store"
+
+
+def negotiate(request: Request, offered: List[str] = DOCUMENT_MEDIA_TYPES) -> str:
+    """
+    Pick the response media type from the request's Accept header.
+
+    Args:
+        request (Request): The incoming request.
+        offered (List[str]): The media types the endpoint can produce, preferred first.
+
+    Raises:
+        HTTPException: If none of the offered media types is acceptable, a 406 error is raised.
+
+    Returns:
+        str: The selected media type.
+    """
+    accept = request.headers.get("accept")
+    if not accept:
+        return offered[0]
+
+    ranges = []
+    for position, item in enumerate(accept.split(",")):
+        media_range, *parameters = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((-quality, position, media_range.lower()))
+
+    for negative_quality, _, media_range in sorted(ranges):
+        if negative_quality == 0:
+            break
+        if media_range in ("*/*", "application/*"):
+            return offered[0]
+        if media_range in offered:
+            return media_range
+
+    raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=f"Available formats: {', '.join(offered)}")
+
+
+def _signal_dtype(signals: Iterable[np.ndarray]) -> np.dtype:
+    """Return int16 if every sample fits in it, otherwise int32, both little-endian."""
+    for signal in signals:
+        if signal.size and (signal.min() < np.iinfo(np.int16).min or signal.max() > np.iinfo(np.int16).max):
+            return np.dtype("<i4")
+    return np.dtype("<i2")
+
+
+def _signal_headers(leads: List[LeadWindow], dtype: np.dtype) -> dict:
+    """Describe the layout of a binary signal response in its headers."""
+    return {
+        # Identifiers are free text: percent-encoding keeps commas unambiguous and the header latin-1
+        "X-ECG-Leads": ",".join(quote(lead.identifier, safe="") for lead in leads),
+        "X-ECG-Samples": ",".join(str(len(lead.signal)) for lead in leads),
+        "X-ECG-Start": ",".join(str(lead.start) for lead in leads),
+        "X-ECG-Dtype": dtype.str,
+    }
+
+
+def document_response(content: dict, media_type: str, headers: Optional[dict] = None) -> Response:
+    """
+    Serialize a response document as JSON or MessagePack.
+
+    NumPy arrays are written by orjson straight from their buffer in JSON, and
+    as raw bytes of MSGPACK_SIGNAL_DTYPE (little-endian int32) in MessagePack,
+    whatever their values, so clients decode every array the same way. Records
+    are written as maps of their fields.
+
+    Args:
+        content (dict): The response document.
+        media_type (str): JSON or MSGPACK.
+        headers (Optional[dict]): Extra response headers, e.g. cache_headers.
+
+    Returns:
+        Response: The serialized response.
+    """
+    if media_type == MSGPACK:
+        body = msgpack.packb(content, default=_msgpack_default, datetime=False)
+    else:
+        body = orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def _msgpack_default(value):
+    if isinstance(value, np.ndarray):
+        return value.astype(MSGPACK_SIGNAL_DTYPE, copy=False).tobytes()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if dataclasses.is_dataclass(value):
+        return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def signals_response(message: str, ecg: ECGRecord, media_type: str, headers: Optional[dict] = None) -> Response:
+    """
+    Serialize an ECG record returned by retrieve_ecg_signals in the negotiated format.
+
+    With ``application/octet-stream`` the body is the concatenation of the lead
+    signals; with ``application/x-npy`` it is a 2-D .npy array of one
+    zero-padded row per lead. In both cases the lead identifiers, sample
+    counts, window starts and dtype are sent in comma-separated X-ECG-*
+    headers, with each identifier percent-encoded (UTF-8).
+
+    Args:
+        message (str): The message of JSON and MessagePack responses.
+        ecg (ECGRecord): The ECG record and its lead windows.
+        media_type (str): One of SIGNAL_MEDIA_TYPES.
+        headers (Optional[dict]): Extra response headers, e.g. cache_headers.
+
+    Returns:
+        Response: The serialized response.
+    """
+    if media_type in DOCUMENT_MEDIA_TYPES:
+        return document_response({"message": message, "data": ecg}, media_type, headers)
+
+    leads = ecg.leads
+    dtype = _signal_dtype(lead.signal for lead in leads)
+    headers = {**_signal_headers(leads, dtype), **(headers or {})}
+
+    if media_type == OCTET_STREAM:
+        body = b"".join(lead.signal.astype(dtype, copy=False).tobytes() for lead in leads)
+    else:
+        matrix = np.zeros((len(leads), max((len(lead.signal) for lead in leads), default=0)), dtype=dtype)
+        for row, lead in enumerate(leads):
+            matrix[row, :len(lead.signal)] = lead.signal
+        buffer = io.BytesIO()
+        np.save(buffer, matrix, allow_pickle=False)
+        body = buffer.getvalue()
+
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def entity_tag(*parts) -> str:
+    """
+    Build a strong ETag from the parts identifying a representation.
+
+    Args:
+        *parts: The resource's id and version and the parameters the representation depends on.
+
+    Returns:
+        str: The quoted entity tag.
+    """
+    digest = hashlib.sha256(repr((REPRESENTATION_VERSION, *parts)).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def signals_etag(version: Optional[ECGVersion], ecg_id: int, media_type: str, **window) -> Optional[str]:
+    """
+    Return the ETag of an ECG record's signals, or None if the record does not exist.
+
+    Args:
+        version (Optional[ECGVersion]): The version of the record, None if it does not exist.
+        ecg_id (int): The ID of the ECG record.
+        media_type (str): The negotiated media type.
+        **window: The leads, start and end of the requested window.
+
+    Returns:
+        Optional[str]: The entity tag of the representation.
+    """
+    if version is None:
+        return None
+    return entity_tag("signals", ecg_id, version.content_hash, media_type, sorted(window.items()))
+
+
+def insights_etag(
+        version: Optional[ECGVersion], ecg_id: int, media_type: str, metrics: Optional[List[str]]
+) -> Optional[str]:
+    """
+    Return the ETag of an ECG record's stored insights, or None if they are not up to date.
+
+    Args:
+        version (Optional[ECGVersion]): The version of the record, None if it does not exist.
+        ecg_id (int): The ID of the ECG record.
+        media_type (str): The negotiated media type.
+        metrics (Optional[List[str]]): The requested metrics.
+
+    Returns:
+        Optional[str]: The entity tag of the representation.
+    """
+    if version is None or version.insight_status != InsightStatus.DONE or version.insight_version != INSIGHTS_VERSION:
+        return None
+    return entity_tag("insights", ecg_id, version.insight_version, version.computed_at, media_type, metrics)
+
+
+def matches_etag(request: Request, etag: Optional[str]) -> bool:
+    """
+    Tell whether the request's If-None-Match header matches an entity tag.
+
+    Args:
+        request (Request): The incoming request.
+        etag (Optional[str]): The entity tag of the current representation, if any.
+
+    Returns:
+        bool: True if the client's copy is current, so a 304 response can be sent.
+    """
+    header = request.headers.get("if-none-match")
+    if etag is None or not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, which ignores the W/ prefix
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def cache_headers(etag: Optional[str], cache_control: str) -> dict:
+    """
+    Return the ETag, Cache-Control and Vary headers of a cacheable response.
+
+    Args:
+        etag (Optional[str]): The entity tag of the representation, if any.
+        cache_control (str): The Cache-Control directives, used only when there is an ETag.
+
+    Returns:
+        dict: The headers to send.
+    """
+    if etag is None:
+        return {"Cache-Control": NO_STORE}
+    return {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept, Authorization"}
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    """
+    Build the 304 response telling the client its cached copy is current.
+
+    Args:
+        etag (str): The entity tag of the representation.
+        cache_control (str): The Cache-Control directives of the representation.
+
+    Returns:
+        Response: The empty response.
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag, cache_control))
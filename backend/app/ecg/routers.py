@@ -1,11 +1,32 @@
-from fastapi import APIRouter, Depends
-from typing import List
+from datetime import datetime
 
-from db import SessionDep
-from auth.utils import UserRequired, user_required
+import anyio
+from fastapi import (
+    APIRouter, BackgroundTasks, Body, Depends, Header, HTTPException, Query, Request, WebSocket, status
+)
+from starlette.concurrency import run_in_threadpool
+from typing import Annotated, Any, List, Optional
+
+from db import SessionDep, run_db
+from auth.utils import UserRequired, WebSocketUserRequired, admin_required, user_required, websocket_subprotocol
 
 from .models import Lead
-from .crud import create_ecg, retrieve_ecgs, retrieve_ecg_by_id, compute_insights
+from .crud import (
+    AGGREGATE_PERIODS, DEFAULT_OVERVIEW_POINTS, DEFAULT_PAGE_SIZE, MAX_BULK_SIZE, MAX_OVERVIEW_POINTS, MAX_PAGE_SIZE,
+    create_ecg, create_ecg_pending, create_ecgs_bulk, validate_bulk_items, retrieve_ecg_summaries, retrieve_ecg_signals,
+    retrieve_ecg_overview, retrieve_ecg_version, aggregate_ecgs, compute_insights, retrieve_insight_status
+)
+from .responses import (
+    IMMUTABLE, REVALIDATE, SIGNAL_MEDIA_TYPES, cache_headers, document_response, insights_etag, matches_etag,
+    negotiate, not_modified, signals_etag, signals_response
+)
+from .live import run_live_session
+from .reanalysis import (
+    cancel_reanalysis, job_progress, lock_reanalysis, retrieve_reanalysis, start_reanalysis, start_reanalysis_thread,
+    unlock_reanalysis,
+)
+from .streaming import receive_upload
+from .worker import run_analysis
 
 ecg_router = APIRouter(
     prefix="/ecg",
@@ -13,69 +34,451 @@ ecg_router = APIRouter(
 )
 
 
-@ecg_router.get("/get_all", description="Retrieve all ECG records.")
-async def get_ecgs(user: UserRequired, session: SessionDep):
+@ecg_router.get("/get_all", description="Retrieve a page of ECG records, without their signals.")
+async def get_ecgs(
+        request: Request,
+        user: UserRequired,
+        session: SessionDep,
+        limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+):
     """
-    Retrieve all ECG records from the database. Requires user role.
+    Retrieve a page of ECG records, newest first. Requires user role.
+
+    Only metadata is returned: the lead identifiers and sample counts of each
+    record, never their signals. The response is JSON or MessagePack depending
+    on the Accept header.
 
     Args:
+        request (Request): The incoming request, used for content negotiation.
         user (UserRequired): The authenticated user making the request.
         session (SessionDep): The database session dependency.
+        limit (int): The maximum number of records to return.
+        cursor (Optional[str]): The next_cursor returned with the previous page.
+        date_from (Optional[datetime]): Only return records dated at or after this date.
+        date_to (Optional[datetime]): Only return records dated before this date.
 
     Returns:
-        dict: A dictionary containing a message and all ECG records.
+        dict: A dictionary containing a message, a page of ECG records and the cursor of the next page.
     """
-    response = retrieve_ecgs(user, session)
+    media_type = negotiate(request)
+    response = await run_db(
+        session, retrieve_ecg_summaries, user, limit=limit, cursor=cursor, date_from=date_from, date_to=date_to
+    )
 
-    return {"message": "All ecgs", "data": response}
+    return document_response({"message": "All ecgs", **response}, media_type)
 
 
-@ecg_router.get("/get/{ecg_id}", description="Retrieve ECG record by its ID.")
-async def get_ecg(user: UserRequired, ecg_id: int, session: SessionDep):
+@ecg_router.get("/aggregate", description="Summarize the user's ECG records per day, week or month.")
+async def get_aggregate(
+        request: Request,
+        user: UserRequired,
+        session: SessionDep,
+        period: Annotated[str, Query(pattern=f"^({'|'.join(AGGREGATE_PERIODS)})$")] = "day",
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+):
     """
-    Retrieve a specific ECG record by its ID. Requires user role.
+    Summarize the user's ECG records per period from their stored insights. Requires user role.
 
     Args:
+        request (Request): The incoming request, used for content negotiation.
+        user (UserRequired): The authenticated user making the request.
+        session (SessionDep): The database session dependency.
+        period (str): "day", "week" or "month".
+        date_from (Optional[datetime]): Only include records dated at or after this date.
+        date_to (Optional[datetime]): Only include records dated before this date.
+
+    Returns:
+        dict: A dictionary containing the statistics of each period.
+    """
+    media_type = negotiate(request)
+    response = await run_db(session, aggregate_ecgs, user, period=period, date_from=date_from, date_to=date_to)
+    return document_response({"message": f"ECG statistics per {period}", **response}, media_type)
+
+
+@ecg_router.get("/get/{ecg_id}", description="Retrieve ECG record by its ID, optionally restricted to some leads and samples.")
+async def get_ecg(
+        request: Request,
+        user: UserRequired,
+        ecg_id: int,
+        session: SessionDep,
+        leads: Annotated[Optional[List[str]], Query()] = None,
+        start: Annotated[int, Query(ge=0)] = 0,
+        end: Annotated[Optional[int], Query(ge=0)] = None,
+):
+    """
+    Retrieve a specific ECG record by its ID with its lead signals. Requires user role.
+
+    The Accept header selects the format: JSON (default), MessagePack, raw
+    signals (application/octet-stream) or a .npy array (application/x-npy).
+    MessagePack signals are always little-endian int32 bytes; the binary
+    formats send their dtype in the X-ECG-Dtype header and their lead
+    identifiers, percent-encoded and comma-separated, in X-ECG-Leads.
+
+    Complete records never change, so responses carry a strong ETag and may be
+    cached privately for good; a request whose If-None-Match matches it is
+    answered with 304 after a single primary key lookup.
+
+    Args:
+        request (Request): The incoming request, used for content negotiation.
         user (UserRequired): The authenticated user making the request.
         ecg_id (int): The ID of the ECG record to retrieve.
         session (SessionDep): The database session dependency.
+        leads (Optional[List[str]]): The identifiers of the leads to return (default is every lead).
+        start (int): The index of the first sample to return (default is 0).
+        end (Optional[int]): The index after the last sample to return (default is the end of the signal).
 
     Returns:
         dict: A dictionary containing the ECG record associated with the specified ID.
     """
-    response = retrieve_ecg_by_id(user, session, ecg_id)
-    return {"message": f"ECG with ID: {ecg_id}", "data": response}
+    if end is not None and end < start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end must not be lower than start")
+
+    media_type = negotiate(request, SIGNAL_MEDIA_TYPES)
+    version = await run_db(session, retrieve_ecg_version, user, ecg_id=ecg_id)
+    etag = signals_etag(version, ecg_id, media_type, leads=leads, start=start, end=end)
+    if matches_etag(request, etag):
+        return not_modified(etag, IMMUTABLE)
+
+    response = await run_db(session, retrieve_ecg_signals, user, ecg_id=ecg_id, leads=leads, start=start, end=end)
+    return signals_response(f"ECG with ID: {ecg_id}", response, media_type, cache_headers(etag, IMMUTABLE))
+
+
+@ecg_router.get("/overview/{ecg_id}", description="Retrieve a min/max overview of an ECG record's signals for drawing.")
+async def get_ecg_overview(
+        request: Request,
+        user: UserRequired,
+        ecg_id: int,
+        session: SessionDep,
+        points: Annotated[int, Query(ge=1, le=MAX_OVERVIEW_POINTS)] = DEFAULT_OVERVIEW_POINTS,
+        leads: Annotated[Optional[List[str]], Query()] = None,
+        start: Annotated[int, Query(ge=0)] = 0,
+        end: Annotated[Optional[int], Query(ge=0)] = None,
+):
+    """
+    Retrieve at most ``points`` min/max pairs per lead for a window of an ECG record. Requires user role.
+
+    Drawing a vertical line from each point's min to its max renders the
+    waveform as it would look from every sample. Windows with no more samples
+    than points return the samples themselves (min equals max).
+
+    Args:
+        request (Request): The incoming request, used for content negotiation.
+        user (UserRequired): The authenticated user making the request.
+        ecg_id (int): The ID of the ECG record to retrieve.
+        session (SessionDep): The database session dependency.
+        points (int): The maximum number of points per lead, e.g. the width of the plot in pixels.
+        leads (Optional[List[str]]): The identifiers of the leads to return (default is every lead).
+        start (int): The index of the first sample of the window (default is 0).
+        end (Optional[int]): The index after the last sample of the window (default is the end of the signal).
+
+    Returns:
+        dict: A dictionary containing the overview of each lead.
+    """
+    if end is not None and end < start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end must not be lower than start")
+
+    media_type = negotiate(request)
+    response = await run_db(
+        session, retrieve_ecg_overview, user, ecg_id=ecg_id, points=points, leads=leads, start=start, end=end
+    )
+    return document_response({"message": f"Overview of ECG with ID: {ecg_id}", "data": response}, media_type)
 
 
 @ecg_router.post("/create", description="Create a new ECG record from leads.")
-async def create_ecg_from_leads(leads: List[Lead], user: UserRequired, session: SessionDep):
+async def create_ecg_from_leads(
+        leads: List[Lead],
+        user: UserRequired,
+        session: SessionDep,
+        idempotency_key: Annotated[Optional[str], Header(min_length=1, max_length=255)] = None,
+):
     """
     Create a new ECG record from a list of leads. Requires user role.
 
+    Retried or repeated uploads of the same leads, or with the same
+    Idempotency-Key header, return the existing record instead of a copy.
+
     Args:
         leads (List[Lead]): A list of Lead objects to associate with the new ECG record.
         user (UserRequired): The authenticated user creating the ECG record.
         session (SessionDep): The database session dependency.
+        idempotency_key (Optional[str]): The Idempotency-Key header identifying the upload across retries.
 
     Returns:
         dict: A dictionary confirming the creation of the new ECG record.
     """
-    response = create_ecg(user, session, leads)
+    response = await run_db(session, create_ecg, user, leads=leads, idempotency_key=idempotency_key)
     return {"data": response, "message": "Created ecg"}
 
 
+@ecg_router.post("/create_bulk", description="Create many ECG records from leads in a single transaction.")
+async def create_ecgs_from_leads(
+        ecgs: Annotated[List[Any], Body(max_length=MAX_BULK_SIZE)],
+        user: UserRequired,
+        session: SessionDep,
+        # Leaves room for the ":{index}" suffix of each record's key
+        idempotency_key: Annotated[Optional[str], Header(min_length=1, max_length=240)] = None,
+):
+    """
+    Create many ECG records at once, e.g. a device's backlog. Requires user role.
+
+    Each item is validated on its own: invalid items are reported and skipped
+    while the valid ones are stored together. Items the user already stored,
+    and retries of a request with the same Idempotency-Key header, get the ids
+    of the existing records.
+
+    Args:
+        ecgs (List[Any]): The records to create, each given as {"leads": [...]}.
+        user (UserRequired): The authenticated user creating the ECG records.
+        session (SessionDep): The database session dependency.
+        idempotency_key (Optional[str]): The Idempotency-Key header identifying the request across retries.
+
+    Returns:
+        dict: The assigned ECG ids in request order (None for invalid items) and the validation errors.
+    """
+    valid, errors = validate_bulk_items(ecgs)
+    created = await run_db(
+        session, create_ecgs_bulk, user, ecgs=[leads for _, leads in valid], idempotency_key=idempotency_key
+    )
+
+    ids = [None] * len(ecgs)
+    for (index, _), ecg_id in zip(valid, created):
+        ids[index] = ecg_id
+
+    return {"message": f"Created {len(created)} ecgs", "data": {"ids": ids, "errors": errors}}
+
+
+@ecg_router.post(
+    "/ingest",
+    status_code=status.HTTP_202_ACCEPTED,
+    description="Store a new ECG record and compute its insights in the background.",
+)
+async def ingest_ecg_from_leads(
+        leads: List[Lead],
+        user: UserRequired,
+        session: SessionDep,
+        background_tasks: BackgroundTasks,
+        idempotency_key: Annotated[Optional[str], Header(min_length=1, max_length=255)] = None,
+):
+    """
+    Store a new ECG record and schedule the computation of its insights. Requires user role.
+
+    Retried or repeated uploads of the same leads, or with the same
+    Idempotency-Key header, return the existing record instead of a copy.
+
+    Args:
+        leads (List[Lead]): A list of Lead objects to associate with the new ECG record.
+        user (UserRequired): The authenticated user creating the ECG record.
+        session (SessionDep): The database session dependency.
+        background_tasks (BackgroundTasks): Used to schedule the analysis after the response.
+        idempotency_key (Optional[str]): The Idempotency-Key header identifying the upload across retries.
+
+    Returns:
+        dict: A dictionary with the new ECG id and the pending insight status.
+    """
+    ecg = await run_db(session, create_ecg_pending, user, leads=leads, idempotency_key=idempotency_key)
+    background_tasks.add_task(run_analysis, ecg.id)
+    return {"message": "Accepted ecg", "data": {"ecg_id": ecg.id, "status": "pending"}}
+
+
+@ecg_router.post("/upload", description="Create a new ECG record from a streamed, chunked upload.")
+async def upload_ecg(request: Request, user: UserRequired, session: SessionDep, background_tasks: BackgroundTasks):
+    """
+    Create a new ECG record from a signal streamed in chunks. Requires user role.
+
+    The body starts with a JSON header line naming the leads, e.g.
+    ``{"leads": ["I", "II"]}``. With ``Content-Type: application/x-ndjson`` every
+    following line maps lead identifiers to samples to append. With
+    ``Content-Type: application/octet-stream`` the header is followed by frames
+    of one little-endian int16 sample per lead, in header order.
+
+    Args:
+        request (Request): The incoming request, whose body is read as a stream.
+        user (UserRequired): The authenticated user creating the ECG record.
+        session (SessionDep): The database session dependency.
+        background_tasks (BackgroundTasks): Used to schedule the analysis after the response.
+
+    Returns:
+        dict: A dictionary confirming the creation of the new ECG record.
+    """
+    response = await receive_upload(request, user, session)
+    background_tasks.add_task(run_analysis, response.id)
+    return {"data": response, "message": "Created ecg"}
+
+
+@ecg_router.websocket("/live")
+async def live_ecg(
+        websocket: WebSocket,
+        user: WebSocketUserRequired,
+        session: SessionDep,
+        every: Annotated[Optional[int], Query(ge=1)] = None,
+):
+    """
+    Monitor a live ECG stream over a WebSocket and record it. Requires user role.
+
+    The first message names the leads, e.g. ``{"leads": ["I", "II"]}``. Every
+    following message appends samples, either as JSON mapping lead identifiers
+    to samples or as binary frames of one little-endian int16 sample per lead.
+    Insights are pushed every ``every`` samples, and the stream is stored as an
+    ECG record, analysed like an upload, once the client closes the connection.
+
+    The JWT is sent in the Authorization header or, from browsers, as the
+    subprotocols ``["bearer", token]``.
+
+    Args:
+        websocket (WebSocket): The WebSocket connection.
+        user (WebSocketUserRequired): The authenticated user streaming the ECG record.
+        session (SessionDep): The database session dependency.
+        every (Optional[int]): The number of samples per lead between two insight updates.
+
+    Returns:
+        None
+    """
+    await websocket.accept(subprotocol=websocket_subprotocol(websocket))
+    ecg = await run_live_session(websocket, user, session, every)
+    if ecg is not None:
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(run_analysis, ecg.id)
+
+
+@ecg_router.get("/insight_status/{ecg_id}", description="Retrieve the insight status of a specific ECG record.")
+async def get_insight_status(ecg_id: int, user: UserRequired, session: SessionDep):
+    """
+    Report whether the insights of an ECG record are pending, done or failed.
+
+    Args:
+        ecg_id (int): The ID of the ECG record.
+        user (UserRequired): The authenticated user making the request.
+        session (SessionDep): The database session dependency.
+
+    Returns:
+        dict: A dictionary containing the insight status of the ECG record.
+    """
+    response = await run_db(session, retrieve_insight_status, user, ecg_id=ecg_id)
+    return {"message": f"Insight status for ecg_id: {ecg_id}", "data": response}
+
+
 @ecg_router.get("/get_insight/{ecg_id}", description="Retrieve insights for a specific ECG record.")
-async def get_insight(ecg_id: int, user: UserRequired, session: SessionDep):
+async def get_insight(
+        request: Request,
+        ecg_id: int,
+        user: UserRequired,
+        session: SessionDep,
+        metrics: Annotated[Optional[List[str]], Query()] = None,
+):
     """
-    Retrieve insights for a specific ECG record.
+    Retrieve insights for a specific ECG record, as JSON or MessagePack.
+
+    Insights are never computed by this read: pending, outdated or missing
+    insights are answered with 409 and failed ones with 422, until the
+    analysis worker or the re-analysis job recomputes them.
+
+    Up-to-date insights carry a strong ETag and must be revalidated, as a
+    re-analysis may replace them; a request whose If-None-Match matches it is
+    answered with 304 after a single primary key lookup.
 
     Args:
+        request (Request): The incoming request, used for content negotiation.
         ecg_id (int): The ID of the ECG record to compute insights for.
         user (UserRequired): The authenticated user making the request.
         session (SessionDep): The database session dependency.
+        metrics (Optional[List[str]]): The metrics to return, repeated or comma-separated
+            (default is every metric: zero_crossings, stats, heart_rate, baseline_wander and signal_quality).
 
     Returns:
         dict: A dictionary containing the computed insights for the ECG record.
     """
-    response = compute_insights(user, session, ecg_id)
-    return {"message": f"Insight for ecg_id: {ecg_id}", "data": response}
+    media_type = negotiate(request)
+    version = await run_db(session, retrieve_ecg_version, user, ecg_id=ecg_id)
+    etag = insights_etag(version, ecg_id, media_type, metrics)
+    if matches_etag(request, etag):
+        return not_modified(etag, REVALIDATE)
+
+    response = await run_db(session, compute_insights, user, ecg_id=ecg_id, metrics=metrics)
+    return document_response(
+        {"message": f"Insight for ecg_id: {ecg_id}", "data": response}, media_type, cache_headers(etag, REVALIDATE)
+    )
+
+
+@ecg_router.post(
+    "/reanalysis",
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(admin_required)],
+    description="Recompute the insights of the stored ECG records in a background job.",
+)
+async def create_reanalysis(
+        session: SessionDep,
+        force: bool = False,
+        max_rate: Annotated[Optional[float], Query(ge=0)] = None,
+):
+    """
+    Start a job recomputing outdated or failed insights, or resume the last one. Restricted to Admin users.
+
+    The job runs in a thread of this server process, with its own pool of
+    REANALYSIS_WORKERS processes, so it is meant for small backlogs; large
+    ones are run with ``python migrate.py reanalyze`` outside the servers.
+
+    Args:
+        session (SessionDep): The database session dependency.
+        force (bool): Recompute every record, including those already at the current insight version.
+        max_rate (Optional[float]): The maximum number of records processed per second, 0 for no cap.
+
+    Raises:
+        HTTPException: If a job is already running, a 409 error is raised.
+
+    Returns:
+        dict: A dictionary with the progress of the started job.
+    """
+    locker = await run_in_threadpool(lock_reanalysis)
+    try:
+        job = await run_db(session, start_reanalysis, force=force, max_rate=max_rate)
+    except BaseException:
+        await run_in_threadpool(unlock_reanalysis, locker)
+        raise
+    start_reanalysis_thread(job.id, locker)
+    return {"message": f"Started re-analysis job {job.id}", "data": job_progress(job)}
+
+
+@ecg_router.get(
+    "/reanalysis/{job_id}",
+    dependencies=[Depends(admin_required)],
+    description="Retrieve the progress of a re-analysis job.",
+)
+async def get_reanalysis(job_id: int, session: SessionDep):
+    """
+    Report the progress, throughput and ETA of a re-analysis job. Restricted to Admin users.
+
+    Args:
+        job_id (int): The ID of the job.
+        session (SessionDep): The database session dependency.
+
+    Returns:
+        dict: A dictionary with the progress of the job.
+    """
+    job = await run_db(session, retrieve_reanalysis, job_id=job_id)
+    return {"message": f"Re-analysis job {job_id}", "data": job_progress(job)}
+
+
+@ecg_router.post(
+    "/reanalysis/{job_id}/cancel",
+    dependencies=[Depends(admin_required)],
+    description="Stop a re-analysis job after its current batch.",
+)
+async def stop_reanalysis(job_id: int, session: SessionDep):
+    """
+    Stop a running re-analysis job after its current batch. Restricted to Admin users.
+
+    The job keeps its checkpoint and is resumed by the next POST /ecg/reanalysis.
+
+    Args:
+        job_id (int): The ID of the job.
+        session (SessionDep): The database session dependency.
+
+    Returns:
+        dict: A dictionary with the progress of the job.
+    """
+    job = await run_db(session, cancel_reanalysis, job_id=job_id)
+    return {"message": f"Re-analysis job {job_id} {job.status.value}", "data": job_progress(job)}
@@ -0,0 +1,460 @@
+import json
+import os
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+import numpy as np
+from fastapi import HTTPException, Request, status
+from sqlalchemy import delete, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from auth.models import User
+from db import sync_session_for
+
+from . import codec
+from .models import ECG, ECGInsight, InsightStatus, Lead, LeadChunk
+from .utils import SignalHasher, combine_lead_hashes
+
+# Samples buffered per lead before they are written as a chunk
+FLUSH_SAMPLES = 16 * codec.BLOCK_SIZE
+
+# Longest header or NDJSON line accepted, in bytes
+MAX_LINE_BYTES = 16 * 1024 * 1024
+
+# Incomplete uploads that wrote no samples for this long are deleted by sweep_abandoned_uploads
+ABANDONED_UPLOAD_MINUTES = float(os.getenv("ABANDONED_UPLOAD_MINUTES", 60))
+
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+BINARY_CONTENT_TYPE = "application/octet-stream"
+
+_FINALIZE_ARRAY = text("""
+    UPDATE lead SET
+        signal = COALESCE((
+            SELECT array_agg(u.value ORDER BY c.seq, u.ord)
+            FROM lead_chunk c CROSS JOIN LATERAL unnest(c.signal) WITH ORDINALITY AS u(value, ord)
+            WHERE c.lead_id = lead.id
+        ), '{}'),
+        signal_blob = NULL,
+        number_of_samples = (SELECT COALESCE(sum(c.number_of_samples), 0) FROM lead_chunk c WHERE c.lead_id = lead.id)
+    WHERE lead.id = ANY(:lead_ids)
+""")
+
+_FINALIZE_BLOB = text("""
+    UPDATE lead SET
+        signal = NULL,
+        signal_blob = COALESCE((
+            SELECT string_agg(c.signal_blob, ''::bytea ORDER BY c.seq) FROM lead_chunk c WHERE c.lead_id = lead.id
+        ), ''::bytea),
+        number_of_samples = (SELECT COALESCE(sum(c.number_of_samples), 0) FROM lead_chunk c WHERE c.lead_id = lead.id)
+    WHERE lead.id = ANY(:lead_ids)
+""")
+
+
+def _unprocessable(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=detail)
+
+
+def _parse_samples(samples) -> np.ndarray:
+    """
+    Validate the samples of a lead decoded from JSON as a flat list of int32 integers.
+
+    Raises:
+        HTTPException: If they are not a list of integers within int32, a 422 error is raised.
+    """
+    if not isinstance(samples, list):
+        raise _unprocessable("Samples must be lists of integers")
+    if not samples:
+        return np.empty(0, dtype=np.int32)
+    try:
+        # Integers become an int64 or uint64 array; floats, booleans, nested lists or huge integers do not
+        array = np.array(samples)
+    except (ValueError, TypeError, OverflowError):
+        raise _unprocessable("Samples must be lists of integers")
+    if array.ndim != 1 or array.dtype.kind not in "iu":
+        raise _unprocessable("Samples must be lists of integers")
+    if array.min() < np.iinfo(np.int32).min or array.max() > np.iinfo(np.int32).max:
+        raise _unprocessable("Samples must fit in 32-bit integers")
+    return array.astype(np.int32)
+
+
+class ECGStreamWriter:
+    """
+    Writes an ECG record incrementally while its signal is being received.
+
+    Samples are buffered per lead and written as LeadChunk rows once enough of
+    them have accumulated. When the stream ends, the chunks are concatenated
+    into the lead rows inside the database, so the recording is never held in
+    memory as a whole and the final rows match those of a regular create. The
+    content hash is computed as the samples arrive, so a stream repeating one
+    of the user's records resolves to that record, like a repeated create.
+
+    Until then the record's upload_activity is set, which hides it from every
+    read, and refreshed by every flush; records of uploads that crashed are
+    deleted by sweep_abandoned_uploads once they are old enough.
+
+    Attributes:
+        ecg (ECG): The ECG record being written.
+        ecg_id (int): The ID of the ECG record, usable even once an abandoned record was deleted.
+        lead_ids (Dict[str, int]): The lead ID of each lead identifier.
+    """
+
+    def __init__(self, user: User, session: Session, identifiers: List[str], flush_samples: Optional[int] = None):
+        self.session = session
+        self.flush_samples = flush_samples or FLUSH_SAMPLES
+        self.storage = codec.SIGNAL_STORAGE
+
+        leads = [Lead(identifier=identifier, number_of_samples=0) for identifier in identifiers]
+        self.ecg = ECG(date=datetime.now(), leads=leads, user_id=user.id, upload_activity=datetime.now())
+        session.add(self.ecg)
+        session.commit()
+
+        self.ecg_id = self.ecg.id
+        self.user_id = user.id
+        self.lead_ids = {lead.identifier: lead.id for lead in leads}
+        self._hashers = {identifier: SignalHasher() for identifier in identifiers}
+        self._buffers: Dict[str, List[np.ndarray]] = {identifier: [] for identifier in identifiers}
+        self._buffered = dict.fromkeys(identifiers, 0)
+        self._next_seq = dict.fromkeys(identifiers, 0)
+        # Leads with samples outside the int16 range fall back to the array column
+        self._array_leads = set() if self.storage == "bytea" else set(identifiers)
+        self._block_offsets = {identifier: [0] for identifier in identifiers}
+
+    def append(self, identifier: str, samples: np.ndarray):
+        """
+        Buffer samples at the end of a lead's signal.
+
+        Args:
+            identifier (str): The identifier of the lead.
+            samples (np.ndarray): The samples to append.
+
+        Raises:
+            HTTPException: If the lead is not part of the upload, a 422 error is raised.
+
+        Returns:
+            None
+        """
+        if identifier not in self._buffers:
+            raise _unprocessable(f"Unknown lead: {identifier}")
+        if len(samples):
+            self._buffers[identifier].append(samples)
+            self._buffered[identifier] += len(samples)
+            self._hashers[identifier].update(samples)
+
+    def _flush_threshold(self, identifier: str) -> int:
+        """Return the number of samples a lead buffers before they are written, at least a block for bytea leads."""
+        return self.flush_samples if identifier in self._array_leads else max(self.flush_samples, codec.BLOCK_SIZE)
+
+    @property
+    def needs_flush(self) -> bool:
+        """bool: Whether a lead has buffered enough samples to be written."""
+        return any(count >= self._flush_threshold(identifier) for identifier, count in self._buffered.items())
+
+    def flush(self, final: bool = False):
+        """
+        Write the buffered samples as chunks and commit them.
+
+        Args:
+            final (bool): Write every buffered sample, not only full buffers (default is False).
+
+        Returns:
+            None
+        """
+        # The record is locked first, so a concurrent sweep either skips it or deletes it before any chunk is added
+        self._mark_upload(datetime.now())
+        for identifier, buffered in self._buffered.items():
+            if not buffered or (buffered < self._flush_threshold(identifier) and not final):
+                continue
+
+            samples = np.concatenate(self._buffers[identifier])
+            rest = samples[:0]
+            if identifier not in self._array_leads and not final:
+                # Bytea chunks hold full blocks only, so block k of the assembled blob starts at sample k * BLOCK_SIZE
+                samples, rest = np.split(samples, [len(samples) - len(samples) % codec.BLOCK_SIZE])
+
+            chunk = LeadChunk(
+                lead_id=self.lead_ids[identifier], seq=self._next_seq[identifier], number_of_samples=len(samples)
+            )
+            if identifier not in self._array_leads and codec.fits_int16(samples):
+                chunk.signal_blob = codec.encode_signal(samples)
+                offsets = self._block_offsets[identifier]
+                offsets.extend(offsets[-1] + offset for offset in codec.block_offsets(chunk.signal_blob)[1:])
+            else:
+                self._demote_to_array(identifier)
+                chunk.signal = samples.tolist()
+
+            self.session.add(chunk)
+            self._buffers[identifier] = [rest] if len(rest) else []
+            self._buffered[identifier] = len(rest)
+            self._next_seq[identifier] += 1
+
+        self.session.commit()
+
+    def _mark_upload(self, activity: Optional[datetime]):
+        """
+        Set the record's upload_activity, None once the upload is complete.
+
+        Raises:
+            HTTPException: If the record was deleted as abandoned meanwhile, a 410 error is raised.
+        """
+        result = self.session.exec(
+            update(ECG).where(ECG.id == self.ecg_id, ECG.upload_activity.is_not(None)).values(upload_activity=activity)
+        )
+        if not result.rowcount:
+            raise HTTPException(status_code=status.HTTP_410_GONE, detail="The upload expired")
+
+    def _demote_to_array(self, identifier: str):
+        """Rewrite the chunks already encoded for a lead as arrays."""
+        if identifier in self._array_leads:
+            return
+        self._array_leads.add(identifier)
+
+        for seq in range(self._next_seq[identifier]):
+            chunk = self.session.get(LeadChunk, (self.lead_ids[identifier], seq))
+            chunk.signal = codec.decode_signal(chunk.signal_blob).tolist()
+            chunk.signal_blob = None
+            self.session.add(chunk)
+            self.session.flush()
+            self.session.expunge(chunk)
+
+    def finish(self) -> ECG:
+        """
+        Write the remaining samples and assemble the lead signals from their chunks.
+
+        If the user already has a record with the same content, the upload is
+        deleted and that record is returned instead.
+
+        Returns:
+            ECG: The completed ECG record, whose insights are pending, or the existing record with the same content.
+        """
+        self.flush(final=True)
+        digest = combine_lead_hashes((identifier, self._hashers[identifier]) for identifier in self.lead_ids)
+        existing = self._find_existing(digest)
+        if existing is not None:
+            return existing
+
+        self._mark_upload(None)
+        try:
+            self.session.exec(update(ECG).where(ECG.id == self.ecg_id).values(content_hash=digest))
+        except IntegrityError:
+            # The same content was completed concurrently, e.g. by a retried upload
+            self.session.rollback()
+            existing = self._find_existing(digest)
+            if existing is not None:
+                return existing
+            raise
+
+        array_ids = [self.lead_ids[identifier] for identifier in self._array_leads]
+        blob_ids = [lead_id for identifier, lead_id in self.lead_ids.items() if identifier not in self._array_leads]
+        if array_ids:
+            self.session.exec(_FINALIZE_ARRAY, params={"lead_ids": array_ids})
+        if blob_ids:
+            self.session.exec(_FINALIZE_BLOB, params={"lead_ids": blob_ids})
+            self.session.exec(update(Lead), params=[
+                {"id": self.lead_ids[identifier], "block_offsets": offsets}
+                for identifier, offsets in self._block_offsets.items() if identifier not in self._array_leads
+            ])
+
+        self.session.exec(delete(LeadChunk).where(LeadChunk.lead_id.in_(self.lead_ids.values())))
+        self.session.add(ECGInsight(ecg_id=self.ecg_id, status=InsightStatus.PENDING, version=0))
+        self.session.commit()
+        self.session.refresh(self.ecg)
+
+        return self.ecg
+
+    def _find_existing(self, digest: str) -> Optional[ECG]:
+        """Return the user's complete record with this content hash, after deleting the upload, if there is one."""
+        existing_id = self.session.exec(
+            select(ECG.id).where(ECG.user_id == self.user_id, ECG.content_hash == digest, ECG.id != self.ecg_id)
+        ).first()
+        if existing_id is None:
+            return None
+        self.abort()
+        return self.session.get(ECG, existing_id)
+
+    def abort(self):
+        """
+        Delete everything written for an upload that could not be completed.
+
+        Returns:
+            None
+        """
+        self.session.rollback()
+        lead_ids = list(self.lead_ids.values())
+        self.session.exec(delete(LeadChunk).where(LeadChunk.lead_id.in_(lead_ids)))
+        self.session.exec(delete(Lead).where(Lead.id.in_(lead_ids)))
+        self.session.exec(delete(ECG).where(ECG.id == self.ecg_id))
+        self.session.commit()
+
+
+def sweep_abandoned_uploads(session: Session, older_than: Optional[timedelta] = None) -> int:
+    """
+    Delete the records of streamed uploads that stopped writing samples, e.g. because their worker crashed.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        older_than (Optional[timedelta]): How long an upload may write no samples
+            (default is ABANDONED_UPLOAD_MINUTES).
+
+    Returns:
+        int: The number of records deleted.
+    """
+    cutoff = datetime.now() - (older_than if older_than is not None else timedelta(minutes=ABANDONED_UPLOAD_MINUTES))
+    # Uploads writing right now hold their record's row lock and are skipped
+    ecg_ids = session.exec(
+        select(ECG.id).where(ECG.upload_activity < cutoff).with_for_update(skip_locked=True)
+    ).all()
+    if not ecg_ids:
+        session.rollback()
+        return 0
+
+    lead_ids = select(Lead.id).where(Lead.ecg_id.in_(ecg_ids))
+    session.exec(delete(LeadChunk).where(LeadChunk.lead_id.in_(lead_ids)))
+    session.exec(delete(Lead).where(Lead.ecg_id.in_(ecg_ids)))
+    session.exec(delete(ECG).where(ECG.id.in_(ecg_ids)))
+    session.commit()
+    return len(ecg_ids)
+
+
+def _parse_header(line: bytes) -> List[str]:
+    """Return the lead identifiers named by an upload's header line."""
+    try:
+        identifiers = json.loads(line)["leads"]
+    except (ValueError, TypeError, KeyError):
+        raise _unprocessable('The first line must be a JSON header like {"leads": ["I", "II"]}')
+
+    if (not isinstance(identifiers, list) or not identifiers
+            or not all(isinstance(identifier, str) for identifier in identifiers)):
+        raise _unprocessable("The header must name at least one lead")
+    if len(set(identifiers)) != len(identifiers):
+        raise _unprocessable("Lead identifiers must be unique")
+    return identifiers
+
+
+async def _iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines."""
+    buffer = bytearray()
+    async for data in stream:
+        buffer.extend(data)
+        start = 0
+        while (end := buffer.find(b"\n", start)) != -1:
+            yield bytes(buffer[start:end])
+            start = end + 1
+        del buffer[:start]
+        if len(buffer) > MAX_LINE_BYTES:
+            raise _unprocessable("Line too long")
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _iter_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator:
+    """
+    Parse an NDJSON upload.
+
+    The first line is the header; every following line is an object mapping
+    lead identifiers to the samples to append to them.
+    """
+    lines = _iter_lines(stream)
+    async for line in lines:
+        yield _parse_header(line)
+        break
+    else:
+        raise _unprocessable("Empty upload")
+
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            chunk = json.loads(line)
+        except ValueError:
+            chunk = None
+        if not isinstance(chunk, dict):
+            raise _unprocessable("Every line must map lead identifiers to lists of integers")
+        yield {identifier: _parse_samples(samples) for identifier, samples in chunk.items()}
+
+
+async def _iter_binary(stream: AsyncIterator[bytes]) -> AsyncIterator:
+    """
+    Parse a binary upload.
+
+    The body starts with a JSON header line, followed by frames holding one
+    little-endian int16 sample per lead, in header order.
+    """
+    buffer = bytearray()
+    identifiers = None
+    frame_size = 0
+
+    async for data in stream:
+        buffer.extend(data)
+
+        if identifiers is None:
+            end = buffer.find(b"\n")
+            if end == -1:
+                if len(buffer) > MAX_LINE_BYTES:
+                    raise _unprocessable("Header too long")
+                continue
+            identifiers = _parse_header(bytes(buffer[:end]))
+            frame_size = 2 * len(identifiers)
+            del buffer[:end + 1]
+            yield identifiers
+
+        usable = len(buffer) - len(buffer) % frame_size
+        if usable:
+            frames = np.frombuffer(bytes(buffer[:usable]), dtype="<i2").reshape(-1, len(identifiers))
+            del buffer[:usable]
+            yield {identifier: frames[:, column] for column, identifier in enumerate(identifiers)}
+
+    if identifiers is None:
+        raise _unprocessable("Empty upload")
+    if buffer:
+        raise _unprocessable("The body ends with an incomplete frame")
+
+
+async def receive_upload(request: Request, user: User, session: Union[Session, AsyncSession]) -> ECG:
+    """
+    Store an ECG record streamed in the request body.
+
+    The body is either NDJSON (``application/x-ndjson``) or raw int16 frames
+    (``application/octet-stream``), both starting with a JSON header line
+    naming the leads. Database writes run in the threadpool.
+
+    Args:
+        request (Request): The incoming request.
+        user (User): The user creating the ECG record.
+        session (Union[Session, AsyncSession]): The request's database session.
+
+    Raises:
+        HTTPException: If the content type is not supported, a 415 error is raised.
+            If the body is malformed, a 422 error is raised.
+
+    Returns:
+        ECG: The created ECG record, including the assigned id and timestamp.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_CONTENT_TYPES:
+        chunks = _iter_ndjson(request.stream())
+    elif content_type == BINARY_CONTENT_TYPE:
+        chunks = _iter_binary(request.stream())
+    else:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Unsupported content type")
+
+    with sync_session_for(session) as sync_session:
+        writer = None
+        try:
+            async for chunk in chunks:
+                if writer is None:
+                    writer = await run_in_threadpool(ECGStreamWriter, user, sync_session, chunk)
+                    continue
+
+                for identifier, samples in chunk.items():
+                    writer.append(identifier, samples)
+                if writer.needs_flush:
+                    await run_in_threadpool(writer.flush)
+
+            return await run_in_threadpool(writer.finish)
+        except BaseException:
+            if writer is not None:
+                await run_in_threadpool(writer.abort)
+            raise
@@ -0,0 +1,188 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from db import engine
+from metrics import INSIGHT_DURATION
+
+from .codec import decode_signal
+from .crud import store_insights
+from .models import ECGInsight, InsightStatus, Lead
+from .pyramid import store_pyramids
+from .analytics import INSIGHTS_VERSION, analyze_leads
+
+logger = logging.getLogger(__name__)
+
+# Number of processes analysing ECGs in the background (0 analyses in the calling thread)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Insights pending for longer than this were lost with the process analysing them, and are analysed again
+STALE_PENDING_MINUTES = float(os.getenv("STALE_PENDING_MINUTES", 15))
+
+_executor: Optional[Executor] = None
+
+
+def get_executor() -> Optional[Executor]:
+    """
+    Return the process pool used to analyse ECGs, creating it on first use.
+
+    Returns:
+        Optional[Executor]: The process pool, or None if ANALYSIS_WORKERS is 0.
+    """
+    global _executor
+
+    if _executor is None and ANALYSIS_WORKERS > 0:
+        # Spawned workers do not inherit the server's threads or open connections
+        _executor = ProcessPoolExecutor(
+            max_workers=ANALYSIS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor():
+    """
+    Shut down the analysis process pool, if it was started.
+
+    Returns:
+        None
+    """
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def analyze_signals(signals: List[Tuple[str, np.ndarray]]) -> dict:
+    """
+    Compute the insights of an ECG from plain (identifier, signal) pairs.
+
+    This runs inside the worker processes, so it only receives picklable data.
+
+    Args:
+        signals (List[Tuple[str, np.ndarray]]): The identifier and signal of each lead.
+
+    Returns:
+        dict: A dictionary containing insights (e.g., zero-crossings) for the ECG.
+    """
+    return analyze_leads([Lead(identifier=identifier, signal=signal) for identifier, signal in signals])
+
+
+def read_lead_signals(session: Session, ecg_id: int) -> List[Tuple[int, str, np.ndarray]]:
+    """
+    Read the signals of an ECG record's leads one lead at a time, as compact NumPy arrays.
+
+    Only one lead's row is fetched at a time, so the Python list of an array
+    signal is released before the next lead is read, and the record is only
+    ever held as int16 (bytea) or int32 (array) samples.
+
+    Args:
+        session (Session): SQLModel session used to interact with the database.
+        ecg_id (int): The ID of the ECG record.
+
+    Returns:
+        List[Tuple[int, str, np.ndarray]]: The ID, identifier and samples of each lead, in lead order.
+    """
+    connection = session.connection()
+    leads = connection.execute(
+        select(Lead.id, Lead.identifier).where(Lead.ecg_id == ecg_id).order_by(Lead.id)
+    ).all()
+
+    signals = []
+    for lead_id, identifier in leads:
+        signal, blob = connection.execute(select(Lead.signal, Lead.signal_blob).where(Lead.id == lead_id)).one()
+        if blob is not None:
+            samples = decode_signal(blob)
+        else:
+            samples = np.array(signal if signal is not None else (), dtype=np.int32)
+        del signal, blob
+        signals.append((lead_id, identifier, samples))
+    return signals
+
+
+def run_analysis(ecg_id: int):
+    """
+    Compute and store the insights of an ECG record in the analysis pool, and build its waveform pyramids.
+
+    Meant to be run as a background task once the ECG has been persisted.
+    Signals are read one lead at a time by read_lead_signals, and only their
+    arrays are sent to the analysis pool. The insight row is marked as failed
+    if the analysis raises; if even that write fails, e.g. because the record
+    was deleted meanwhile, the error is logged and the analysis given up.
+    Records whose current insights are already stored, e.g. a repeated upload
+    resolved to an existing record, are skipped.
+
+    Args:
+        ecg_id (int): The ID of the ECG record to analyse.
+
+    Returns:
+        None
+    """
+    with Session(engine) as session:
+        insight = session.get(ECGInsight, ecg_id)
+        if insight is not None and insight.status == InsightStatus.DONE and insight.version == INSIGHTS_VERSION:
+            return
+        try:
+            leads = read_lead_signals(session, ecg_id)
+            signals = [(identifier, signal) for _, identifier, signal in leads]
+
+            executor = get_executor()
+            with INSIGHT_DURATION.labels("worker").time():
+                if executor is None:
+                    data = analyze_signals(signals)
+                else:
+                    data = executor.submit(analyze_signals, signals).result()
+
+            store_insights(session, ecg_id, data)
+            store_pyramids(session, [(lead_id, signal) for lead_id, _, signal in leads])
+            session.commit()
+        except Exception:
+            logger.exception("Analysis of ECG %s failed", ecg_id)
+            session.rollback()
+            try:
+                store_insights(session, ecg_id, {}, status=InsightStatus.FAILED)
+                session.commit()
+            except Exception:
+                logger.exception("Could not mark the analysis of ECG %s as failed, giving up", ecg_id)
+                session.rollback()
+
+
+def recover_pending_analyses(older_than: Optional[timedelta] = None) -> int:
+    """
+    Analyse again the ECG records whose insights stayed pending, because the process analysing them stopped.
+
+    The stale rows are claimed by moving their computed_at to now, so
+    concurrent replicas skip them until they are stale again.
+
+    Args:
+        older_than (Optional[timedelta]): How long insights must have been pending
+            (default is STALE_PENDING_MINUTES).
+
+    Returns:
+        int: The number of ECG records analysed again.
+    """
+    if older_than is None:
+        older_than = timedelta(minutes=STALE_PENDING_MINUTES)
+    now = datetime.now()
+
+    with Session(engine) as session:
+        ecg_ids = session.exec(
+            update(ECGInsight)
+            .where(ECGInsight.status == InsightStatus.PENDING, ECGInsight.computed_at <= now - older_than)
+            .values(computed_at=now)
+            .returning(ECGInsight.ecg_id)
+        ).scalars().all()
+        session.commit()
+
+    for ecg_id in ecg_ids:
+        logger.warning("Analysing ECG %s again, its insights were pending since before %s", ecg_id, now - older_than)
+        run_analysis(ecg_id)
+    return len(ecg_ids)
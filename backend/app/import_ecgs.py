@@ -0,0 +1,336 @@
+"""
+Offline bulk import of ECG recordings with Postgres COPY.
+
+Every subdirectory of DIRECTORY is one recording, holding one file per lead
+named after its identifier: ``II.csv`` (integer samples separated by commas
+or newlines) or ``II.npy`` (a 1-D integer array), with samples within the
+32-bit range of the signal column. Directories without lead files or with an
+invalid one are reported and skipped. The recording date is read
+from an optional ``metadata.json`` (``{"date": "2024-05-01T10:30:00"}``) and
+otherwise from the modification time of the newest lead file. Rows are written
+exactly as the API would write them, including the configured signal storage,
+content hash, stored insights and waveform pyramids, and are owned by the given
+user.
+
+Usage:
+    python import_ecgs.py /data/archive --username alice --workers 8 --batch-size 200
+
+Progress is checkpointed after each committed batch, so an interrupted import
+resumes where it stopped when run again with the same checkpoint file. A batch
+committed just before a crash is not yet in the checkpoint; its recordings are
+recognised by their content hash and skipped when the import resumes.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+from multiprocessing import Pool
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlmodel import Session
+
+from auth.utils import get_user_by_username
+from db import engine
+from ecg import codec
+from ecg.models import InsightStatus, Lead
+from ecg.analytics import INSIGHTS_VERSION, analyze_leads
+from ecg.pyramid import build_pyramid
+from ecg.utils import STANDARD_LEAD_ORDER, content_hash
+
+LEAD_EXTENSIONS = (".csv", ".npy")
+METADATA_FILE = "metadata.json"
+
+
+@dataclass(slots=True)
+class PreparedRecording:
+    """
+    A recording read from its directory, with the COPY fields of its rows.
+
+    Attributes:
+        name (str): The name of the recording's directory, as stored in the checkpoint.
+        date (datetime): The date of the recording.
+        digest (str): The content hash of its leads.
+        leads (List[tuple]): The fields of each lead row (identifier, number_of_samples, signal, signal_blob,
+            block_offsets).
+        pyramids (List[List[tuple]]): The fields of each pyramid level of each lead (level, number_of_buckets,
+            minimum, maximum).
+        insights (dict): The insights of the recording.
+    """
+    name: str
+    date: datetime
+    digest: str
+    leads: List[tuple]
+    pyramids: List[List[tuple]]
+    insights: dict
+
+
+def _lead_order(identifier: str) -> Tuple[int, str]:
+    # Standard leads come first; other identifiers follow alphabetically
+    if identifier in STANDARD_LEAD_ORDER:
+        return STANDARD_LEAD_ORDER.index(identifier), identifier
+    return len(STANDARD_LEAD_ORDER), identifier
+
+
+def read_lead_file(path: str) -> np.ndarray:
+    """
+    Read the samples of one lead from a .csv or .npy file.
+
+    Args:
+        path (str): The path of the lead file.
+
+    Raises:
+        ValueError: If the file does not hold integers within the int32 range of the signal column.
+
+    Returns:
+        np.ndarray: The samples of the lead.
+    """
+    try:
+        if path.endswith(".npy"):
+            samples = np.load(path, allow_pickle=False).ravel()
+        else:
+            with open(path) as file:
+                samples = np.array(file.read().replace(",", " ").split(), dtype=np.int64)
+    except (ValueError, OverflowError) as exc:
+        raise ValueError(f"{os.path.basename(path)}: {exc}")
+
+    if samples.dtype.kind not in "iu":
+        raise ValueError(f"{os.path.basename(path)}: samples must be integers, not {samples.dtype}")
+    if samples.size and (samples.min() < np.iinfo(np.int32).min or samples.max() > np.iinfo(np.int32).max):
+        raise ValueError(f"{os.path.basename(path)}: samples must fit in 32-bit integers")
+    return samples.astype(np.int64)
+
+
+def read_recording_date(path: str, files: List[str]) -> datetime:
+    """
+    Read the date of a recording from its metadata file, or from the modification time of its lead files.
+
+    Args:
+        path (str): The directory of the recording.
+        files (List[str]): The names of its lead files.
+
+    Returns:
+        datetime: The date of the recording.
+    """
+    metadata = os.path.join(path, METADATA_FILE)
+    if os.path.exists(metadata):
+        with open(metadata) as file:
+            date = json.load(file).get("date")
+        if date is not None:
+            return datetime.fromisoformat(date)
+
+    return datetime.fromtimestamp(max(os.path.getmtime(os.path.join(path, name)) for name in files))
+
+
+def _copy_text(value) -> str:
+    """Format a value as a field of COPY's text format."""
+    if value is None:
+        return r"\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _array_text(values) -> str:
+    """Format integers as a Postgres array literal."""
+    return "{" + ",".join(map(str, values)) + "}"
+
+
+def prepare_recording(path: str) -> PreparedRecording:
+    """
+    Read a recording and build its lead rows, pyramids, content hash and insights.
+
+    Runs in the reader processes, so the parsing, encoding and analysis of
+    recordings happen in parallel.
+
+    Args:
+        path (str): The directory of the recording.
+
+    Raises:
+        ValueError: If the directory has no lead file, or one of them is invalid.
+
+    Returns:
+        PreparedRecording: The recording and the COPY fields of its rows.
+    """
+    files = sorted(
+        (name for name in os.listdir(path) if name.endswith(LEAD_EXTENSIONS)),
+        key=lambda name: _lead_order(os.path.splitext(name)[0]),
+    )
+    if not files:
+        raise ValueError("no lead file")
+
+    leads = [
+        Lead(identifier=os.path.splitext(name)[0], signal=read_lead_file(os.path.join(path, name)).tolist())
+        for name in files
+    ]
+    date = read_recording_date(path, files)
+    digest = content_hash(leads)
+    insights = analyze_leads(leads)
+
+    rows, pyramids = [], []
+    for lead in leads:
+        lead.number_of_samples = len(lead.signal)
+        pyramids.append([
+            (level, len(minimum), _array_text(minimum.tolist()), _array_text(maximum.tolist()))
+            for level, minimum, maximum in build_pyramid(np.asarray(lead.signal, dtype=np.int32))
+        ])
+        codec.apply_signal_storage(lead)
+        signal = _array_text(lead.signal) if lead.signal is not None else None
+        blob = "\\x" + lead.signal_blob.hex() if lead.signal_blob is not None else None
+        offsets = _array_text(lead.block_offsets) if lead.block_offsets is not None else None
+        rows.append((lead.identifier, lead.number_of_samples, signal, blob, offsets))
+
+    return PreparedRecording(os.path.basename(path), date, digest, rows, pyramids, insights)
+
+
+def _prepare_or_skip(path: str) -> Tuple[str, Optional[PreparedRecording], Optional[str]]:
+    """Prepare a recording in a reader process, returning why it is skipped instead of raising."""
+    try:
+        return os.path.basename(path), prepare_recording(path), None
+    except ValueError as exc:
+        return os.path.basename(path), None, str(exc)
+
+
+def load_checkpoint(path: str) -> set:
+    """Return the names of the recordings already imported."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as file:
+        return set(json.load(file)["done"])
+
+
+def save_checkpoint(path: str, done: set):
+    """Atomically record the names of the recordings already imported."""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump({"done": sorted(done)}, file)
+    os.replace(temporary, path)
+
+
+def copy_batch(user_id: int, batch: List[PreparedRecording]) -> int:
+    """
+    Write a batch of prepared recordings with COPY in a single transaction.
+
+    Recordings the user already has, with the same content hash, are skipped,
+    so a batch committed before a crash but missing from the checkpoint is not
+    written twice.
+
+    Args:
+        user_id (int): The ID of the user who owns the recordings.
+        batch (List[PreparedRecording]): Recordings returned by prepare_recording.
+
+    Returns:
+        int: The number of recordings written.
+    """
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT content_hash FROM ecg WHERE user_id = %s AND content_hash = ANY(%s)",
+            (user_id, [recording.digest for recording in batch]),
+        )
+        stored = {row[0] for row in cursor.fetchall()}
+        recordings = []
+        for recording in batch:
+            if recording.digest not in stored:
+                stored.add(recording.digest)
+                recordings.append(recording)
+        if not recordings:
+            connection.rollback()
+            return 0
+
+        # Ids are drawn ahead so the lead and pyramid rows can reference them
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence('ecg', 'id')) FROM generate_series(1, %s)", (len(recordings),)
+        )
+        ecg_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence('lead', 'id')) FROM generate_series(1, %s)",
+            (sum(len(recording.leads) for recording in recordings),),
+        )
+        lead_ids = iter([row[0] for row in cursor.fetchall()])
+        now = datetime.now().isoformat()
+
+        ecgs, leads, pyramids, insights = io.StringIO(), io.StringIO(), io.StringIO(), io.StringIO()
+        for ecg_id, recording in zip(ecg_ids, recordings):
+            ecgs.write("\t".join(_copy_text(value) for value in (
+                ecg_id, recording.date.isoformat(), user_id, recording.digest
+            )) + "\n")
+            for row, levels in zip(recording.leads, recording.pyramids):
+                lead_id = next(lead_ids)
+                leads.write("\t".join(_copy_text(value) for value in (lead_id, *row, ecg_id)) + "\n")
+                for level in levels:
+                    pyramids.write("\t".join(_copy_text(value) for value in (lead_id, *level)) + "\n")
+            insights.write("\t".join(_copy_text(value) for value in (
+                ecg_id, InsightStatus.DONE.name, INSIGHTS_VERSION, json.dumps(recording.insights), now
+            )) + "\n")
+
+        for table, columns, buffer in (
+                ("ecg", "id, date, user_id, content_hash", ecgs),
+                ("lead", "id, identifier, number_of_samples, signal, signal_blob, block_offsets, ecg_id", leads),
+                ("lead_pyramid", "lead_id, level, number_of_buckets, minimum, maximum", pyramids),
+                ("ecg_insight", "ecg_id, status, version, data, computed_at", insights),
+        ):
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buffer)
+
+        connection.commit()
+        return len(recordings)
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directory holding one subdirectory per recording")
+    parser.add_argument("--username", required=True, help="Owner of the imported recordings")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parallel reader processes")
+    parser.add_argument("--batch-size", type=int, default=100, help="Recordings written per COPY transaction")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default is DIRECTORY/.import_checkpoint.json)")
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        user = get_user_by_username(session, args.username)
+    if user is None:
+        sys.exit(f"Unknown user: {args.username}")
+
+    checkpoint = args.checkpoint or os.path.join(args.directory, ".import_checkpoint.json")
+    done = load_checkpoint(checkpoint)
+    paths = sorted(
+        os.path.join(args.directory, name) for name in os.listdir(args.directory)
+        if name not in done and os.path.isdir(os.path.join(args.directory, name))
+    )
+    print(f"{len(paths)} recordings to import, {len(done)} already imported")
+
+    imported = skipped = 0
+    with Pool(args.workers) as pool:
+        batch = []
+        for name, recording, reason in pool.imap(_prepare_or_skip, paths, chunksize=4):
+            if recording is None:
+                # Skipped recordings stay out of the checkpoint, so they are read again once fixed
+                print(f"Skipped {name}: {reason}", flush=True)
+                skipped += 1
+                continue
+            batch.append(recording)
+            if len(batch) >= args.batch_size:
+                imported += copy_batch(user.id, batch)
+                done.update(recording.name for recording in batch)
+                save_checkpoint(checkpoint, done)
+                print(f"Imported {imported}/{len(paths)} recordings", flush=True)
+                batch = []
+
+        if batch:
+            imported += copy_batch(user.id, batch)
+            done.update(recording.name for recording in batch)
+            save_checkpoint(checkpoint, done)
+
+    print(f"Imported {imported} recordings, {len(done)} in total, {skipped} skipped")
+
+
+if __name__ == "__main__":
+    main()
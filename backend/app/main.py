@@ -1,15 +1,42 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import os
+from typing import Callable
 
-from db import create_db_and_tables
+from fastapi import FastAPI, status
+from fastapi.responses import JSONResponse
+from prometheus_client import REGISTRY
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+
+from db import create_db_and_tables, engine, warm_pools
 from ecg.routers import ecg_router
 from auth.routers import auth_router
 from auth.utils import initialize_admin_user
+from ecg.streaming import sweep_abandoned_uploads
+from ecg.worker import recover_pending_analyses, shutdown_executor
+from metrics import metrics_middleware, metrics_response
+from profiling import ProfilingMiddleware, profiling_router
+
+logger = logging.getLogger(__name__)
+
+# Production replicas leave the schema and admin bootstrap to the one-shot "python serve.py init"
+BOOTSTRAP_ON_STARTUP = os.getenv("BOOTSTRAP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+WARMUP_RETRY_SECONDS = 5
+# How often the records of abandoned streamed uploads are deleted
+UPLOAD_SWEEP_INTERVAL_SECONDS = float(os.getenv("UPLOAD_SWEEP_INTERVAL_SECONDS", 300))
+# How often insights left pending by a stopped process are analysed again
+ANALYSIS_RECOVERY_INTERVAL_SECONDS = float(os.getenv("ANALYSIS_RECOVERY_INTERVAL_SECONDS", 300))
 
 app = FastAPI()
+app.state.ready = False
+app.add_middleware(ProfilingMiddleware)
+app.middleware("http")(metrics_middleware)
 
 # Register routers
 app.include_router(ecg_router)
 app.include_router(auth_router)
+app.include_router(profiling_router)
 
 @app.get("/")
 async def health_check():
@@ -21,14 +48,104 @@ async def health_check():
     """
     return {"message": "Hello, World!"}
 
+@app.get("/ready", include_in_schema=False)
+async def readiness_check():
+    """
+    Readiness endpoint, successful once the database connection pools are warm.
+
+    Returns:
+        dict: A dictionary with a message indicating the server is ready, or a 503 response while warming up.
+    """
+    if not app.state.ready:
+        return JSONResponse({"message": "Warming up"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {"message": "Ready"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Prometheus scrape endpoint.
+
+    Returns:
+        Response: The metrics in the Prometheus text format.
+    """
+    return metrics_response()
+
+async def warm_up():
+    """
+    Warm the database pools, retrying until the database is reachable, then report readiness.
+
+    Returns:
+        None
+    """
+    while True:
+        try:
+            await warm_pools()
+            app.state.ready = True
+            return
+        except Exception:
+            logger.warning("Database warm-up failed, retrying in %s s", WARMUP_RETRY_SECONDS, exc_info=True)
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+def sweep_uploads_once() -> int:
+    """Delete the records of abandoned streamed uploads once, returning how many were deleted."""
+    with Session(engine) as session:
+        return sweep_abandoned_uploads(session)
+
+async def run_periodically(description: str, function: Callable[[], int], interval: float):
+    """
+    Run a blocking maintenance function in the threadpool every interval seconds, from startup.
+
+    Args:
+        description (str): What the function does to the records it returns the number of, for the logs.
+        function (Callable[[], int]): The function, returning the number of records it handled.
+        interval (float): The number of seconds between runs.
+
+    Returns:
+        None
+    """
+    while True:
+        try:
+            handled = await run_in_threadpool(function)
+            if handled:
+                logger.info("%s: %s records", description, handled)
+        except Exception:
+            logger.warning("%s failed", description, exc_info=True)
+        await asyncio.sleep(interval)
+
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
+    """
+    Startup event handler. Unless BOOTSTRAP_ON_STARTUP is disabled, it creates
+    the necessary database tables and initializes the admin user if not
+    already present. It then warms the database pools and, in the background,
+    sweeps abandoned uploads and analyses again the insights left pending by
+    stopped processes.
+
+    Returns:
+        None
+    """
+    if BOOTSTRAP_ON_STARTUP:
+        await run_in_threadpool(create_db_and_tables)
+        await run_in_threadpool(initialize_admin_user)
+
+    app.state.warm_up = asyncio.create_task(warm_up())
+    app.state.sweep_uploads = asyncio.create_task(
+        run_periodically("Deleting abandoned uploads", sweep_uploads_once, UPLOAD_SWEEP_INTERVAL_SECONDS)
+    )
+    app.state.recover_analyses = asyncio.create_task(
+        run_periodically("Recovering pending analyses", recover_pending_analyses, ANALYSIS_RECOVERY_INTERVAL_SECONDS)
+    )
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
     """
-    Startup event handler. It creates the necessary database tables and
-    initializes the admin user if not already present.
+    Shutdown event handler. It stops the background tasks and the background analysis workers.
 
     Returns:
         None
     """
-    create_db_and_tables()
-    initialize_admin_user()
+    app.state.warm_up.cancel()
+    app.state.sweep_uploads.cancel()
+    app.state.recover_analyses.cancel()
+    await run_in_threadpool(shutdown_executor)
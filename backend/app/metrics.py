@@ -0,0 +1,193 @@
+import os
+import time
+from typing import Callable, Dict, List
+
+from fastapi import Request, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+# Latency buckets in seconds, from sub-millisecond queries to slow analyses
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests being served", ["method"], multiprocess_mode="livesum"
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "SQL statement execution time", ["engine", "operation"], buckets=LATENCY_BUCKETS
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", buckets=LATENCY_BUCKETS
+)
+INSIGHT_DURATION = Histogram(
+    "ecg_insight_compute_seconds", "Time spent computing the insights of an ECG", ["source"], buckets=LATENCY_BUCKETS
+)
+
+
+class StatsCollector(Collector):
+    """Exposes the numeric values of a stats dictionary as gauges.
+
+    Attributes:
+        prefix (str): The prefix of the gauge names.
+        stats (Callable[[], Dict[str, float]]): Returns the current stats.
+        labels (Dict[str, str]): Labels added to every gauge.
+    """
+
+    def __init__(self, prefix: str, stats: Callable[[], Dict[str, float]], labels: Dict[str, str] = None):
+        self.prefix = prefix
+        self.stats = stats
+        self.labels = labels or {}
+
+    def collect(self):
+        for name, value in self.stats().items():
+            gauge = GaugeMetricFamily(f"{self.prefix}_{name}", f"{self.prefix} {name}", labels=list(self.labels))
+            gauge.add_metric(list(self.labels.values()), value)
+            yield gauge
+
+
+# Stats collectors describing this process only, exported beside the aggregated multiprocess metrics
+_process_collectors: List[StatsCollector] = []
+
+
+def register_stats(prefix: str, stats: Callable[[], Dict[str, float]], labels: Dict[str, str] = None):
+    """
+    Expose the numeric values of a stats dictionary of this process as gauges.
+
+    Args:
+        prefix (str): The prefix of the gauge names.
+        stats (Callable[[], Dict[str, float]]): Returns the current stats.
+        labels (Dict[str, str]): Labels added to every gauge.
+
+    Returns:
+        None
+    """
+    collector = StatsCollector(prefix, stats, labels)
+    REGISTRY.register(collector)
+    _process_collectors.append(collector)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waits for a connection."""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+
+
+def pool_stats(engine: Engine) -> Callable[[], Dict[str, float]]:
+    """
+    Build a callback reporting the connection pool usage of an engine.
+
+    Args:
+        engine (Engine): The SQLAlchemy engine.
+
+    Returns:
+        Callable[[], Dict[str, float]]: Returns the pool size and its checked out, checked in and overflow connections.
+    """
+    def stats():
+        pool = engine.pool
+        if not hasattr(pool, "checkedout"):
+            return {}
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        }
+
+    return stats
+
+
+def instrument_engine(engine: Engine, name: str):
+    """
+    Record the duration of every SQL statement and expose the pool usage of an engine.
+
+    Args:
+        engine (Engine): The SQLAlchemy engine, the sync_engine of an async engine.
+        name (str): The value of the "engine" label.
+
+    Returns:
+        None
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_QUERY_DURATION.labels(name, operation).observe(duration)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches after_cursor_execute, so its start time is discarded here
+        if context.connection is not None:
+            context.connection.info.pop("query_start", None)
+
+    register_stats("db_pool", pool_stats(engine), {"engine": name})
+
+
+async def metrics_middleware(request: Request, call_next):
+    """
+    Record the latency of each request by method, route template and status code.
+
+    Args:
+        request (Request): The incoming request.
+        call_next: Calls the rest of the application.
+
+    Returns:
+        Response: The response of the application.
+    """
+    in_flight = REQUESTS_IN_FLIGHT.labels(request.method)
+    in_flight.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        in_flight.dec()
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(
+            request.method, route.path if route is not None else "unmatched", str(status)
+        ).observe(time.perf_counter() - start)
+
+
+def metrics_response() -> Response:
+    """
+    Render the metrics in the Prometheus text format.
+
+    When PROMETHEUS_MULTIPROC_DIR is set, the histograms and gauges of every
+    worker process are aggregated; pool stats describe the serving process.
+
+    Returns:
+        Response: The metrics.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        body = generate_latest(registry) + generate_latest(_process_local_registry())
+    else:
+        body = generate_latest(REGISTRY)
+    return Response(content=body, media_type=CONTENT_TYPE_LATEST)
+
+
+def _process_local_registry() -> CollectorRegistry:
+    """Registry of the collectors that only describe the current process."""
+    registry = CollectorRegistry()
+    for collector in _process_collectors:
+        registry.register(collector)
+    return registry
@@ -0,0 +1,189 @@
+"""
+Database migrations for existing deployments.
+
+Usage:
+    python migrate.py schema
+    python migrate.py signals-to-bytea [--batch-size 500]
+    python migrate.py signals-to-array [--batch-size 500]
+    python migrate.py pyramids [--batch-size 500]
+    python migrate.py reanalyze [--batch-size 100] [--force] [--max-rate 200] [--workers N]
+
+``reanalyze`` recomputes outdated insights like POST /ecg/reanalysis, but in
+the foreground, and resumes the last job if it was interrupted.
+"""
+import argparse
+from typing import List, Optional
+
+from sqlalchemy import Connection, inspect, text
+from sqlmodel import Session, SQLModel, func, select
+
+from db import engine, create_db_and_tables
+from ecg.codec import block_offsets, decode_signal, encode_signal, fits_int16, lead_signal
+from ecg.models import Lead, LeadPyramid
+from ecg.pyramid import FIRST_LEVEL, MIN_PYRAMID_SAMPLES, store_pyramids
+from ecg.reanalysis import (
+    job_progress, lock_reanalysis, retrieve_reanalysis, run_reanalysis, start_reanalysis, unlock_reanalysis
+)
+
+# Statements bringing tables created by older versions up to date with the models
+SCHEMA_MIGRATIONS = [
+    "ALTER TABLE lead ADD COLUMN IF NOT EXISTS signal_blob BYTEA",
+    "CREATE INDEX IF NOT EXISTS ix_lead_ecg_id ON lead (ecg_id)",
+    "CREATE INDEX IF NOT EXISTS ix_ecg_user_id_date_id ON ecg (user_id, date, id)",
+    "ALTER TABLE ecg ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE ecg ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(255)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_ecg_user_id_content_hash ON ecg (user_id, content_hash)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_ecg_user_id_idempotency_key ON ecg (user_id, idempotency_key)",
+    "ALTER TABLE ecg ADD COLUMN IF NOT EXISTS upload_activity TIMESTAMP",
+    "ALTER TABLE lead ADD COLUMN IF NOT EXISTS block_offsets INTEGER[]",
+    # Blobs are already compressed; storing them uncompressed out of line lets substring() read only the needed pages
+    "ALTER TABLE lead ALTER COLUMN signal_blob SET STORAGE EXTERNAL",
+    # Pyramid levels finer than ecg.pyramid.FIRST_LEVEL are no longer stored
+    f"DELETE FROM lead_pyramid WHERE level < {FIRST_LEVEL}",
+]
+
+
+def migrate_schema():
+    """
+    Create missing tables and apply the schema changes that create_all does not.
+
+    Returns:
+        None
+    """
+    create_db_and_tables()
+    with engine.begin() as connection:
+        for statement in SCHEMA_MIGRATIONS:
+            connection.execute(text(statement))
+
+
+def missing_schema(connection: Optional[Connection] = None) -> List[str]:
+    """
+    List the tables, columns and named indexes of the models that the database does not have yet.
+
+    Args:
+        connection (Optional[Connection]): The connection to inspect (default is a new connection of the engine).
+
+    Returns:
+        List[str]: The missing objects, e.g. "lead.block_offsets", empty once the schema is up to date.
+    """
+    inspector = inspect(connection if connection is not None else engine)
+    tables = set(inspector.get_table_names())
+
+    missing = []
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in tables:
+            missing.append(table.name)
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in columns]
+        missing += [f"{table.name}.{index.name}" for index in table.indexes if index.name not in indexes]
+    return missing
+
+
+def migrate_signals(to_bytea: bool, batch_size: int) -> int:
+    """
+    Move lead signals between the array column and the compact bytea column.
+
+    Leads are processed in id order, one committed batch at a time, so the
+    migration can be interrupted and started again. Signals that do not fit in
+    16-bit integers are left in the array column.
+
+    Args:
+        to_bytea (bool): True to encode array signals, False to decode bytea signals.
+        batch_size (int): The number of leads converted per transaction.
+
+    Returns:
+        int: The number of leads converted.
+    """
+    converted, last_id = 0, 0
+    pending = Lead.signal_blob.is_(None) & Lead.signal.is_not(None) if to_bytea else Lead.signal_blob.is_not(None)
+
+    while True:
+        with Session(engine) as session:
+            leads = session.exec(
+                select(Lead).where(pending, Lead.id > last_id).order_by(Lead.id).limit(batch_size)
+            ).all()
+            if not leads:
+                return converted
+
+            for lead in leads:
+                if to_bytea and fits_int16(lead.signal):
+                    lead.signal_blob = encode_signal(lead.signal)
+                    lead.block_offsets = block_offsets(lead.signal_blob)
+                    lead.signal = None
+                    converted += 1
+                elif not to_bytea:
+                    lead.signal = decode_signal(lead.signal_blob).tolist()
+                    lead.signal_blob = None
+                    lead.block_offsets = None
+                    converted += 1
+                session.add(lead)
+
+            last_id = leads[-1].id
+            session.commit()
+
+
+def build_missing_pyramids(batch_size: int) -> int:
+    """
+    Build the waveform pyramids of leads stored before pyramids existed.
+
+    Leads are processed in id order, one committed batch at a time, so the
+    migration can be interrupted and started again.
+
+    Args:
+        batch_size (int): The number of leads processed per transaction.
+
+    Returns:
+        int: The number of leads whose pyramid was built.
+    """
+    built, last_id = 0, 0
+    number_of_samples = func.coalesce(Lead.number_of_samples, func.cardinality(Lead.signal), 0)
+    missing = ~select(LeadPyramid.lead_id).where(LeadPyramid.lead_id == Lead.id).exists() & (
+        number_of_samples > MIN_PYRAMID_SAMPLES
+    )
+
+    while True:
+        with Session(engine) as session:
+            leads = session.exec(
+                select(Lead).where(missing, Lead.id > last_id).order_by(Lead.id).limit(batch_size)
+            ).all()
+            if not leads:
+                return built
+
+            store_pyramids(session, [(lead.id, lead_signal(lead)) for lead in leads])
+            built += len(leads)
+            last_id = leads[-1].id
+            session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["schema", "signals-to-bytea", "signals-to-array", "pyramids", "reanalyze"])
+    parser.add_argument("--batch-size", type=int, help="Leads per batch (500), or records per batch for reanalyze")
+    parser.add_argument("--force", action="store_true", help="reanalyze: also recompute up-to-date insights")
+    parser.add_argument("--max-rate", type=float, help="reanalyze: maximum records per second, 0 for no cap")
+    parser.add_argument("--workers", type=int, help="reanalyze: number of analysis processes")
+    args = parser.parse_args()
+
+    migrate_schema()
+    if args.command == "reanalyze":
+        locker = lock_reanalysis()
+        try:
+            with Session(engine) as session:
+                job = start_reanalysis(session, force=args.force, max_rate=args.max_rate)
+        except BaseException:
+            unlock_reanalysis(locker)
+            raise
+        run_reanalysis(job.id, locker, workers=args.workers, batch_size=args.batch_size)
+        with Session(engine) as session:
+            print(job_progress(retrieve_reanalysis(session, job.id)))
+    elif args.command == "pyramids":
+        print(f"Built the pyramids of {build_missing_pyramids(args.batch_size or 500)} leads")
+    elif args.command != "schema":
+        converted = migrate_signals(args.command == "signals-to-bytea", args.batch_size or 500)
+        print(f"Converted {converted} leads")
+
+
+if __name__ == "__main__":
+    main()
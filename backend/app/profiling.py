@@ -0,0 +1,255 @@
+import asyncio
+import cProfile
+import inspect
+import io
+import os
+import pstats
+import re
+import tempfile
+import threading
+import uuid
+from contextlib import asynccontextmanager
+from typing import Annotated, List
+
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from starlette.datastructures import MutableHeaders, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from auth.utils import admin_required, get_current_user
+from db import active_profile, get_session
+
+# Profiles are stored as pstats files; only the most recent PROFILE_KEEP are kept
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "ecg-profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 100))
+
+PROFILE_HEADER = "x-profile"
+PROFILE_TOKEN_HEADER = "x-profile-token"
+PROFILE_QUERY_FLAG = "profile"
+
+# Values of the header or query flag that opt into profiling; any other value, e.g. "0" or "false", does not
+PROFILE_FLAG_VALUES = ("1", "true")
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# cProfile hooks the whole event loop thread, so profiled requests run one at a time
+_profile_lock = asyncio.Lock()
+
+
+class RequestProfile:
+    """Deterministic profile of a single request.
+
+    The event loop thread is profiled directly, and every database function
+    dispatched to the threadpool by ``run_db`` gets its own profiler, since a
+    cProfile profiler only observes the thread that enabled it. The profilers
+    are merged when the profile is saved.
+
+    Attributes:
+        id (str): The identifier of the profile, returned in the X-Profile-Id header.
+        profilers (List[cProfile.Profile]): The profilers of the event loop and threadpool work.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.profilers: List[cProfile.Profile] = [cProfile.Profile()]
+        self._lock = threading.Lock()
+
+    def call(self, function, *args, **kwargs):
+        """Run a function in the current thread under a new profiler of this request."""
+        profiler = cProfile.Profile()
+        with self._lock:
+            self.profilers.append(profiler)
+        return profiler.runcall(function, *args, **kwargs)
+
+    def save(self) -> str:
+        """
+        Merge the profilers and store them as a pstats file.
+
+        Returns:
+            str: The path of the stored profile.
+        """
+        stats = pstats.Stats(self.profilers[0])
+        for profiler in self.profilers[1:]:
+            stats.add(profiler)
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = profile_path(self.id)
+        stats.dump_stats(path)
+        _prune_profiles()
+        return path
+
+
+def profile_path(profile_id: str) -> str:
+    """Return the path of a stored profile."""
+    return os.path.join(PROFILE_DIR, f"{profile_id}.pstats")
+
+
+def _stored_profiles() -> List[str]:
+    """Return the paths of the stored profiles, oldest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    paths = [os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith(".pstats")]
+    return sorted(paths, key=os.path.getmtime)
+
+
+def _prune_profiles():
+    for path in _stored_profiles()[:-PROFILE_KEEP or None]:
+        os.remove(path)
+
+
+def wants_profile(scope: Scope) -> bool:
+    """Check whether a request opted into profiling with a true X-Profile header or profile query flag."""
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER.encode() and value.decode("latin-1").strip().lower() in PROFILE_FLAG_VALUES:
+            return True
+    if not scope["query_string"]:
+        return False
+    return QueryParams(scope["query_string"]).get(PROFILE_QUERY_FLAG, "").strip().lower() in PROFILE_FLAG_VALUES
+
+
+@asynccontextmanager
+async def _request_session(request: Request):
+    """Open a database session the same way the session dependency of the routes would."""
+    dependency = request.app.dependency_overrides.get(get_session, get_session)
+    if inspect.isasyncgenfunction(dependency):
+        generator = dependency()
+        try:
+            yield await generator.__anext__()
+        finally:
+            await generator.aclose()
+    elif inspect.isgeneratorfunction(dependency):
+        generator = dependency()
+        try:
+            yield next(generator)
+        finally:
+            generator.close()
+    else:
+        yield dependency()
+
+
+async def authorize_profile(request: Request) -> bool:
+    """
+    Check whether the request that opted into profiling carries an admin token.
+
+    The token is read from the X-Profile-Token header, so an admin can profile
+    a request made with another user's credentials, or else from the
+    Authorization header.
+
+    Args:
+        request (Request): The request to profile.
+
+    Returns:
+        bool: True if the token is valid and belongs to an admin.
+    """
+    token = request.headers.get(PROFILE_TOKEN_HEADER)
+    if token is None:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return False
+
+    try:
+        async with _request_session(request) as session:
+            await admin_required(await get_current_user(token, session))
+    except HTTPException:
+        return False
+    return True
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests of admins who opt in; other requests pass straight through.
+
+    This is a pure ASGI middleware, so requests that do not opt in reach the
+    application untouched, and a flag sent by anyone but an admin is ignored.
+    The merged profile is stored under PROFILE_DIR and its id is returned in
+    the X-Profile-Id response header. Concurrent requests handled by the same
+    process are also captured on the event loop thread, so profiles are most
+    precise on an idle replica.
+
+    Attributes:
+        app (ASGIApp): The rest of the application.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not wants_profile(scope) or not await authorize_profile(Request(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        if _profile_lock.locked():
+            detail = {"detail": "Another request is being profiled"}
+            await JSONResponse(detail, status_code=status.HTTP_409_CONFLICT)(scope, receive, send)
+            return
+
+        async with _profile_lock:
+            profile = RequestProfile()
+
+            async def send_with_profile_id(message: Message):
+                if message["type"] == "http.response.start":
+                    MutableHeaders(scope=message).append("X-Profile-Id", profile.id)
+                await send(message)
+
+            token = active_profile.set(profile)
+            profile.profilers[0].enable()
+            try:
+                await self.app(scope, receive, send_with_profile_id)
+            finally:
+                profile.profilers[0].disable()
+                active_profile.reset(token)
+                # Merging and writing the stats is blocking work, kept off the event loop
+                await anyio.to_thread.run_sync(profile.save)
+
+
+profiling_router = APIRouter(
+    prefix="/profiles",
+    tags=["Profiling Endpoints"],
+    dependencies=[Depends(admin_required)],
+)
+
+
+@profiling_router.get("", description="List the stored request profiles.")
+async def list_profiles():
+    """
+    List the stored request profiles, newest first. Restricted to Admin users.
+
+    Returns:
+        dict: The ids of the stored profiles.
+    """
+    ids = [os.path.basename(path)[:-len(".pstats")] for path in reversed(_stored_profiles())]
+    return {"data": ids, "message": f"{len(ids)} profiles"}
+
+
+@profiling_router.get("/{profile_id}", description="Download a stored request profile.")
+async def get_profile(
+        profile_id: str,
+        format: Annotated[str, Query(pattern="^(pstats|text)$")] = "pstats",
+        limit: Annotated[int, Query(ge=1, le=1000)] = 50,
+):
+    """
+    Download a stored request profile. Restricted to Admin users.
+
+    Args:
+        profile_id (str): The id returned in the X-Profile-Id header of the profiled request.
+        format (str): "pstats" for the raw file (open it with pstats or snakeviz),
+            or "text" for a report of the functions with the highest cumulative time.
+        limit (int): The number of functions in the text report.
+
+    Raises:
+        HTTPException: If the profile does not exist, a 404 error is raised.
+
+    Returns:
+        Response: The profile file or its text report.
+    """
+    path = profile_path(profile_id)
+    if not PROFILE_ID_PATTERN.match(profile_id) or not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+
+    if format == "pstats":
+        return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.pstats")
+
+    report = io.StringIO()
+    pstats.Stats(path, stream=report).sort_stats("cumulative").print_stats(limit)
+    return PlainTextResponse(report.getvalue())
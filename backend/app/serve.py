@@ -0,0 +1,218 @@
+"""
+Production launcher.
+
+Usage:
+    python serve.py init
+    python serve.py wait [--timeout 300]
+    python serve.py run [--host 0.0.0.0] [--port 8000] [--workers N]
+
+``init`` creates the tables, applies the schema migrations and creates the
+admin user. Run it once per release, e.g. as a Kubernetes Job, instead of on
+the startup of every replica. ``wait`` only reads: it returns once the schema
+has every table, column and index of the models, so replicas of a new release
+can wait for the init Job in an initContainer.
+
+``run`` serves the app with one worker process per available CPU (or
+WEB_CONCURRENCY). With gunicorn installed the app is preloaded once and
+forked into uvicorn workers; otherwise uvicorn manages the workers itself.
+uvloop and httptools are used when they are installed. The schema bootstrap
+is left to ``init`` unless BOOTSTRAP_ON_STARTUP is set.
+"""
+import argparse
+import importlib.util
+import math
+import os
+import tempfile
+
+# The app is imported by the functions below, once the environment it reads
+# at import time (BOOTSTRAP_ON_STARTUP, PROMETHEUS_MULTIPROC_DIR) is set
+
+
+def available_cpus() -> int:
+    """
+    Count the CPUs this process may use, honouring container CPU limits.
+
+    Returns:
+        int: The cgroup CPU quota rounded up, or the number of CPUs the process is allowed to run on.
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as file:
+            quota, period = file.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+# Key of the advisory lock serializing concurrent init runs, e.g. a retried init Job
+INIT_LOCK_KEY = 0x45434731
+# Seconds between two checks of the schema by wait
+WAIT_INTERVAL_SECONDS = 2
+
+
+def init():
+    """
+    Bootstrap the database: tables, schema migrations and the admin user.
+
+    Returns:
+        None
+    """
+    from sqlalchemy import text
+
+    from auth.utils import initialize_admin_user
+    from db import engine
+    from migrate import migrate_schema
+
+    with engine.connect() as lock:
+        lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": INIT_LOCK_KEY})
+        try:
+            migrate_schema()
+            initialize_admin_user()
+        finally:
+            lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INIT_LOCK_KEY})
+    print("Database initialized")
+
+
+def wait(timeout: float):
+    """
+    Wait until the database schema matches the models, without changing it.
+
+    The schema is ready once no init holds INIT_LOCK_KEY and no table, column
+    or index of the models is missing. Connection errors are retried, since
+    the database may still be starting.
+
+    Args:
+        timeout (float): The number of seconds to wait before giving up.
+
+    Raises:
+        SystemExit: If the schema is still not ready after the timeout.
+
+    Returns:
+        None
+    """
+    import time
+
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    from db import engine
+    from migrate import missing_schema
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with engine.connect() as connection:
+                idle = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": INIT_LOCK_KEY}).scalar()
+                if idle:
+                    connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INIT_LOCK_KEY})
+            missing = missing_schema() if idle else ["init in progress"]
+        except OperationalError as error:
+            missing = [f"database unavailable ({error.orig})"]
+
+        if not missing:
+            print("Database schema ready")
+            return
+        if time.monotonic() >= deadline:
+            raise SystemExit(f"Database schema not ready: {', '.join(missing)}")
+        print(f"Waiting for the database schema: {', '.join(missing)}", flush=True)
+        time.sleep(WAIT_INTERVAL_SECONDS)
+
+
+def run_gunicorn(host: str, port: int, workers: int, loop: str, http: str):
+    """Serve the preloaded app with gunicorn and uvicorn workers."""
+    from gunicorn.app.base import BaseApplication
+    if _available("uvicorn_worker"):
+        from uvicorn_worker import UvicornWorker
+    else:
+        from uvicorn.workers import UvicornWorker
+
+    class Worker(UvicornWorker):
+        CONFIG_KWARGS = {"loop": loop, "http": http, "proxy_headers": True}
+
+    def post_fork(server, worker):
+        # Connections opened while preloading must not be shared with the workers
+        from db import async_engine, engine
+        engine.dispose(close=False)
+        if async_engine is not None:
+            async_engine.sync_engine.dispose(close=False)
+
+    def child_exit(server, worker):
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(worker.pid)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", Worker)
+            self.cfg.set("preload_app", True)
+            self.cfg.set("post_fork", post_fork)
+            self.cfg.set("child_exit", child_exit)
+
+        def load(self):
+            from main import app
+            return app
+
+    Application().run()
+
+
+def run(host: str, port: int, workers: int):
+    """
+    Serve the app with the best available server stack.
+
+    Args:
+        host (str): The address to bind.
+        port (int): The port to bind.
+        workers (int): The number of worker processes.
+
+    Returns:
+        None
+    """
+    os.environ.setdefault("BOOTSTRAP_ON_STARTUP", "false")
+    if workers > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Metrics of every worker are aggregated through files in this directory
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+
+    loop = "uvloop" if _available("uvloop") else "asyncio"
+    http = "httptools" if _available("httptools") else "h11"
+    server = "gunicorn" if _available("gunicorn") else "uvicorn"
+    print(f"Serving on {host}:{port} with {workers} {server} workers ({loop}, {http})", flush=True)
+
+    if server == "gunicorn":
+        run_gunicorn(host, port, workers, loop, http)
+    else:
+        import uvicorn
+        uvicorn.run("main:app", host=host, port=port, workers=workers, loop=loop, http=http, proxy_headers=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="Create the schema and the admin user, then exit")
+    waiting = commands.add_parser("wait", help="Wait until the schema is up to date, then exit")
+    waiting.add_argument("--timeout", type=float, default=300)
+    serve = commands.add_parser("run", help="Serve the app")
+    serve.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    serve.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    serve.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", 0)) or available_cpus())
+    args = parser.parse_args()
+
+    if args.command == "init":
+        init()
+    elif args.command == "wait":
+        wait(args.timeout)
+    else:
+        run(args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Throughput and latency of the ECG API on realistic synthetic 12-lead recordings.
+
+Measures POST /ecg/create, GET /ecg/get, GET /ecg/get_all and
+GET /ecg/get_insight, plus microbenchmarks of count_zero_crossings and of
+the response serializers, and prints the results as JSON so runs on
+different commits can be compared.
+
+Run from the backend directory against the database in DATABASE_URL, either
+in-process, against a uvicorn server started by the benchmark, or against a
+running server:
+
+    PYTHONPATH=app python -m benchmarks.bench_api --seconds 10 --records 50 --requests 500 --output base.json
+    PYTHONPATH=app python -m benchmarks.bench_api --serve --workers 4 --concurrency 16
+    PYTHONPATH=app python -m benchmarks.bench_api --base-url http://localhost:8000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import httpx
+import numpy as np
+from sqlmodel import Session
+
+from auth.models import UserRequest
+from auth.user_crud import create_user
+from auth.utils import create_access_token, get_user_by_username
+from db import create_db_and_tables, engine
+from ecg.records import ECGRecord, LeadWindow
+from ecg.responses import JSON, MSGPACK, NPY, OCTET_STREAM, signals_response
+from ecg.utils import count_zero_crossings, count_zero_crossings_python
+from main import app
+
+from .synthetic import SAMPLING_RATE, synthetic_leads, synthetic_payload
+
+USERNAME = "bench_api"
+PASSWORD = "bench_password"
+APP_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+
+def setup_user():
+    """Create the benchmark user if needed."""
+    create_db_and_tables()
+    with Session(engine) as session:
+        if get_user_by_username(session, USERNAME) is None:
+            create_user(UserRequest(username=USERNAME, password=PASSWORD), session)
+
+
+def latency_summary(latencies: List[float], elapsed: float, errors: int) -> dict:
+    values = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed,
+        "latency_ms": {
+            "mean": float(values.mean()),
+            "p50": float(np.percentile(values, 50)),
+            "p90": float(np.percentile(values, 90)),
+            "p99": float(np.percentile(values, 99)),
+            "max": float(values.max()),
+        },
+    }
+
+
+async def measure(client: httpx.AsyncClient, requests: List[Tuple[str, str, dict]],
+                  concurrency: int) -> Tuple[dict, List[httpx.Response]]:
+    """
+    Send requests from concurrent workers and summarize their latencies.
+
+    Args:
+        client (httpx.AsyncClient): The client of the app under test.
+        requests (List[Tuple[str, str, dict]]): The method, URL and httpx arguments of each request.
+        concurrency (int): The number of requests in flight at once.
+
+    Returns:
+        Tuple[dict, List[httpx.Response]]: The summary and the responses in request order.
+    """
+    responses: List[Optional[httpx.Response]] = [None] * len(requests)
+    latencies = []
+    pending = iter(enumerate(requests))
+
+    async def worker():
+        for index, (method, url, kwargs) in pending:
+            start = time.perf_counter()
+            responses[index] = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    errors = sum(response.is_error for response in responses)
+    return latency_summary(latencies, elapsed, errors), responses
+
+
+async def run_api(client: httpx.AsyncClient, args) -> dict:
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': USERNAME}, expire_delta=600)}"}
+    results = {}
+
+    # Distinct recordings, so creation is not helped by any caching
+    payloads = [synthetic_payload(args.seconds, seed=seed) for seed in range(args.records)]
+    results["create"], responses = await measure(
+        client, [("POST", "/ecg/create", {"json": payload, "headers": headers}) for payload in payloads],
+        args.concurrency,
+    )
+    ids = [response.json()["data"]["id"] for response in responses if response.is_success]
+    if not ids:
+        raise RuntimeError(f"No ECG could be created: {responses[0].status_code} {responses[0].text[:200]}")
+
+    for name, url in (("get", "/ecg/get/{}"), ("get_insight", "/ecg/get_insight/{}")):
+        requests = [("GET", url.format(ids[index % len(ids)]), {"headers": headers}) for index in range(args.requests)]
+        await measure(client, requests[:args.concurrency], args.concurrency)
+        results[name], _ = await measure(client, requests, args.concurrency)
+
+    requests = [("GET", "/ecg/get_all", {"headers": headers, "params": {"limit": 50}})] * args.requests
+    results["get_all"], _ = await measure(client, requests, args.concurrency)
+    return results
+
+
+def run_micro(args) -> dict:
+    leads = synthetic_leads(args.seconds)
+    best = lambda function: min(timeit.repeat(function, number=1, repeat=args.repeat))
+
+    zero_crossings = {
+        "numpy_s": best(lambda: count_zero_crossings(leads)),
+        "python_s": best(lambda: count_zero_crossings_python(leads)),
+    }
+
+    ecg = ECGRecord(id=1, date=datetime.now(), user_id=1, leads=[
+        LeadWindow(lead.identifier, len(lead.signal), 0, len(lead.signal), np.asarray(lead.signal, dtype=np.int32))
+        for lead in leads
+    ])
+    as_lists = {"id": ecg.id, "date": ecg.date.isoformat(), "user_id": ecg.user_id,
+                "leads": [{"identifier": lead.identifier, "number_of_samples": lead.number_of_samples,
+                           "start": lead.start, "end": lead.end, "signal": lead.signal.tolist()}
+                          for lead in ecg.leads]}
+    serialization = {"stdlib_json_s": best(lambda: json.dumps(as_lists).encode())}
+    for name, media_type in (("json", JSON), ("msgpack", MSGPACK), ("octet_stream", OCTET_STREAM), ("npy", NPY)):
+        serialization[f"{name}_s"] = best(lambda: signals_response("ECG", ecg, media_type))
+
+    return {"count_zero_crossings": zero_crossings, "serialize_signals": serialization}
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    """Start uvicorn on the app with the current environment and wait until it answers."""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        cwd=APP_DIRECTORY,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1).raise_for_status()
+            return server
+        except httpx.HTTPError:
+            if server.poll() is not None:
+                raise RuntimeError("The server exited during startup")
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("The server did not start within 60 seconds")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    setup_user()
+    server = None
+    if args.serve:
+        server = start_server(args.port, args.workers)
+        base_url = f"http://127.0.0.1:{args.port}"
+    else:
+        base_url = args.base_url
+
+    if base_url:
+        client = httpx.AsyncClient(base_url=base_url, timeout=120)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=120)
+
+    try:
+        async with client:
+            api = await run_api(client, args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    return {
+        "metadata": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "target": base_url or "in-process",
+            "db_mode": os.getenv("DB_MODE", "sync"),
+            "signal_storage": os.getenv("SIGNAL_STORAGE", "array"),
+            "parameters": {
+                "seconds": args.seconds, "samples_per_lead": int(args.seconds * SAMPLING_RATE), "leads": 12,
+                "records": args.records, "requests": args.requests, "concurrency": args.concurrency,
+            },
+        },
+        "api": api,
+        "micro": run_micro(args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10, help="Recording length in seconds at 500 Hz")
+    parser.add_argument("--records", type=int, default=20, help="ECGs created in the create phase")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per read phase")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of each microbenchmark")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--base-url", help="Benchmark a running server instead of the in-process app")
+    target.add_argument("--serve", action="store_true", help="Start a local uvicorn server to benchmark")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the server started with --serve")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the server started with --serve")
+    parser.add_argument("--output", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = json.dumps(asyncio.run(run(args)), indent=2)
+    print(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(results + "\n")
+
+
+if __name__ == "__main__":
+    main()
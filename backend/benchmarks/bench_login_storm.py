@@ -0,0 +1,104 @@
+"""
+Measure /ecg/get latency while a storm of logins hits /auth/token.
+
+Password checks run in a bounded pool off the event loop, so the p99 of
+/ecg/get should stay close to its baseline during the storm. Logins beyond
+the pool's queue depth are rejected with 503.
+
+Run from the backend directory against the database in DATABASE_URL:
+
+    PYTHONPATH=app python -m benchmarks.bench_login_storm --logins 200 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+import numpy as np
+from sqlmodel import Session
+
+from auth.models import User, UserRequest
+from auth.user_crud import create_user
+from auth.utils import create_access_token, get_user_by_username
+from db import create_db_and_tables, engine
+from ecg.crud import create_ecg
+from ecg.models import Lead
+from main import app
+
+USERNAME = "bench_login_storm"
+PASSWORD = "bench_password"
+
+
+def setup() -> int:
+    """Create the benchmark user and one 12-lead, 10-second ECG, returning its id."""
+    create_db_and_tables()
+    with Session(engine) as session:
+        user = get_user_by_username(session, USERNAME)
+        if user is None:
+            create_user(UserRequest(username=USERNAME, password=PASSWORD), session)
+            user = get_user_by_username(session, USERNAME)
+
+        signal = (1000 * np.sin(np.linspace(0, 20 * np.pi, 5000))).astype(int).tolist()
+        leads = [Lead(identifier=f"L{index}", signal=signal) for index in range(12)]
+        return create_ecg(user=User(id=user.id), session=session, leads=leads).id
+
+
+def percentiles(latencies) -> dict:
+    values = np.asarray(latencies) * 1000
+    return {"p50_ms": float(np.percentile(values, 50)), "p99_ms": float(np.percentile(values, 99)),
+            "max_ms": float(values.max())}
+
+
+async def measure_gets(client: httpx.AsyncClient, url: str, headers: dict, requests: int) -> list:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get(url, headers=headers)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return latencies
+
+
+async def login(client: httpx.AsyncClient) -> int:
+    response = await client.post("/auth/token", data={"username": USERNAME, "password": PASSWORD})
+    return response.status_code
+
+
+async def run(args) -> dict:
+    ecg_id = setup()
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': USERNAME}, expire_delta=60)}"}
+    url = f"/ecg/get/{ecg_id}"
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=60)
+
+    async with client:
+        await measure_gets(client, url, headers, 10)
+        baseline = await measure_gets(client, url, headers, args.requests)
+
+        storm = asyncio.gather(*[login(client) for _ in range(args.logins)])
+        during = await measure_gets(client, url, headers, args.requests)
+        statuses = await storm
+
+    return {
+        "baseline": percentiles(baseline),
+        "during_login_storm": percentiles(during),
+        "logins": {"ok": statuses.count(200), "rejected": statuses.count(503), "total": len(statuses)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200, help="Concurrent login requests in the storm")
+    parser.add_argument("--requests", type=int, default=200, help="Sequential /ecg/get requests per phase")
+    parser.add_argument("--base-url", help="Benchmark a running server instead of the in-process app")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Time and allocations of the read path, ORM entities against Core records.
+
+Loads the same ECG record, page of records and stored insights both through
+the ORM (model entities and the identity map) and through the SQLAlchemy Core
+queries of ecg.records, and prints the time per call and the memory allocated
+per call as JSON. The ORM page is read as before the Core records: the page's
+ECG entities, then a single column-only query for the lead summaries.
+
+Run from the backend directory against the database in DATABASE_URL:
+
+    PYTHONPATH=app python -m benchmarks.bench_read_path --seconds 10 --records 50 --repeat 20
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Callable
+
+from sqlmodel import Session, func, select
+
+from auth.models import User, UserRequest
+from auth.user_crud import create_user
+from auth.utils import get_user_by_username
+from db import create_db_and_tables, engine
+from ecg.codec import lead_signal
+from ecg.crud import create_ecg, encode_cursor, retrieve_ecg_signals, retrieve_ecg_summaries
+from ecg.models import ECG, ECGInsight, Lead
+from ecg.records import fetch_insight
+
+from .synthetic import synthetic_leads
+
+USERNAME = "bench_read_path"
+PASSWORD = "bench_password"
+
+
+def setup(seconds: float, records: int) -> User:
+    """Create the benchmark user and its 12-lead ECG records if they do not exist yet."""
+    create_db_and_tables()
+    with Session(engine) as session:
+        user = get_user_by_username(session, USERNAME)
+        if user is None:
+            create_user(UserRequest(username=USERNAME, password=PASSWORD), session)
+            user = get_user_by_username(session, USERNAME)
+        user = User(id=user.id)
+
+        existing = len(session.exec(select(ECG.id).where(ECG.user_id == user.id)).all())
+        for index in range(existing, records):
+            leads = [Lead(identifier=lead.identifier, signal=[value + index for value in lead.signal])
+                     for lead in synthetic_leads(seconds)]
+            create_ecg(user=user, session=session, leads=leads)
+        return user
+
+
+def orm_get(session: Session, user: User, ecg_id: int):
+    ecg = session.exec(select(ECG).where(ECG.id == ecg_id, ECG.user_id == user.id)).first()
+    return ecg, [(lead.identifier, lead_signal(lead)) for lead in ecg.leads]
+
+
+def orm_get_all(session: Session, user: User, limit: int):
+    """The page as served before the Core records: ECG entities, then one column-only query for their leads."""
+    ecgs = session.exec(select(ECG).where(ECG.user_id == user.id).order_by(ECG.date.desc(), ECG.id.desc())
+                        .limit(limit)).all()
+
+    leads = {ecg.id: [] for ecg in ecgs}
+    if ecgs:
+        number_of_samples = func.coalesce(Lead.number_of_samples, func.cardinality(Lead.signal))
+        rows = session.exec(
+            select(Lead.ecg_id, Lead.identifier, number_of_samples)
+            .where(Lead.ecg_id.in_(leads))
+            .order_by(Lead.ecg_id, Lead.id)
+        ).all()
+        for ecg_id, identifier, samples in rows:
+            leads[ecg_id].append({"identifier": identifier, "number_of_samples": samples})
+
+    data = [{"id": ecg.id, "date": ecg.date, "user_id": ecg.user_id, "leads": leads[ecg.id]} for ecg in ecgs]
+    return {"data": data, "next_cursor": encode_cursor(ecgs[-1]) if len(ecgs) == limit else None}
+
+
+def orm_insight(session: Session, user: User, ecg_id: int):
+    return session.exec(
+        select(ECGInsight).join(ECG, ECG.id == ECGInsight.ecg_id)
+        .where(ECGInsight.ecg_id == ecg_id, ECG.user_id == user.id)
+    ).first()
+
+
+def measure(function: Callable[[Session], object], repeat: int) -> dict:
+    """Run function in a fresh session repeat times, returning its mean time and allocations per call."""
+    with Session(engine) as session:
+        function(session)
+
+    elapsed, allocated, peak = 0.0, 0, 0
+    for _ in range(repeat):
+        with Session(engine) as session:
+            start = time.perf_counter()
+            function(session)
+            elapsed += time.perf_counter() - start
+
+        with Session(engine) as session:
+            tracemalloc.start()
+            result = function(session)
+            current, call_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del result
+        allocated += current
+        peak = max(peak, call_peak)
+
+    return {"mean_ms": elapsed / repeat * 1000, "retained_kib": allocated / repeat / 1024, "peak_kib": peak / 1024}
+
+
+def run(args) -> dict:
+    user = setup(args.seconds, args.records)
+    with Session(engine) as session:
+        ecg_id = session.exec(select(ECG.id).where(ECG.user_id == user.id).order_by(ECG.id)).first()
+
+    cases = {
+        "get": (lambda session: orm_get(session, user, ecg_id),
+                lambda session: retrieve_ecg_signals(user, session, ecg_id)),
+        "get_all": (lambda session: orm_get_all(session, user, args.limit),
+                    lambda session: retrieve_ecg_summaries(user, session, args.limit)),
+        "get_insight": (lambda session: orm_insight(session, user, ecg_id),
+                        lambda session: fetch_insight(session, user, ecg_id)),
+    }
+    return {
+        "config": vars(args),
+        "results": {
+            name: {"orm": measure(orm, args.repeat), "core": measure(core, args.repeat)}
+            for name, (orm, core) in cases.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10, help="Recording length in seconds at 500 Hz")
+    parser.add_argument("--records", type=int, default=50, help="ECG records of the benchmark user")
+    parser.add_argument("--limit", type=int, default=50, help="Records per page of get_all")
+    parser.add_argument("--repeat", type=int, default=20, help="Measured calls per case")
+    print(json.dumps(run(parser.parse_args()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+Microbenchmark comparing the vectorized count_zero_crossings with the
+pure-Python reference implementation.
+
+Run from the backend directory:
+
+    PYTHONPATH=app python -m benchmarks.bench_zero_crossings --leads 12 --seconds 600
+"""
+import argparse
+import json
+import timeit
+
+from ecg.utils import STANDARD_LEAD_ORDER, count_zero_crossings, count_zero_crossings_python
+
+from .synthetic import SAMPLING_RATE, synthetic_leads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=12, choices=range(1, 13), metavar="1-12")
+    parser.add_argument("--seconds", type=int, default=600, help="Recording length in seconds at 500 Hz")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    leads = synthetic_leads(args.seconds, leads=STANDARD_LEAD_ORDER[:args.leads])
+    assert count_zero_crossings(leads) == count_zero_crossings_python(leads)
+
+    results = {}
+    for name, function in (("numpy", count_zero_crossings), ("python", count_zero_crossings_python)):
+        results[name] = min(timeit.repeat(lambda: function(leads), number=1, repeat=args.repeat))
+    results["speedup"] = results["python"] / results["numpy"]
+
+    print(json.dumps({"leads": args.leads, "samples_per_lead": args.seconds * SAMPLING_RATE, "seconds": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
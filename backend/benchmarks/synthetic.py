@@ -0,0 +1,107 @@
+"""
+Synthetic 12-lead ECG signals for benchmarks.
+
+Each beat is the sum of Gaussian P, Q, R, S and T waves whose amplitudes
+depend on the lead, with beat-to-beat heart rate variability, baseline
+wander, mains interference and white noise. The recordings are
+deterministic for a given seed, so runs on different commits are
+comparable.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+from ecg.models import Lead
+from ecg.utils import STANDARD_LEAD_ORDER
+
+SAMPLING_RATE = 500
+
+# Position (s after the beat onset) and width (s) of the P, Q, R, S and T waves
+WAVE_CENTERS = np.array([0.10, 0.21, 0.25, 0.29, 0.50])
+WAVE_WIDTHS = np.array([0.025, 0.010, 0.012, 0.010, 0.050])
+
+# Amplitude (µV) of the P, Q, R, S and T waves in each lead
+LEAD_AMPLITUDES = {
+    "I": (100, -50, 700, -100, 200),
+    "II": (150, -80, 1100, -200, 300),
+    "III": (60, -40, 500, -150, 120),
+    "aVR": (-120, 50, -850, 150, -250),
+    "aVL": (30, -30, 250, -50, 60),
+    "aVF": (100, -60, 800, -170, 210),
+    "V1": (80, 0, 300, -900, -100),
+    "V2": (100, 0, 600, -1200, 350),
+    "V3": (100, -30, 900, -700, 400),
+    "V4": (100, -60, 1400, -400, 400),
+    "V5": (90, -80, 1300, -250, 320),
+    "V6": (80, -70, 1000, -150, 250),
+}
+
+
+def synthetic_signals(seconds: float, heart_rate: float = 72, sampling_rate: int = SAMPLING_RATE,
+                      leads: List[str] = STANDARD_LEAD_ORDER, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    Generate the integer signals of a synthetic ECG recording.
+
+    Args:
+        seconds (float): The length of the recording.
+        heart_rate (float): The mean heart rate in beats per minute.
+        sampling_rate (int): The number of samples per second.
+        leads (List[str]): The lead identifiers, each one of LEAD_AMPLITUDES.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        Dict[str, np.ndarray]: The int32 signal of each lead.
+    """
+    rng = np.random.default_rng(seed)
+    number_of_samples = int(seconds * sampling_rate)
+    t = np.arange(number_of_samples) / sampling_rate
+
+    # Beat onsets with 5% RR-interval variability
+    mean_rr = 60 / heart_rate
+    rr = mean_rr * (1 + 0.05 * rng.standard_normal(int(seconds / mean_rr) + 2))
+    onsets = np.concatenate(([0], np.cumsum(rr)))
+    beat_time = t - onsets[np.searchsorted(onsets, t, side="right") - 1]
+
+    # Contribution of each wave, shape (5, samples)
+    waves = np.exp(-0.5 * ((beat_time - WAVE_CENTERS[:, None]) / WAVE_WIDTHS[:, None]) ** 2)
+
+    signals = {}
+    for identifier in leads:
+        wander = 80 * np.sin(2 * np.pi * 0.25 * t + rng.uniform(0, 2 * np.pi))
+        mains = 15 * np.sin(2 * np.pi * 50 * t)
+        noise = rng.normal(0, 20, number_of_samples)
+        signal = np.asarray(LEAD_AMPLITUDES[identifier], dtype=float) @ waves + wander + mains + noise
+        signals[identifier] = signal.astype(np.int32)
+    return signals
+
+
+def synthetic_leads(seconds: float, seed: int = 0, **kwargs) -> List[Lead]:
+    """
+    Generate a synthetic recording as Lead objects.
+
+    Args:
+        seconds (float): The length of the recording.
+        seed (int): The seed of the random generator.
+        **kwargs: Other arguments of synthetic_signals.
+
+    Returns:
+        List[Lead]: One lead per identifier, in the standard order.
+    """
+    signals = synthetic_signals(seconds, seed=seed, **kwargs)
+    return [Lead(identifier=identifier, signal=signal.tolist()) for identifier, signal in signals.items()]
+
+
+def synthetic_payload(seconds: float, seed: int = 0, **kwargs) -> List[dict]:
+    """
+    Generate a synthetic recording as the JSON body of POST /ecg/create.
+
+    Args:
+        seconds (float): The length of the recording.
+        seed (int): The seed of the random generator.
+        **kwargs: Other arguments of synthetic_signals.
+
+    Returns:
+        List[dict]: One {"identifier", "signal"} object per lead.
+    """
+    signals = synthetic_signals(seconds, seed=seed, **kwargs)
+    return [{"identifier": identifier, "signal": signal.tolist()} for identifier, signal in signals.items()]
@@ -47,3 +47,8 @@ def test_admin(session: Session) -> User:
 @pytest.fixture(name="admin_token")
 def get_admin_token(test_admin: User) -> str:
     return create_access_token({"sub": test_admin.username})
+
+
+@pytest.fixture(name="user_token")
+def get_user_token(test_user: User) -> str:
+    return create_access_token({"sub": test_user.username})
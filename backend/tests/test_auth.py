@@ -4,7 +4,9 @@ from fastapi.testclient import TestClient
 
 from sqlmodel import Session
 from auth.models import User
-from auth.utils import SECRET_KEY, create_access_token
+from auth.utils import (
+    DUMMY_PASSWORD_HASH, SECRET_KEY, UserCache, create_access_token, get_password_hash, user_cache
+)
 
 
 def test_create_user(client: TestClient, session: Session, admin_token: str):
@@ -52,3 +54,69 @@ def test_get_current_user(client: TestClient, session: Session):
     response = client.get("/auth/users/me", headers={"Authorization": f"Bearer {token}"})
     assert response.status_code == status.HTTP_200_OK
     assert response.json()["username"] == username
+
+
+def test_get_current_user_cached(client: TestClient, admin_token: str):
+    user_cache.invalidate()
+    headers = {"Authorization": f"Bearer {admin_token}"}
+
+    before = client.get("/auth/cache_stats", headers=headers).json()
+    after = client.get("/auth/cache_stats", headers=headers).json()
+
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
+    assert after["size"] == 1
+
+
+def test_user_cache_eviction_and_expiry():
+    cache = UserCache(max_size=2, ttl=60)
+    for username in ("a", "b", "c"):
+        cache.put(User(id=1, username=username, hashed_password="password"))
+
+    assert cache.get("a") is None
+    assert cache.get("c").username == "c"
+
+    cache.ttl = -1
+    cache.put(User(id=2, username="d", hashed_password="password"))
+    assert cache.get("d") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_login(client: TestClient, session: Session, admin_token: str):
+    client.post(
+        "/auth/users/create",
+        json={"username": "Carol", "password": "carol_password"},
+        headers={"Authorization": f"Bearer {admin_token}"},
+    )
+
+    response = client.post("/auth/token", data={"username": "Carol", "password": "carol_password"})
+    assert response.status_code == status.HTTP_200_OK
+    assert jwt.decode(response.json()["access_token"], SECRET_KEY, algorithms=["HS256"])["sub"] == "Carol"
+
+    response = client.post("/auth/token", data={"username": "Carol", "password": "wrong"})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    response = client.post("/auth/token", data={"username": "Nobody", "password": "wrong"})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_login_unknown_username_verifies_dummy_hash(monkeypatch, client: TestClient):
+    verified = []
+    monkeypatch.setattr("auth.utils.verify_password", lambda password, hashed: verified.append(hashed) or False)
+
+    response = client.post("/auth/token", data={"username": "Nobody", "password": "wrong"})
+
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert verified == [DUMMY_PASSWORD_HASH]
+    # The dummy hash has the cost of real ones, so unknown usernames take as long to reject
+    assert DUMMY_PASSWORD_HASH[:7] == get_password_hash("password")[:7]
+
+
+def test_login_rejected_when_password_pool_saturated(monkeypatch, client: TestClient):
+    monkeypatch.setattr("auth.utils.PASSWORD_HASH_WORKERS", 0)
+    monkeypatch.setattr("auth.utils.PASSWORD_HASH_QUEUE_DEPTH", 0)
+
+    response = client.post("/auth/token", data={"username": "Alice", "password": "password"})
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
@@ -1,12 +1,42 @@
+import asyncio
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import msgpack
+import numpy as np
 import pytest
-from fastapi import HTTPException
-from sqlmodel import Session
+from fastapi import HTTPException, WebSocketDisconnect, status
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, delete, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
+from urllib.parse import unquote
 
 from auth.models import User, Role
-from ecg.crud import create_ecg, retrieve_ecgs, retrieve_ecg_by_id, compute_insights
-from ecg.models import Lead
-from ecg.utils import count_zero_crossings
+from auth.utils import create_access_token
+from db import engine, get_async_database_url, run_db
+from ecg.crud import (
+    create_ecg, create_ecg_pending, retrieve_ecgs, retrieve_ecg_summaries, retrieve_ecg_by_id, compute_insights,
+    create_ecgs_bulk, retrieve_ecg_signals, store_insights
+)
+from ecg.analytics import INSIGHTS_VERSION, METRICS, SignalBatch, analyze_leads, detect_r_peaks
+from ecg.codec import BLOCK_SIZE, decode_signal, encode_signal, lead_signal
+from ecg.models import ECG, ECGInsight, InsightStatus, JobStatus, Lead, LeadPyramid, ReanalysisJob
+from ecg.pyramid import build_pyramid
+from ecg.records import LeadSummary, fetch_lead_windows
+from ecg.streaming import ECGStreamWriter, sweep_abandoned_uploads
+from ecg import reanalysis
+from ecg.reanalysis import cancel_reanalysis, lock_reanalysis, run_reanalysis, start_reanalysis, unlock_reanalysis
+from ecg.worker import read_lead_signals, recover_pending_analyses, run_analysis
+from ecg.utils import count_zero_crossings, count_zero_crossings_python
+from import_ecgs import _prepare_or_skip, copy_batch, prepare_recording
+from main import app
+from migrate import missing_schema
 
 
 @pytest.fixture
@@ -26,13 +56,29 @@ def test_create_ecg(session: Session, test_leads: List[Lead], test_user: User):
     assert ecg.user_id == test_user.id
 
 
+def test_create_ecg_idempotent(client: TestClient, session: Session, test_user: User, user_token: str):
+    leads = [{"identifier": "I", "signal": [7, -7, 7]}, {"identifier": "II", "signal": [1, 2]}]
+    headers = {"Authorization": f"Bearer {user_token}", "Idempotency-Key": "upload-1"}
+
+    first = client.post("/ecg/create", json=leads, headers=headers).json()["data"]
+    retried = client.post("/ecg/create", json=leads, headers=headers).json()["data"]
+    repeated = client.post("/ecg/create", json=leads, headers={"Authorization": headers["Authorization"]}).json()
+    assert retried["id"] == repeated["data"]["id"] == first["id"]
+    assert first["content_hash"] is not None
+    copies = select(func.count()).where(ECG.user_id == test_user.id, ECG.content_hash == first["content_hash"])
+    assert session.exec(copies).one() == 1
+
+    response = client.post("/ecg/create", json=leads[:1], headers=headers)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 def test_retrieve_ecgs(session: Session, test_leads: List[Lead]):
     test_user = User(username="test_user", hashed_password="password")
     session.add(test_user)
     session.commit()
 
     create_ecg(user=test_user, session=session, leads=test_leads)
-    create_ecg(user=test_user, session=session, leads=test_leads)
+    create_ecg(user=test_user, session=session, leads=[Lead(identifier="I", signal=[1, -1])])
 
     ecgs = retrieve_ecgs(user=test_user, session=session)
 
@@ -40,6 +86,27 @@ def test_retrieve_ecgs(session: Session, test_leads: List[Lead]):
     assert all(ecg.user_id == test_user.id for ecg in ecgs)
 
 
+def test_retrieve_ecg_summaries_paginated(session: Session, test_leads: List[Lead]):
+    test_user = User(username="paginated_user", hashed_password="password")
+    session.add(test_user)
+    session.commit()
+
+    ids = [create_ecg(user=test_user, session=session, leads=[Lead(identifier="I", signal=[1, -index])]).id
+           for index in range(1, 4)]
+
+    first_page = retrieve_ecg_summaries(user=test_user, session=session, limit=2)
+    assert [ecg.id for ecg in first_page["data"]] == ids[:0:-1]
+    assert first_page["data"][0].leads == [LeadSummary(identifier="I", number_of_samples=2)]
+    assert first_page["next_cursor"] is not None
+
+    second_page = retrieve_ecg_summaries(user=test_user, session=session, limit=2, cursor=first_page["next_cursor"])
+    assert [ecg.id for ecg in second_page["data"]] == ids[:1]
+    assert second_page["next_cursor"] is None
+
+    dated = retrieve_ecg_summaries(user=test_user, session=session, date_from=first_page["data"][0].date)
+    assert [ecg.id for ecg in dated["data"]] == ids[2:]
+
+
 def test_retrieve_ecg_by_id(session: Session, test_user: User, test_leads: List[Lead]):
     ecg = create_ecg(user=test_user, session=session, leads=test_leads)
     retrieved_ecg = retrieve_ecg_by_id(user=test_user, session=session, ecg_id=ecg.id)
@@ -49,6 +116,59 @@ def test_retrieve_ecg_by_id(session: Session, test_user: User, test_leads: List[
     assert retrieved_ecg.leads == ecg.leads
 
 
+@pytest.mark.parametrize("storage", ["array", "bytea"])
+def test_get_ecg_window(monkeypatch, client: TestClient, session: Session, test_user: User, user_token: str,
+                        storage: str):
+    monkeypatch.setattr("ecg.codec.SIGNAL_STORAGE", storage)
+    ecg = create_ecg(user=test_user, session=session, leads=[
+        Lead(identifier="I", signal=[1, 2, 3, 4, 5]),
+        Lead(identifier="II", signal=[5, -1, 3, -5, -10, 10]),
+    ])
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    response = client.get(f"/ecg/get/{ecg.id}", params={"leads": "II", "start": 1, "end": 4}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["data"]["leads"] == [
+        {"identifier": "II", "number_of_samples": 6, "start": 1, "end": 4, "signal": [-1, 3, -5]}
+    ]
+
+    response = client.get(f"/ecg/get/{ecg.id}", params={"start": 4}, headers=headers)
+    assert [lead["signal"] for lead in response.json()["data"]["leads"]] == [[5], [-10, 10]]
+
+
+def test_get_ecg_content_negotiation(client: TestClient, session: Session, test_user: User, user_token: str):
+    ecg = create_ecg(user=test_user, session=session, leads=[
+        Lead(identifier="I", signal=[1, 2, 3]),
+        Lead(identifier="II", signal=[-4, 5]),
+    ])
+    url = f"/ecg/get/{ecg.id}"
+
+    response = client.get(url, headers={"Authorization": f"Bearer {user_token}", "Accept": "application/octet-stream"})
+    assert response.headers["X-ECG-Leads"] == "I,II"
+    assert response.headers["X-ECG-Samples"] == "3,2"
+    assert np.frombuffer(response.content, dtype=response.headers["X-ECG-Dtype"]).tolist() == [1, 2, 3, -4, 5]
+
+    # Identifiers holding commas or non-latin-1 characters are percent-encoded
+    odd = create_ecg(user=test_user, session=session, leads=[
+        Lead(identifier="V1,a", signal=[7, 3]), Lead(identifier="αVR", signal=[-7])
+    ])
+    response = client.get(
+        f"/ecg/get/{odd.id}", headers={"Authorization": f"Bearer {user_token}", "Accept": "application/octet-stream"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert [unquote(identifier) for identifier in response.headers["X-ECG-Leads"].split(",")] == ["V1,a", "αVR"]
+
+    response = client.get(url, headers={"Authorization": f"Bearer {user_token}", "Accept": "application/x-npy"})
+    assert np.load(io.BytesIO(response.content)).tolist() == [[1, 2, 3], [-4, 5, 0]]
+
+    response = client.get(url, headers={"Authorization": f"Bearer {user_token}", "Accept": "application/x-msgpack"})
+    lead = msgpack.unpackb(response.content)["data"]["leads"][1]
+    assert np.frombuffer(lead["signal"], dtype="<i4").tolist() == [-4, 5]
+
+    response = client.get(url, headers={"Authorization": f"Bearer {user_token}", "Accept": "text/html"})
+    assert response.status_code == status.HTTP_406_NOT_ACCEPTABLE
+
+
 def test_retrieve_ecg_by_id_not_found(session: Session, test_user: User):
     with pytest.raises(HTTPException) as exc_info:
         retrieve_ecg_by_id(user=test_user, session=session, ecg_id=999)
@@ -63,3 +183,823 @@ def test_compute_insights(session: Session, test_user: User, test_leads: List[Le
 
     expected_zero_crossings = count_zero_crossings(test_leads)
     assert insights["zero_crossings"] == expected_zero_crossings
+
+
+def test_compute_insights_stored_at_creation(session: Session, test_user: User, test_leads: List[Lead]):
+    ecg = create_ecg(user=test_user, session=session, leads=test_leads)
+
+    insight = session.get(ECGInsight, ecg.id)
+    assert insight is not None
+    assert insight.data["zero_crossings"] == count_zero_crossings(test_leads)
+    assert set(insight.data) == {*METRICS, "compute_ms"}
+
+
+def test_compute_insights_not_recomputed_on_read(client: TestClient, session: Session, test_user: User,
+                                                 user_token: str):
+    ecg = create_ecg(user=test_user, session=session, leads=[Lead(identifier="I", signal=[17, -17, 17])])
+    url = f"/ecg/get_insight/{ecg.id}"
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    # Failed and outdated insights are reported as stored, and left to the re-analysis job
+    store_insights(session, ecg.id, {}, status=InsightStatus.FAILED)
+    session.commit()
+    assert client.get(url, headers=headers).status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert client.get(f"/ecg/insight_status/{ecg.id}", headers=headers).json()["data"]["status"] == "failed"
+
+    insight = session.get(ECGInsight, ecg.id)
+    session.refresh(insight)
+    insight.status, insight.version = InsightStatus.DONE, INSIGHTS_VERSION - 1
+    session.add(insight)
+    session.commit()
+    assert client.get(url, headers=headers).status_code == status.HTTP_409_CONFLICT
+
+    # Records stored before insights existed are pending until the re-analysis job computes them
+    session.delete(insight)
+    session.commit()
+    assert client.get(url, headers=headers).status_code == status.HTTP_409_CONFLICT
+    response = client.get(f"/ecg/insight_status/{ecg.id}", headers=headers)
+    assert response.json()["data"] == {"ecg_id": ecg.id, "status": "pending", "version": None}
+    assert session.get(ECGInsight, ecg.id) is None
+    assert client.get("/ecg/get_insight/-1", headers=headers).status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_analyze_leads_metrics():
+    # One 1000-unit, 40 ms spike per second at 500 Hz, i.e. 60 bpm, over a slow 50-unit drift
+    t = np.arange(10 * 500)
+    spikes = np.maximum(0, 1000 - 100 * np.abs(t % 500 - 10)) + (50 * np.sin(2 * np.pi * t / 5000)).astype(int)
+    leads = [Lead(identifier="II", signal=spikes.tolist()), Lead(identifier="V1", signal=[3] * 500)]
+
+    insights = analyze_leads(leads)
+
+    assert insights["heart_rate"]["bpm"] == pytest.approx(60, rel=0.02)
+    assert insights["stats"]["V1"] == {"min": 3, "max": 3, "mean": 3.0, "rms": 3.0}
+    assert insights["signal_quality"]["II"] == {"ok": True, "flags": []}
+    assert insights["signal_quality"]["V1"]["flags"] == ["short", "flat"]
+    assert insights["baseline_wander"]["V1"] == 0
+    assert set(insights["compute_ms"]) == set(METRICS)
+
+
+def test_detect_r_peaks_refractory():
+    # Complexes every 100 samples (0.2 s): each kept onset silences the next 125 samples, not each dropped one
+    t = np.arange(3000)
+    signal = np.maximum(0, 1000 - 100 * np.abs(t % 100 - 10))
+    peaks = detect_r_peaks(SignalBatch(["I", "II"], [signal, signal[:1]]))
+    assert np.diff(peaks[0]).tolist() == [200] * 14
+    assert peaks[1].tolist() == []
+
+
+def test_get_insight_selected_metrics(client: TestClient, session: Session, test_user: User,
+                                      test_leads: List[Lead], user_token: str):
+    ecg = create_ecg(user=test_user, session=session, leads=test_leads)
+    url = f"/ecg/get_insight/{ecg.id}"
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    response = client.get(url, params={"metrics": "stats,zero_crossings"}, headers=headers)
+    data = response.json()["data"]
+    assert set(data) == {"stats", "zero_crossings", "compute_ms"}
+    assert set(data["compute_ms"]) == {"stats", "zero_crossings"}
+    assert data["stats"]["I"] == {"min": 1, "max": 5, "mean": 3.0, "rms": pytest.approx(3.3166, rel=1e-4)}
+
+    response = client.get(url, params={"metrics": "qt_interval"}, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_conditional_requests(client: TestClient, session: Session, test_user: User, user_token: str):
+    ecg = create_ecg(user=test_user, session=session, leads=[Lead(identifier="I", signal=[4, -4, 4])])
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    response = client.get(f"/ecg/get/{ecg.id}", headers=headers)
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == "private, max-age=31536000, immutable"
+
+    response = client.get(f"/ecg/get/{ecg.id}", headers={**headers, "If-None-Match": f'"stale", W/{etag}'})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b"" and response.headers["etag"] == etag
+    # Each window and format is a representation of its own
+    conditional = {**headers, "If-None-Match": etag}
+    assert client.get(f"/ecg/get/{ecg.id}", params={"start": 1}, headers=conditional).status_code == 200
+    msgpack_headers = {**conditional, "Accept": "application/x-msgpack"}
+    assert client.get(f"/ecg/get/{ecg.id}", headers=msgpack_headers).status_code == 200
+
+    url = f"/ecg/get_insight/{ecg.id}"
+    response = client.get(url, headers=headers)
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert client.get(url, headers={**headers, "If-None-Match": etag}).status_code == status.HTTP_304_NOT_MODIFIED
+
+    # A re-analysis replaces the insights, and with them their ETag
+    store_insights(session, ecg.id, analyze_leads(ecg.leads))
+    session.commit()
+    response = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+
+
+def test_count_zero_crossings_matches_reference():
+    leads = [
+        Lead(identifier="I", signal=[1, 0, -1, 0, 1, -1, 2]),
+        Lead(identifier="II", signal=[-3, 3]),
+        Lead(identifier="III", signal=[]),
+        Lead(identifier="aVR", signal=[0, 0, 0, -1, 4, -2, -2, 7, 0]),
+    ]
+
+    assert count_zero_crossings(leads) == count_zero_crossings_python(leads)
+    assert count_zero_crossings(leads) == {"I": 2, "II": 1, "III": 0, "aVR": 3}
+
+
+def test_compute_insights_pending(session: Session, test_user: User):
+    ecg = create_ecg_pending(user=test_user, session=session, leads=[Lead(identifier="I", signal=[14, -14, 14])])
+
+    with pytest.raises(HTTPException) as exc_info:
+        compute_insights(user=test_user, session=session, ecg_id=ecg.id)
+
+    assert exc_info.value.status_code == 409
+
+
+def test_recover_pending_analyses(monkeypatch, session: Session, test_user: User):
+    monkeypatch.setattr("ecg.worker.ANALYSIS_WORKERS", 0)
+    stale = create_ecg_pending(user=test_user, session=session, leads=[Lead(identifier="I", signal=[15, -15, 15])])
+    recent = create_ecg_pending(user=test_user, session=session, leads=[Lead(identifier="I", signal=[16, -16, 16])])
+    # The process analysing the first record stopped two minutes ago
+    insight = session.get(ECGInsight, stale.id)
+    insight.computed_at = datetime.now() - timedelta(minutes=2)
+    session.add(insight)
+    session.commit()
+
+    assert recover_pending_analyses(older_than=timedelta(minutes=1)) == 1
+    session.expire_all()
+    assert session.get(ECGInsight, stale.id).status == InsightStatus.DONE
+    assert session.get(ECGInsight, recent.id).status == InsightStatus.PENDING
+    assert recover_pending_analyses(older_than=timedelta(minutes=1)) == 0
+
+
+def test_run_analysis_deleted_ecg(monkeypatch, caplog, session: Session):
+    monkeypatch.setattr("ecg.worker.ANALYSIS_WORKERS", 0)
+    missing_id = session.exec(select(func.coalesce(func.max(ECG.id), 0))).one() + 1000
+
+    # Neither the insights nor their failure can be stored for a deleted record; the worker logs it and gives up
+    run_analysis(missing_id)
+    assert f"Could not mark the analysis of ECG {missing_id} as failed" in caplog.text
+    assert session.get(ECGInsight, missing_id) is None
+
+
+def test_ingest_ecg(client: TestClient, user_token: str):
+    headers = {"Authorization": f"Bearer {user_token}"}
+    leads = [{"identifier": "I", "signal": [1, -1, 1]}, {"identifier": "II", "signal": [0, 2, -2]}]
+
+    response = client.post("/ecg/ingest", json=leads, headers=headers)
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    ecg_id = response.json()["data"]["ecg_id"]
+
+    # The test client runs background tasks before returning the response
+    response = client.get(f"/ecg/insight_status/{ecg_id}", headers=headers)
+    assert response.json()["data"]["status"] == "done"
+
+    response = client.get(f"/ecg/get_insight/{ecg_id}", headers=headers)
+    assert response.json()["data"]["zero_crossings"] == {"I": 2, "II": 1}
+
+
+def test_signal_codec_roundtrip():
+    signal = np.random.default_rng(0).integers(-32768, 32768, 3 * BLOCK_SIZE + 17)
+    signal[:4] = [32767, -32768, 32767, 0]
+    blob = encode_signal(signal)
+
+    assert np.array_equal(decode_signal(blob), signal)
+    assert np.array_equal(decode_signal(blob, BLOCK_SIZE - 5, 2 * BLOCK_SIZE + 3), signal[BLOCK_SIZE - 5:2 * BLOCK_SIZE + 3])
+    assert decode_signal(encode_signal([])).size == 0
+
+    with pytest.raises(ValueError):
+        encode_signal([40000])
+
+
+def test_create_ecg_bytea_storage(monkeypatch, session: Session, test_user: User):
+    monkeypatch.setattr("ecg.codec.SIGNAL_STORAGE", "bytea")
+    leads = [Lead(identifier="I", signal=[3, -2, 5, 0, -1]), Lead(identifier="II", signal=[70000, -1])]
+
+    ecg = create_ecg(user=test_user, session=session, leads=leads)
+    session.expire_all()
+    stored = retrieve_ecg_by_id(user=test_user, session=session, ecg_id=ecg.id).leads
+
+    assert stored[0].signal is None and stored[0].signal_blob is not None
+    assert stored[1].signal == [70000, -1] and stored[1].signal_blob is None
+    assert lead_signal(stored[0]).tolist() == [3, -2, 5, 0, -1]
+    assert compute_insights(user=test_user, session=session, ecg_id=ecg.id)["zero_crossings"] == {"I": 2, "II": 1}
+
+    # The background analysis reads each lead as a compact array
+    signals = read_lead_signals(session, ecg.id)
+    assert [(identifier, signal.dtype, signal.tolist()) for _, identifier, signal in signals] == [
+        ("I", np.int16, [3, -2, 5, 0, -1]), ("II", np.int32, [70000, -1])
+    ]
+
+
+def test_bytea_block_index(monkeypatch, session: Session, test_user: User):
+    monkeypatch.setattr("ecg.codec.SIGNAL_STORAGE", "bytea")
+    monkeypatch.setattr("ecg.codec.BLOCK_SIZE", 4)
+    signal = [3, -2, 5, 0, -1, 7, 7, 9, -4, 1]
+    created = create_ecg(user=test_user, session=session, leads=[Lead(identifier="I", signal=signal)])
+
+    writer = ECGStreamWriter(test_user, session, ["I"], flush_samples=2)
+    for offset in range(0, len(signal), 3):
+        writer.append("I", np.array(signal[offset:offset + 3]))
+        if writer.needs_flush:
+            writer.flush()
+    streamed = writer.finish()
+    session.expire_all()
+
+    created_lead, streamed_lead = created.leads[0], streamed.leads[0]
+    assert len(created_lead.block_offsets) == 4 and created_lead.block_offsets[-1] == len(created_lead.signal_blob)
+    assert streamed_lead.block_offsets == created_lead.block_offsets
+    assert lead_signal(streamed_lead).tolist() == signal
+
+    for start, end in [(0, None), (5, 9), (4, 8), (9, 10), (3, 3), (8, 20)]:
+        for ecg in (created, streamed):
+            window = fetch_lead_windows(session, ecg.id, start=start, end=end)[0]
+            assert window.signal.tolist() == signal[start:end]
+
+    bulk_id = create_ecgs_bulk(test_user, session, [[Lead(identifier="I", signal=signal[::-1])]])[0]
+    assert fetch_lead_windows(session, bulk_id, start=5, end=9)[0].signal.tolist() == signal[::-1][5:9]
+    assert retrieve_ecg_by_id(test_user, session, bulk_id).leads[0].block_offsets is not None
+
+    # Blobs stored before the block index existed are read whole
+    created_lead.block_offsets = None
+    session.add(created_lead)
+    session.commit()
+    assert fetch_lead_windows(session, created.id, start=5, end=9)[0].signal.tolist() == signal[5:9]
+
+
+@pytest.mark.parametrize("storage", ["array", "bytea"])
+def test_upload_ecg(monkeypatch, client: TestClient, session: Session, test_user: User, user_token: str, storage: str):
+    monkeypatch.setattr("ecg.codec.SIGNAL_STORAGE", storage)
+    monkeypatch.setattr("ecg.streaming.FLUSH_SAMPLES", 2)
+    headers = {"Authorization": f"Bearer {user_token}", "Content-Type": "application/x-ndjson"}
+    first = 1 if storage == "array" else 11
+    signals = {"I": [first, -2, 3, 4, -5, 6, 7], "II": [0, 50000, -50000, 2, 2, -1, 9]}
+
+    body = "\n".join([
+        '{"leads": ["I", "II"]}',
+        f'{{"I": [{first}, -2, 3], "II": [0]}}',
+        '{"I": [4, -5], "II": [50000, -50000, 2]}',
+        '{"I": [6, 7], "II": [2, -1, 9]}',
+    ])
+    response = client.post("/ecg/upload", content=body, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    # Streaming the same samples again, split differently, resolves to the same record
+    again = "\n".join([
+        '{"leads": ["I", "II"]}',
+        f'{{"I": [{first}, -2, 3, 4, -5, 6, 7]}}',
+        '{"II": [0, 50000, -50000, 2, 2, -1, 9]}',
+    ])
+    ecgs = session.exec(select(func.count()).select_from(ECG).where(ECG.user_id == test_user.id)).one()
+    assert client.post("/ecg/upload", content=again, headers=headers).json()["data"]["id"] == (
+        response.json()["data"]["id"]
+    )
+    assert session.exec(select(func.count()).select_from(ECG).where(ECG.user_id == test_user.id)).one() == ecgs
+
+    streamed = retrieve_ecg_by_id(user=test_user, session=session, ecg_id=response.json()["data"]["id"])
+    # Identical uploads of one user are deduplicated, so the reference record is stored for another user
+    owner = User(username=f"upload_{storage}", hashed_password="password")
+    session.add(owner)
+    session.commit()
+    created = create_ecg(user=owner, session=session, leads=[
+        Lead(identifier=identifier, signal=signal) for identifier, signal in signals.items()
+    ])
+    session.expire_all()
+
+    assert streamed.content_hash == created.content_hash is not None
+    for streamed_lead, created_lead in zip(streamed.leads, created.leads):
+        assert streamed_lead.identifier == created_lead.identifier
+        assert streamed_lead.number_of_samples == created_lead.number_of_samples
+        assert (streamed_lead.signal_blob is None) == (created_lead.signal_blob is None)
+        assert lead_signal(streamed_lead).tolist() == lead_signal(created_lead).tolist()
+    assert [lead_signal(lead).tolist() for lead in streamed.leads] == list(signals.values())
+
+    response = client.get(f"/ecg/get_insight/{streamed.id}", headers=headers)
+    expected = compute_insights(user=owner, session=session, ecg_id=created.id)
+    assert {key: value for key, value in response.json()["data"].items() if key != "compute_ms"} == {
+        key: value for key, value in expected.items() if key != "compute_ms"
+    }
+
+
+def test_incomplete_upload_hidden_and_swept(session: Session, test_user: User):
+    writer = ECGStreamWriter(test_user, session, ["I"], flush_samples=1)
+    writer.append("I", np.array([1, -1, 1]))
+    writer.flush()
+    ecg_id = writer.ecg.id
+
+    assert ecg_id not in [ecg.id for ecg in retrieve_ecg_summaries(user=test_user, session=session)["data"]]
+    for read in (retrieve_ecg_by_id, compute_insights):
+        with pytest.raises(HTTPException) as exc_info:
+            read(user=test_user, session=session, ecg_id=ecg_id)
+        assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
+
+    # Recent uploads are kept, abandoned ones are deleted with their leads and chunks
+    assert sweep_abandoned_uploads(session) == 0
+    assert sweep_abandoned_uploads(session, older_than=timedelta(0)) == 1
+    session.expire_all()
+    assert session.get(ECG, ecg_id) is None
+    assert session.exec(select(func.count()).select_from(Lead).where(Lead.ecg_id == ecg_id)).one() == 0
+
+    with pytest.raises(HTTPException) as exc_info:
+        writer.finish()
+    assert exc_info.value.status_code == status.HTTP_410_GONE
+
+
+def test_upload_ecg_binary(client: TestClient, session: Session, test_user: User, user_token: str):
+    frames = np.array([[1, -1], [-2, 2], [3, 0]], dtype="<i2")
+    body = b'{"leads": ["V1", "V2"]}\n' + frames.tobytes()
+
+    response = client.post("/ecg/upload", content=body, headers={
+        "Authorization": f"Bearer {user_token}", "Content-Type": "application/octet-stream"
+    })
+    assert response.status_code == status.HTTP_200_OK
+
+    ecg = retrieve_ecg_by_id(user=test_user, session=session, ecg_id=response.json()["data"]["id"])
+    session.refresh(ecg)
+    assert [(lead.identifier, lead_signal(lead).tolist()) for lead in ecg.leads] == [("V1", [1, -2, 3]), ("V2", [-1, 2, 0])]
+
+    response = client.post("/ecg/upload", content=body[:-1], headers={
+        "Authorization": f"Bearer {user_token}", "Content-Type": "application/octet-stream"
+    })
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.parametrize("line", [
+    '{"I": 5}', '{"I": [[1, 2], [3, 4]]}', '{"I": [100000000000000000000000]}', '{"I": [3000000000]}',
+    '{"I": [1.7, -2.2]}', '{"I": [true]}', '{"I": ["1"]}', '[1, 2]',
+])
+def test_upload_ecg_invalid_samples(client: TestClient, user_token: str, line: str):
+    response = client.post("/ecg/upload", content='{"leads": ["I"]}\n' + line, headers={
+        "Authorization": f"Bearer {user_token}", "Content-Type": "application/x-ndjson"
+    })
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_live_ecg(client: TestClient, session: Session, test_user: User, user_token: str):
+    signals = {"I": [3, -1, 0, 2, -2, 5, -5, 1], "II": [100, 100, -40000, 7, 7, 7, -1, 2]}
+
+    with client.websocket_connect("/ecg/live?every=3", subprotocols=["bearer", user_token]) as websocket:
+        assert websocket.accepted_subprotocol == "bearer"
+        websocket.send_json({"leads": ["I", "II"]})
+        ecg_id = websocket.receive_json()["ecg_id"]
+
+        websocket.send_json({identifier: signal[:2] for identifier, signal in signals.items()})
+        websocket.send_json({identifier: signal[2:4] for identifier, signal in signals.items()})
+        update = websocket.receive_json()
+        assert update == {"type": "insights", "data": {
+            "samples": {"I": 4, "II": 4},
+            "zero_crossings": {"I": 1, "II": 2},
+            "stats": {"I": {"min": -1, "max": 3, "mean": 1.0, "rms": 3.5 ** 0.5},
+                      "II": {"min": -40000, "max": 100, "mean": -9948.25, "rms": pytest.approx(20000.125)}},
+        }}
+
+        frames = np.array([signals["I"][4:], signals["II"][4:]], dtype="<i2").T
+        websocket.send_bytes(frames.tobytes())
+        update = websocket.receive_json()["data"]
+
+    expected = analyze_leads([Lead(identifier=identifier, signal=signal) for identifier, signal in signals.items()])
+    assert update["zero_crossings"] == expected["zero_crossings"]
+    assert all(update["stats"][identifier] == pytest.approx(expected["stats"][identifier]) for identifier in signals)
+
+    session.expire_all()
+    ecg = retrieve_ecg_by_id(user=test_user, session=session, ecg_id=ecg_id)
+    assert [lead_signal(lead).tolist() for lead in ecg.leads] == list(signals.values())
+    assert compute_insights(user=test_user, session=session, ecg_id=ecg_id)["zero_crossings"] == update["zero_crossings"]
+
+
+@pytest.mark.parametrize("url", ["/ecg/live", "/ecg/live?token={token}"])
+def test_live_ecg_requires_token(client: TestClient, user_token: str, url: str):
+    # Tokens in the URL would end up in access logs, so they are not accepted
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect(url.format(token=user_token)) as websocket:
+            websocket.receive_json()
+    assert exc_info.value.code == status.WS_1008_POLICY_VIOLATION
+
+
+@pytest.mark.parametrize("message", [
+    '{"I": 5}', '{"I": [[1, 2], [3, 4]]}', '{"I": [100000000000000000000000]}', '{"I": [3000000000]}',
+    '{"I": [1.7, -2.2]}', '{"III": [1]}',
+])
+def test_live_ecg_invalid_samples(client: TestClient, session: Session, test_user: User, user_token: str,
+                                  message: str):
+    headers = {"Authorization": f"Bearer {user_token}"}
+    with client.websocket_connect("/ecg/live?every=1", headers=headers) as websocket:
+        websocket.send_json({"leads": ["I"]})
+        ecg_id = websocket.receive_json()["ecg_id"]
+        websocket.send_text(message)
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            websocket.receive_json()
+    assert exc_info.value.code == status.WS_1007_INVALID_FRAME_PAYLOAD_DATA
+    # The partial recording is discarded
+    assert session.get(ECG, ecg_id) is None
+
+
+def test_run_db_async_session(test_user: User, test_leads: List[Lead]):
+    async def create_and_analyse():
+        engine = create_async_engine(get_async_database_url(os.getenv("DATABASE_URL")))
+        async with AsyncSession(engine, expire_on_commit=False) as async_session:
+            ecg = await run_db(async_session, create_ecg, test_user, leads=test_leads)
+            insights = await run_db(async_session, compute_insights, test_user, ecg_id=ecg.id)
+        await engine.dispose()
+        return ecg, insights
+
+    ecg, insights = asyncio.run(create_and_analyse())
+
+    assert ecg.id is not None
+    assert insights["zero_crossings"] == count_zero_crossings(test_leads)
+
+
+@pytest.mark.parametrize("storage", ["array", "bytea"])
+def test_run_db_async_reads(monkeypatch, session: Session, test_user: User, storage: str):
+    monkeypatch.setattr("ecg.codec.SIGNAL_STORAGE", storage)
+    signal = [(index * 13 + len(storage)) % 400 - 200 for index in range(BLOCK_SIZE + 100)]
+    ecg = create_ecg(user=test_user, session=session, leads=[
+        Lead(identifier="I", signal=signal), Lead(identifier="II", signal=signal[::-1])
+    ])
+
+    async def read():
+        engine = create_async_engine(get_async_database_url(os.getenv("DATABASE_URL")))
+        async with AsyncSession(engine, expire_on_commit=False) as async_session:
+            page = await run_db(async_session, retrieve_ecg_summaries, test_user, limit=1)
+            window = await run_db(
+                async_session, retrieve_ecg_signals, test_user,
+                ecg_id=ecg.id, leads=["II"], start=10, end=BLOCK_SIZE + 5,
+            )
+            with pytest.raises(HTTPException) as exc_info:
+                await run_db(async_session, retrieve_ecg_signals, test_user, ecg_id=-1)
+        await engine.dispose()
+        return page, window, exc_info.value
+
+    page, window, error = asyncio.run(read())
+
+    # The native async reads return what the synchronous functions return
+    assert page == retrieve_ecg_summaries(user=test_user, session=session, limit=1)
+    expected = retrieve_ecg_signals(user=test_user, session=session, ecg_id=ecg.id, leads=["II"], start=10,
+                                    end=BLOCK_SIZE + 5)
+    assert [(lead.identifier, lead.number_of_samples, lead.start, lead.end) for lead in window.leads] == \
+        [(lead.identifier, lead.number_of_samples, lead.start, lead.end) for lead in expected.leads]
+    assert window.leads[0].signal.tolist() == signal[::-1][10:BLOCK_SIZE + 5]
+    assert error.status_code == 404
+
+
+def test_create_ecgs_bulk(client: TestClient, session: Session, test_user: User, user_token: str):
+    items = [
+        {"leads": [{"identifier": "I", "signal": [1, -1, 1]}]},
+        {"leads": [{"identifier": "I", "signal": "not a signal"}]},
+        {"leads": [{"identifier": "II", "signal": [-2, 2]}, {"identifier": "III", "signal": []}]},
+        ["not an object"],
+    ]
+
+    response = client.post("/ecg/create_bulk", json=items, headers={"Authorization": f"Bearer {user_token}"})
+    assert response.status_code == status.HTTP_200_OK
+    ids = response.json()["data"]["ids"]
+    assert ids[1] is None and ids[3] is None
+    assert [error["index"] for error in response.json()["data"]["errors"]] == [1, 3]
+
+    second = retrieve_ecg_by_id(user=test_user, session=session, ecg_id=ids[2])
+    assert [(lead.identifier, lead.number_of_samples) for lead in second.leads] == [("II", 2), ("III", 0)]
+    assert compute_insights(user=test_user, session=session, ecg_id=ids[0])["zero_crossings"] == {"I": 2}
+    assert ids[0] < ids[2]
+
+
+def test_ingest_and_bulk_idempotent(client: TestClient, session: Session, test_user: User, user_token: str):
+    headers = {"Authorization": f"Bearer {user_token}"}
+    leads = [{"identifier": "I", "signal": [8, -8, 8]}]
+    stored = client.post("/ecg/create", json=leads, headers=headers).json()["data"]["id"]
+
+    # Repeated uploads resolve to the stored record, whichever endpoint stored it
+    response = client.post("/ecg/ingest", json=leads, headers=headers)
+    assert response.json()["data"]["ecg_id"] == stored
+    items = [{"leads": leads}, {"leads": [{"identifier": "I", "signal": [9, -9]}]}, {"leads": leads}]
+    ids = client.post("/ecg/create_bulk", json=items, headers=headers).json()["data"]["ids"]
+    assert ids[0] == ids[2] == stored and ids[1] != stored
+
+    retry = {**headers, "Idempotency-Key": "backlog-1"}
+    items = [{"leads": [{"identifier": "I", "signal": [10, -10]}]}, {"leads": [{"identifier": "I", "signal": [11]}]}]
+    first = client.post("/ecg/create_bulk", json=items, headers=retry).json()["data"]["ids"]
+    assert client.post("/ecg/create_bulk", json=items, headers=retry).json()["data"]["ids"] == first
+    assert client.post("/ecg/create_bulk", json=items[::-1], headers=retry).status_code == 422
+
+    retry = {**headers, "Idempotency-Key": "ingest-1"}
+    first = client.post("/ecg/ingest", json=[{"identifier": "I", "signal": [12, -12]}], headers=retry)
+    again = client.post("/ecg/ingest", json=[{"identifier": "I", "signal": [12, -12]}], headers=retry)
+    assert again.json()["data"]["ecg_id"] == first.json()["data"]["ecg_id"]
+    assert client.post("/ecg/ingest", json=[{"identifier": "I", "signal": [13]}], headers=retry).status_code == 422
+    digests = select(ECG.content_hash).where(ECG.id.in_([stored, ids[1], first.json()["data"]["ecg_id"]]))
+    assert None not in session.exec(digests).all()
+
+
+def test_import_recordings_with_copy(tmp_path, session: Session, test_user: User):
+    recording = tmp_path / "recording_1"
+    recording.mkdir()
+    (recording / "II.csv").write_text("5,-1,3\n-5,-10,11\n")
+    np.save(recording / "I.npy", np.array([1, 2, 3, 4, 6]))
+
+    long_signal = (np.arange(3000) % 97 - 48) * 3
+    np.save(recording / "III.npy", long_signal)
+    (recording / "metadata.json").write_text('{"date": "2021-03-04T05:06:07"}')
+
+    copy_batch(test_user.id, [prepare_recording(str(recording))])
+
+    ecg = session.exec(select(ECG).where(ECG.user_id == test_user.id, ECG.date == datetime(2021, 3, 4, 5, 6, 7))).one()
+    leads = [
+        Lead(identifier="I", signal=[1, 2, 3, 4, 6]), Lead(identifier="II", signal=[5, -1, 3, -5, -10, 11]),
+        Lead(identifier="III", signal=long_signal.tolist()),
+    ]
+    assert [(lead.identifier, lead.number_of_samples, lead_signal(lead).tolist()) for lead in ecg.leads] == [
+        (lead.identifier, len(lead.signal), lead.signal) for lead in leads
+    ]
+    assert compute_insights(user=test_user, session=session, ecg_id=ecg.id)["zero_crossings"] == (
+        count_zero_crossings(leads)
+    )
+
+    # The pyramids are stored like those of a record created through the API
+    stored = session.exec(
+        select(LeadPyramid).where(LeadPyramid.lead_id == ecg.leads[2].id).order_by(LeadPyramid.level)
+    ).all()
+    assert [(level.level, level.minimum, level.maximum) for level in stored] == [
+        (level, minimum.tolist(), maximum.tolist()) for level, minimum, maximum in build_pyramid(long_signal)
+    ]
+    assert session.exec(select(func.count()).where(LeadPyramid.lead_id == ecg.leads[0].id)).one() == 0
+
+
+def test_import_skips_invalid_recordings(tmp_path):
+    (tmp_path / "empty").mkdir()
+    (tmp_path / "out_of_range").mkdir()
+    (tmp_path / "out_of_range" / "I.csv").write_text("1,2,3000000000")
+    (tmp_path / "floats").mkdir()
+    np.save(tmp_path / "floats" / "I.npy", np.array([0.5, 1.5]))
+
+    for name, reason in [("empty", "no lead file"), ("out_of_range", "32-bit"), ("floats", "integers")]:
+        skipped, recording, message = _prepare_or_skip(str(tmp_path / name))
+        assert skipped == name and recording is None and reason in message
+
+
+def test_import_resumes_without_duplicates(tmp_path, session: Session, test_user: User):
+    recordings = []
+    for index in range(3):
+        recording = tmp_path / f"recording_{index}"
+        recording.mkdir()
+        (recording / "I.csv").write_text(f"{index},-21,21")
+        os.utime(recording / "I.csv", (1_600_000_000 + index, 1_600_000_000 + index))
+        recordings.append(prepare_recording(str(recording)))
+
+    # Without metadata, the date is the modification time of the lead files
+    dates = [recording.date for recording in recordings]
+    assert dates == [datetime.fromtimestamp(1_600_000_000 + index) for index in range(3)]
+
+    # A batch committed before a crash, but missing from the checkpoint, is read again on resume
+    assert copy_batch(test_user.id, recordings[:2]) == 2
+    assert copy_batch(test_user.id, recordings) == 1
+    assert copy_batch(test_user.id, recordings + recordings) == 0
+
+    digests = [recording.digest for recording in recordings]
+    stored = session.exec(select(ECG.content_hash).where(ECG.user_id == test_user.id, ECG.content_hash.in_(digests)))
+    assert sorted(stored.all()) == sorted(digests)
+
+
+def test_missing_schema(session: Session):
+    assert missing_schema() == []
+
+    # The shared session must not hold locks on the tables altered below
+    session.commit()
+    with engine.connect() as connection:
+        connection.execute(text("DROP INDEX ix_lead_ecg_id"))
+        connection.execute(text("ALTER TABLE lead DROP COLUMN block_offsets"))
+        assert missing_schema(connection) == ["lead.block_offsets", "lead.ix_lead_ecg_id"]
+        connection.rollback()
+    assert missing_schema() == []
+
+
+def test_metrics_endpoint(client: TestClient, user_token: str):
+    headers = {"Authorization": f"Bearer {user_token}"}
+    client.post("/ecg/create", json=[{"identifier": "I", "signal": [1, -1, 1]}], headers=headers)
+
+    response = client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="POST",route="/ecg/create",status="200"}' in body
+    assert 'db_query_duration_seconds_count{engine="sync",operation="INSERT"}' in body
+    assert 'ecg_insight_compute_seconds_count{source="ingest"}' in body
+    assert 'db_pool_checked_out{engine="sync"}' in body
+    # The scrape is unauthenticated, so it says nothing about the users
+    assert "user_cache" not in body
+
+    # Failed statements do not leave their start time behind
+    with engine.connect() as connection:
+        with pytest.raises(DBAPIError):
+            connection.execute(text("SELECT 1 / 0"))
+        assert not connection.info.get("query_start")
+        connection.rollback()
+        connection.execute(text("SELECT 1"))
+
+
+def test_profile_request(monkeypatch, tmp_path, client: TestClient, session: Session, test_user: User,
+                         test_leads: List[Lead], user_token: str, admin_token: str):
+    monkeypatch.setattr("profiling.PROFILE_DIR", str(tmp_path))
+    ecg = create_ecg(user=test_user, session=session, leads=test_leads)
+    url = f"/ecg/get_insight/{ecg.id}"
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    response = client.get(url, headers=headers)
+    assert "X-Profile-Id" not in response.headers
+
+    # The flag of a non-admin is ignored
+    response = client.get(url, params={"profile": 1}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK and "X-Profile-Id" not in response.headers
+    response = client.get(url, headers={**headers, "X-Profile": "1", "X-Profile-Token": "not a token"})
+    assert response.status_code == status.HTTP_200_OK and "X-Profile-Id" not in response.headers
+
+    # Only true flags opt in
+    response = client.get(url, params={"profile": "0"}, headers={**headers, "X-Profile-Token": admin_token})
+    assert response.status_code == status.HTTP_200_OK and "X-Profile-Id" not in response.headers
+    response = client.get(url, headers={**headers, "X-Profile": "false", "X-Profile-Token": admin_token})
+    assert response.status_code == status.HTTP_200_OK and "X-Profile-Id" not in response.headers
+
+    response = client.get(url, headers={**headers, "X-Profile": "1", "X-Profile-Token": admin_token})
+    assert response.status_code == status.HTTP_200_OK
+    profile_id = response.headers["X-Profile-Id"]
+    response = client.get(url, params={"profile": "true"}, headers={**headers, "X-Profile-Token": admin_token})
+    latest_id = response.headers["X-Profile-Id"]
+
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+    assert client.get("/profiles", headers=admin_headers).json()["data"] == [latest_id, profile_id]
+    report = client.get(f"/profiles/{profile_id}", params={"format": "text"}, headers=admin_headers)
+    assert "compute_insights" in report.text
+    assert client.get(f"/profiles/{profile_id}", headers=headers).status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_get_ecg_overview(client: TestClient, session: Session, test_user: User, user_token: str):
+    signal = (1000 * np.sin(np.arange(10000) / 50)).astype(int) + np.arange(10000) % 7
+    ecg = create_ecg(user=test_user, session=session, leads=[
+        Lead(identifier="I", signal=signal.tolist()), Lead(identifier="II", signal=signal[:3000].tolist())
+    ])
+    url = f"/ecg/overview/{ecg.id}"
+    headers = {"Authorization": f"Bearer {user_token}"}
+
+    params = {"points": 100, "leads": "I", "start": 1000}
+    lead = client.get(url, params=params, headers=headers).json()["data"]["leads"][0]
+    step = lead["samples_per_point"]
+    assert step > 1 and len(lead["min"]) <= 100
+    assert (lead["start"], lead["end"]) == (1000 - 1000 % step, 10000)
+    buckets = [signal[index:index + step] for index in range(lead["start"], lead["end"], step)]
+    assert lead["min"] == [int(bucket.min()) for bucket in buckets]
+    assert lead["max"] == [int(bucket.max()) for bucket in buckets]
+
+    # Zoomed in enough, the samples themselves are returned
+    leads = client.get(url, params={"points": 100, "start": 2950, "end": 3050}, headers=headers).json()["data"]["leads"]
+    assert [(lead["samples_per_point"], lead["end"]) for lead in leads] == [(1, 3050), (1, 3000)]
+    assert leads[0]["min"] == leads[0]["max"] == signal[2950:3050].tolist()
+
+    # Levels finer than FIRST_LEVEL are read from the signal
+    params = {"points": 100, "leads": "I", "start": 1000, "end": 1700}
+    zoomed = client.get(url, params=params, headers=headers).json()["data"]["leads"][0]
+    assert zoomed["samples_per_point"] == 7 and zoomed["min"][0] == int(signal[1000:1007].min())
+
+    # Pyramids missing for older records are computed from the signal, without writing in the read
+    lead_ids = [lead.id for lead in ecg.leads]
+    levels = session.exec(select(LeadPyramid.level).where(LeadPyramid.lead_id == lead_ids[0])).all()
+    assert sorted(levels) == [4, 5, 6, 7]
+    session.exec(delete(LeadPyramid).where(LeadPyramid.lead_id.in_(lead_ids)))
+    session.commit()
+    params = {"points": 100, "leads": "I", "start": 1000}
+    assert client.get(url, params=params, headers=headers).json()["data"]["leads"][0] == lead
+    assert session.exec(select(func.count()).where(LeadPyramid.lead_id.in_(lead_ids))).one() == 0
+
+    # Leads sharing an identifier are kept apart
+    twins = create_ecg(user=test_user, session=session, leads=[
+        Lead(identifier="I", signal=[3, 1, 4, 1, 5]), Lead(identifier="I", signal=[-2, 7, -1, 8])
+    ])
+    leads = client.get(f"/ecg/overview/{twins.id}", params={"points": 10}, headers=headers).json()["data"]["leads"]
+    assert [(lead["identifier"], lead["min"]) for lead in leads] == [("I", [3, 1, 4, 1, 5]), ("I", [-2, 7, -1, 8])]
+
+
+def test_get_aggregate(client: TestClient, session: Session):
+    user = User(username="aggregate_user", hashed_password="password")
+    session.add(user)
+    session.commit()
+
+    for index, date in enumerate((datetime(2024, 3, 4, 9), datetime(2024, 3, 4, 18), datetime(2024, 3, 12, 9))):
+        leads = [Lead(identifier="I", signal=[1 + index, -1, 1]), Lead(identifier="II", signal=[4, 4, -4, 10])]
+        ecg = create_ecg(user=user, session=session, leads=leads)
+        ecg.date = date
+        session.add(ecg)
+    # Insights of an older version are counted apart and left out of the statistics
+    outdated = create_ecg(user=user, session=session, leads=[Lead(identifier="II", signal=[100, -100, 100])])
+    outdated.date = datetime(2024, 3, 5)
+    insight = session.get(ECGInsight, outdated.id)
+    insight.version = INSIGHTS_VERSION - 1
+    session.add_all([outdated, insight])
+    session.commit()
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': user.username})}"}
+    response = client.get("/ecg/aggregate", params={"period": "week", "date_to": "2024-03-10"}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    [week] = response.json()["data"]
+    assert week["period"].startswith("2024-03-04")
+    assert (week["ecgs"], week["analyzed"], week["outdated"]) == (3, 2, 1)
+    assert week["leads"]["I"]["zero_crossings"] == 2
+    assert week["leads"]["II"] == {
+        "ecgs": 2, "mean": 3.5, "rms": pytest.approx(37 ** 0.5), "min": -4, "max": 10,
+        "zero_crossings": 2, "baseline_wander": None, "quality_ok": 0.0,
+    }
+
+    response = client.get("/ecg/aggregate", params={"period": "day"}, headers=headers)
+    assert [day["ecgs"] for day in response.json()["data"]] == [2, 1, 1]
+
+
+def test_reanalysis_job(client: TestClient, session: Session, test_user: User, admin_token: str, user_token: str):
+    ecgs = [create_ecg(user=test_user, session=session, leads=[Lead(identifier="I", signal=[index, -index, index])])
+            for index in range(20, 25)]
+    for ecg in ecgs[1:-1]:
+        insight = session.get(ECGInsight, ecg.id)
+        insight.version, insight.data = 1, {}
+        session.add(insight)
+    # The last record was stored before insights existed
+    session.delete(session.get(ECGInsight, ecgs[-1].id))
+    # Uploads in progress are not analysed
+    writer = ECGStreamWriter(test_user, session, ["I"], flush_samples=1)
+    writer.append("I", np.array([1, -1, 1]))
+    writer.flush()
+    session.commit()
+
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    assert client.post("/ecg/reanalysis", headers={"Authorization": f"Bearer {user_token}"}).status_code == 403
+    response = client.post("/ecg/reanalysis", params={"max_rate": 0}, headers=headers)
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    job = response.json()["data"]
+    assert job["status"] == "running" and job["total"] >= 4
+
+    for _ in range(200):
+        job = client.get(f"/ecg/reanalysis/{job['id']}", headers=headers).json()["data"]
+        if job["status"] != "running":
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done" and job["processed"] == job["total"] and job["remaining"] == 0
+    assert job["checkpoint"] >= ecgs[-1].id and job["throughput_per_second"] > 0
+
+    session.expire_all()
+    for ecg in ecgs:
+        insight = session.get(ECGInsight, ecg.id)
+        assert insight.version == INSIGHTS_VERSION and insight.data["zero_crossings"] == {"I": 2}
+    assert session.get(ECGInsight, writer.ecg_id) is None
+    writer.abort()
+
+    # While a job holds the lock, starting another one writes no job
+    jobs = session.exec(select(func.count()).select_from(ReanalysisJob)).one()
+    locker = lock_reanalysis()
+    try:
+        assert client.post("/ecg/reanalysis", headers=headers).status_code == status.HTTP_409_CONFLICT
+    finally:
+        unlock_reanalysis(locker)
+    assert session.exec(select(func.count()).select_from(ReanalysisJob)).one() == jobs
+
+
+def test_reanalysis_cancel_and_resume(monkeypatch, session: Session, test_user: User):
+    ecgs = [create_ecg(user=test_user, session=session, leads=[Lead(identifier="I", signal=[index, -index, index])])
+            for index in range(30, 33)]
+    for ecg in ecgs:
+        insight = session.get(ECGInsight, ecg.id)
+        insight.version, insight.data = 1, {}
+        session.add(insight)
+    session.commit()
+
+    # Cancel the job once its first batch is written
+    write_batch = reanalysis._write_batch
+
+    def write_and_cancel(job_id, results, elapsed):
+        written = write_batch(job_id, results, elapsed)
+        with Session(engine) as other:
+            cancel_reanalysis(other, job_id)
+        return written
+
+    monkeypatch.setattr("ecg.reanalysis._write_batch", write_and_cancel)
+    locker = lock_reanalysis()
+    job = start_reanalysis(session, max_rate=0)
+    run_reanalysis(job.id, locker, workers=1, batch_size=1)
+    session.refresh(job)
+    assert job.status == JobStatus.CANCELLED and job.processed == 1 and job.checkpoint is not None
+
+    session.expire_all()
+    versions = {ecg.id: session.get(ECGInsight, ecg.id).version for ecg in ecgs}
+    assert all(version == 1 for ecg_id, version in versions.items() if ecg_id > job.checkpoint)
+    assert list(versions.values()).count(1) >= 2
+
+    # Starting again resumes the cancelled job after its checkpoint
+    monkeypatch.setattr("ecg.reanalysis._write_batch", write_batch)
+    locker = lock_reanalysis()
+    assert start_reanalysis(session, max_rate=0).id == job.id
+    run_reanalysis(job.id, locker, workers=1, batch_size=1)
+    session.refresh(job)
+    assert job.status == JobStatus.DONE and job.processed == job.total
+
+    session.expire_all()
+    assert all(session.get(ECGInsight, ecg.id).version == INSIGHTS_VERSION for ecg in ecgs)
+
+
+def test_ready_after_warm_up():
+    with TestClient(app) as client:
+        for _ in range(100):
+            if client.get("/ready").status_code == status.HTTP_200_OK:
+                break
+            time.sleep(0.05)
+        assert client.get("/ready").json() == {"message": "Ready"}
@@ -12,7 +12,11 @@ if [[ "$ACTION" == "up" ]]; then
     # Apply the PostgreSQL Deployment
     kubectl apply -f postgres-deployment.yml
 
-    # Apply the Backend Deployment
+    # Run the one-shot schema and admin bootstrap again for this release
+    kubectl delete job backend-init --ignore-not-found
+    kubectl apply -f backend-init-job.yml
+
+    # Apply the Backend Deployment, whose replicas wait for the bootstrap
     kubectl apply -f backend-deployment.yml
 
     # Apply the Backend Horizontal Pod Autoscaler (HPA)
@@ -22,6 +26,6 @@ if [[ "$ACTION" == "up" ]]; then
 
 elif [[ "$ACTION" == "down" ]]; then
     echo "Tearing down deployment..."
-    kubectl delete -f .
+    kubectl delete -f . --ignore-not-found
 fi
 